@@ -114,17 +114,17 @@ class TerminalChat:
         print(f"{Colors.BRIGHT_GREEN}│{Colors.RESET} {message}")
         print(f"{Colors.BRIGHT_GREEN}└─{Colors.RESET}")
     
-    def print_ai_message(self, message):
+    def print_ai_message(self, stream):
         timestamp = datetime.now().strftime("%H:%M")
         print(f"\n{Colors.BRIGHT_BLUE}┌─ AI Assistant {Colors.DIM}({timestamp}){Colors.RESET}")
         
-        # Simulate typing effect
+        # Print deltas as the model produces them
         print(f"{Colors.BRIGHT_BLUE}│{Colors.RESET} ", end="", flush=True)
-        for char in message:
-            print(char, end="", flush=True)
-            time.sleep(0.02)  # Adjust speed as needed
+        for chunk in stream:
+            print(chunk.text, end="", flush=True)
         
         print(f"\n{Colors.BRIGHT_BLUE}└─{Colors.RESET}")
+        return stream.response.text
     
     def get_user_input(self):
         prompt = f"\n{Colors.BRIGHT_YELLOW}▶ {Colors.BRIGHT_WHITE}"
@@ -190,13 +190,10 @@ class TerminalChat:
             # Display user message
             self.print_user_message(user_input)
             
-            # Show AI thinking
-            self.simulate_ai_thinking()
-            
-            # Get and display AI response
+            # Get and display AI response (streamed token by token)
             #ai_response = self.get_ai_response(user_input)
-            ai_response = client.text_generation(user_input, max_new_tokens=max_new_tokens)
-            self.print_ai_message(ai_response)
+            stream = client.text_generation(user_input, stream=True, max_new_tokens=max_new_tokens)
+            ai_response = self.print_ai_message(stream)
             
             # Store in history
             self.chat_history.append({
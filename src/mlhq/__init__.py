@@ -1,8 +1,9 @@
-from .client import Client, ClientConfig
-from .types import MLHQResponse
+from .client import Client, AsyncClient, ClientConfig
+from .types import MLHQResponse, MLHQStream, MLHQStreamChunk
 from .logging_config import setup_logging, get_logger
 
-__all__ = ["Client", "ClientConfig", "MLHQResponse", "__version__", "hello", 'setup_logging', 'get_logger']
+__all__ = ["Client", "AsyncClient", "ClientConfig", "MLHQResponse", "MLHQStream",
+           "MLHQStreamChunk", "__version__", "hello", 'setup_logging', 'get_logger']
 
 __version__ = "0.1.0"
 
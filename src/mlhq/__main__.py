@@ -1,24 +1,279 @@
-# Allows: python -m mlhq [--version]
-from .core import get_version
+# Allows: python -m mlhq [--version] | bench ... | stub ... | serve ... | batch run ...
 import argparse
+import asyncio
+import json
+import sys
+import time
 # src/mlhq/__main__.py
 from . import __version__
-from .client import Client
 
 
 # ============================================================================:
-def __handle_cli_args():
-    parser = argparse.ArgumentParser(prog="mlhq", description="MLHQ sample CLI")
+def __add_bench_args(sub):
+    p = sub.add_parser("bench", help="load-test a backend and report latency/throughput as JSON")
+    p.add_argument("-b", "--backend", default="openai")
+    p.add_argument("-m", "--model", default=None)
+    p.add_argument("--base-url", default=None)
+    p.add_argument("--api-key", default=None)
+    p.add_argument("-c", "--config", default=None, help="MLHQ Client Config file")
+    p.add_argument("--api", choices=["chat", "responses", "text"], default="chat")
+    p.add_argument("--prompt", default=None)
+    p.add_argument("--max-tokens", type=int, default=64)
+    p.add_argument("--no-stream", dest="stream", action="store_false",
+                   help="measure whole-request latency only (no TTFT/ITL)")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--rate", type=float, default=None, help="open-loop requests/s")
+    p.add_argument("--duration", type=float, default=None, help="stop after N seconds")
+    p.add_argument("--warmup", type=int, default=0)
+    p.add_argument("--stub", action="store_true",
+                   help="start a local OpenAI-compatible stub server and bench against it")
+    p.add_argument("--stub-latency", type=float, default=0.05)
+    p.add_argument("--stub-tokens-per-s", type=float, default=100.0)
+    p.add_argument("--mode", default=None,
+                   help="hflocal acceleration mode, e.g. bf16, int8, bf16+compile")
+    p.add_argument("--compare-modes", default=None,
+                   help="comma-separated hflocal modes to benchmark one after another")
+    p.add_argument("--draft-model", default=None,
+                   help="hflocal: draft model for assisted (speculative) decoding")
+    p.add_argument("--logging-overhead", action="store_true",
+                   help="measure the per-call cost of mlhq's logging setups and exit")
+    p.add_argument("-o", "--output", default=None, help="also write the JSON report here")
+
+
+def __add_stub_args(sub):
+    p = sub.add_parser("stub", help="run the OpenAI-compatible stub server")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--tokens-per-s", type=float, default=100.0)
+    p.add_argument("--output-tokens", type=int, default=32)
+
+
+def __add_serve_args(sub):
+    p = sub.add_parser("serve", help="serve a local model over the OpenAI HTTP API")
+    p.add_argument("-m", "--model", default=None)
+    p.add_argument("-b", "--backend", default="hflocal", help="hflocal or hflocal-pool")
+    p.add_argument("-c", "--config", default=None, help="MLHQ Client Config file")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--served-model-name", default=None,
+                   help="model id reported to clients (default: --model)")
+    p.add_argument("--max-queue", type=int, default=64,
+                   help="queued requests before new ones get 429")
+    p.add_argument("--concurrency", type=int, default=1,
+                   help="requests (or batches) generating at once")
+    p.add_argument("--max-batch", type=int, default=8,
+                   help="queued requests merged into one batched generate call")
+    p.add_argument("--continuous-batching", action="store_true")
+    p.add_argument("--mode", default=None,
+                   help="hflocal acceleration mode, e.g. bf16, int8, bf16+compile")
+    p.add_argument("--draft-model", default=None,
+                   help="hflocal: draft model for assisted (speculative) decoding")
+    p.add_argument("--snapshot-dir", default=None,
+                   help="persist converted/quantized weights here; later starts map them")
+    p.add_argument("--kv-memory-budget", type=int, default=None, metavar="BYTES",
+                   help="hflocal: KV cache + activation bytes admitted at once")
+    p.add_argument("--kv-budget-policy", default="queue", choices=["queue", "reject"],
+                   help="over the KV budget: wait for memory, or answer 503")
+    p.add_argument("--warmup", nargs="?", const=True, default=False, metavar="PROMPT",
+                   help="run one generation before accepting requests")
+
+
+def __add_batch_args(sub):
+    p = sub.add_parser("batch", help="bulk JSONL jobs")
+    batch_sub = p.add_subparsers(dest="batch_command")
+    run = batch_sub.add_parser("run", help="run every request in a JSONL file (resumable)")
+    run.add_argument("input")
+    run.add_argument("output")
+    run.add_argument("-b", "--backend", default="openai")
+    run.add_argument("-m", "--model", default=None)
+    run.add_argument("--base-url", default=None)
+    run.add_argument("--api-key", default=None)
+    run.add_argument("-c", "--config", default=None, help="MLHQ Client Config file")
+    run.add_argument("--method", choices=["chat.completions", "responses", "text_generation"],
+                     default="chat.completions", help="for rows that don't name one")
+    run.add_argument("--concurrency", type=int, default=None)
+    run.add_argument("--batch-size", type=int, default=None,
+                     help="rows per batched generate call (hflocal)")
+    run.add_argument("--no-resume", dest="resume", action="store_false",
+                     help="overwrite the output instead of skipping finished rows")
+    run.add_argument("--keep-errors", dest="retry_errors", action="store_false",
+                     help="on resume, don't re-run rows that failed")
+    run.add_argument("--progress-interval", type=float, default=5.0)
+
+
+def __handle_cli_args(argv=None):
+    parser = argparse.ArgumentParser(prog="mlhq", description="MLHQ command line")
     parser.add_argument("--version", action="store_true", help="print version and exit")
-    args = parser.parse_args()
-    return args 
+    sub = parser.add_subparsers(dest="command")
+    __add_bench_args(sub)
+    __add_stub_args(sub)
+    __add_serve_args(sub)
+    __add_batch_args(sub)
+    args = parser.parse_args(argv)
+    if not args.version and args.command is None:
+        parser.print_help()
+    return args
 # ============================================================================:
-def main(args):
+def _bench(args):
+    from .bench import DEFAULT_PROMPT, compare_modes, logging_overhead, parse_mode, run_bench
+    from .client import Client
+
+    if args.logging_overhead:
+        _print_report(logging_overhead(), args.output)
+        return
+    if args.compare_modes:
+        report = compare_modes(
+            args.model,
+            args.compare_modes.split(","),
+            api=args.api,
+            prompt=args.prompt or DEFAULT_PROMPT,
+            max_tokens=args.max_tokens,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=max(args.warmup, 1),
+        )
+        _print_report(report, args.output)
+        return
+
+    stub = None
+    base_url = args.base_url
+    if args.stub:
+        from .stub_server import StubServer
+        stub = StubServer(latency=args.stub_latency, tokens_per_s=args.stub_tokens_per_s).start()
+        base_url = stub.url
+    try:
+        start = time.perf_counter()
+        if args.config:
+            client = Client(config=args.config)
+        else:
+            mode = parse_mode(args.mode) if args.mode else {}
+            client = Client(backend=args.backend, model=args.model, base_url=base_url,
+                            api_key=args.api_key, draft_model=args.draft_model, **mode)
+        load_s = time.perf_counter() - start
+        report = run_bench(
+            client,
+            api=args.api,
+            model=args.model or ("stub" if args.stub else None),
+            prompt=args.prompt or DEFAULT_PROMPT,
+            max_tokens=args.max_tokens,
+            stream=args.stream,
+            concurrency=args.concurrency,
+            requests=args.requests,
+            rate=args.rate,
+            duration=args.duration,
+            warmup=args.warmup,
+        )
+    finally:
+        if stub is not None:
+            stub.stop()
+    if args.mode:
+        report["accel"] = args.mode
+    report["load_s"] = load_s
+    _print_report(report, args.output)
+
+
+def _print_report(report, output):
+    out = json.dumps(report, indent=2)
+    print(out)
+    if output:
+        with open(output, "w") as f:
+            f.write(out + "\n")
+
+
+def _batch(args):
+    from .batch import run_batch
+    from .client import Client
+
+    if args.batch_command != "run":
+        print("usage: mlhq batch run INPUT OUTPUT [options]", file=sys.stderr)
+        return
+    if args.config:
+        client = Client(config=args.config)
+    else:
+        client = Client(backend=args.backend, model=args.model, base_url=args.base_url,
+                        api_key=args.api_key)
+
+    def progress(stats):
+        print("\r{succeeded} ok  {failed} failed  {skipped} skipped  "
+              "{rows_per_s:.1f} rows/s  {tokens_per_s:.1f} tok/s".format(**stats),
+              end="", file=sys.stderr, flush=True)
+
+    with client:
+        stats = run_batch(
+            client, args.input, args.output,
+            method=args.method,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            resume=args.resume,
+            retry_errors=args.retry_errors,
+            progress_interval=args.progress_interval,
+            on_progress=progress,
+        )
+    print(file=sys.stderr)
+    print(json.dumps(stats, indent=2))
+
+
+def _stub(args):
+    from .stub_server import StubServer
+    server = StubServer(args.host, args.port, latency=args.latency,
+                        tokens_per_s=args.tokens_per_s, output_tokens=args.output_tokens)
+    print(f"mlhq stub server on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def _serve(args):
+    from .bench import parse_mode
+    from .client import Client
+    from .server import ModelServer
+
+    if args.config:
+        client = Client(config=args.config)
+    else:
+        if not args.model:
+            print("mlhq serve: --model (or -c CONFIG) is required", file=sys.stderr)
+            sys.exit(2)
+        mode = parse_mode(args.mode) if args.mode else {}
+        client = Client(backend=args.backend, model=args.model,
+                        continuous_batching=args.continuous_batching,
+                        draft_model=args.draft_model, snapshot_dir=args.snapshot_dir,
+                        kv_memory_budget=args.kv_memory_budget,
+                        kv_budget_policy=args.kv_budget_policy,
+                        warmup=args.warmup, **mode)
+    server = ModelServer(client, args.host, args.port, model_name=args.served_model_name,
+                         max_queue=args.max_queue, concurrency=args.concurrency,
+                         max_batch=args.max_batch)
+    startup = getattr(client._backend, "startup_timings", None)
+    if startup:
+        print("startup: " + ", ".join(f"{k}={v:.2f}s" for k, v in startup.items()),
+              file=sys.stderr)
+    print(f"mlhq serving {server.model_name} on http://{args.host}:{args.port}/v1",
+          file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    args = __handle_cli_args(argv)
     if args.version:
         print(f"mlhq {__version__}")
-
-    print(f"DEBUG: Test-Client: {Client().ping()}")
+        return
+    if args.command == "bench":
+        _bench(args)
+    elif args.command == "stub":
+        _stub(args)
+    elif args.command == "serve":
+        _serve(args)
+    elif args.command == "batch":
+        _batch(args)
 # ============================================================================:
 if __name__ == "__main__":
-    args = __handle_cli_args()
-    main(args)
+    main()
@@ -0,0 +1,201 @@
+"""
+Minimal asyncio HTTP/1.1 server used by the bench stub and `mlhq serve`.
+
+Only what an OpenAI-compatible endpoint needs: keep-alive, Content-Length
+request bodies, JSON responses and chunked Server-Sent-Events streams.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Union
+from dataclasses import dataclass, field
+import asyncio
+import json
+import threading
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes = b""
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"{}")
+
+
+@dataclass
+class Response:
+    status: int = 200
+    body: Any = None  # dict/list -> JSON, bytes/str sent as-is
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class EventStream:
+    """SSE response; each yielded item is sent as one ``data:`` event."""
+    events: AsyncIterator[Union[str, Dict[str, Any]]]
+    status: int = 200
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[Request], Awaitable[Union[Response, EventStream]]]
+
+
+def json_error(status: int, message: str, type_: str = "invalid_request_error") -> Response:
+    return Response(status, {"error": {"message": message, "type": type_}})
+
+
+async def _write_head(writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]) -> None:
+    head = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Unknown')}"]
+    head += [f"{k}: {v}" for k, v in headers.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+
+
+async def _send(writer: asyncio.StreamWriter, resp: Union[Response, EventStream],
+                keep_alive: bool) -> None:
+    conn = "keep-alive" if keep_alive else "close"
+    if isinstance(resp, EventStream):
+        headers = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                   "Transfer-Encoding": "chunked", "Connection": conn, **resp.headers}
+        await _write_head(writer, resp.status, headers)
+        async for event in resp.events:
+            data = event if isinstance(event, str) else json.dumps(event)
+            payload = f"data: {data}\n\n".encode()
+            writer.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+    else:
+        body = resp.body
+        ctype = "application/json"
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body, ctype = body.encode(), "text/plain; charset=utf-8"
+        body = body or b""
+        headers = {"Content-Type": ctype, "Content-Length": str(len(body)), "Connection": conn,
+                   **resp.headers}
+        await _write_head(writer, resp.status, headers)
+        writer.write(body)
+    await writer.drain()
+
+
+async def _serve_connection(handler: Handler, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                method, target, version = line.decode("latin-1").split()
+            except ValueError:
+                await _send(writer, json_error(400, "malformed request line"), False)
+                break
+            headers: Dict[str, str] = {}
+            while True:
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            body = await reader.readexactly(int(headers.get("content-length") or 0))
+            keep_alive = (headers.get("connection", "").lower() != "close"
+                          and version == "HTTP/1.1")
+            request = Request(method.upper(), target.split("?", 1)[0], headers, body)
+            try:
+                resp = await handler(request)
+            except Exception as e:
+                logger.exception("handler failed for %s %s", method, target)
+                resp = json_error(500, str(e), "server_error")
+            await _send(writer, resp, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+class HTTPServer:
+    """Serve `handler` either on the current event loop (`serve_forever`) or on
+    a private loop in a background thread (`start` / `stop`, for tests & bench)."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._tasks: set = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def _on_connection(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await _serve_connection(self.handler, reader, writer)
+        except asyncio.CancelledError:
+            pass  # stop(); asyncio's stream callback chokes on a cancelled task
+        finally:
+            self._tasks.discard(task)
+
+    async def _start_server(self) -> None:
+        self._server = await asyncio.start_server(
+            self._on_connection, self.host, self.port, backlog=4096
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self._start_server()
+        logger.info("Listening on %s", self.url)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start(self) -> "HTTPServer":
+        ready = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start_server())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="mlhq-http", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+
+        async def shutdown() -> None:
+            self._server.close()
+            # idle keep-alive connections and requests still in flight
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+
+    def __enter__(self) -> "HTTPServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
@@ -0,0 +1,5 @@
+# NOTE: keep this module free of heavy imports (torch, transformers, openai);
+# concrete backends are imported lazily through the registry.
+from .registry import register_backend, get_backend, available_backends
+
+__all__ = ["register_backend", "get_backend", "available_backends"]
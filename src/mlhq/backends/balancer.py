@@ -0,0 +1,313 @@
+"""
+Client-side load balancing across OpenAI-compatible replicas.
+
+`LoadBalancer` picks an endpoint per call (least outstanding requests by
+default, or any callable policy), tracks per-endpoint latency and errors,
+and passively ejects replicas that keep failing: after `max_failures`
+consecutive retryable errors (connection errors, 429, 5xx) an endpoint is
+taken out of rotation for `ejection_s` seconds, doubling on each repeat
+ejection. When it comes back, one success restores it fully.
+
+`BalancedOpenAI` / `BalancedAsyncOpenAI` put that in front of one SDK
+client per endpoint, exposing the ``responses.create``,
+``chat.completions.create`` and ``embeddings.create`` surface the OpenAI
+backend calls.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Union
+from collections import deque
+import itertools
+import random
+import threading
+import time
+
+from ..metrics import percentile
+from ..ratelimit import is_retryable
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+class Endpoint:
+    """One replica plus its live counters (mutated under the balancer's lock)."""
+
+    def __init__(self, url: str, client: Any = None, window: int = 256) -> None:
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        # ejections since the last success: sets the next ejection's length
+        self.ejection_streak = 0
+        self.ejected_until = 0.0
+        self.ewma: Optional[float] = None  # seconds
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def stats(self) -> Dict[str, Any]:
+        window = list(self.latencies)
+        return {
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejected": not self.available(time.monotonic()),
+            "ejections": self.ejections,
+            "latency_ewma_s": self.ewma,
+            "latency_p50_s": percentile(window, 50) if window else None,
+            "latency_p95_s": percentile(window, 95) if window else None,
+        }
+
+    def __repr__(self) -> str:
+        return f"<Endpoint {self.url} outstanding={self.outstanding}>"
+
+
+Policy = Callable[[List[Endpoint]], Endpoint]
+
+
+def least_outstanding(endpoints: List[Endpoint]) -> Endpoint:
+    """Fewest in-flight requests; ties go to recent health, then lower latency."""
+    return min(endpoints, key=lambda e: (e.outstanding, e.consecutive_failures, e.ewma or 0.0))
+
+
+def power_of_two(endpoints: List[Endpoint]) -> Endpoint:
+    """Least outstanding of two random candidates (cheap, avoids herding)."""
+    if len(endpoints) < 2:
+        return endpoints[0]
+    return least_outstanding(random.sample(endpoints, 2))
+
+
+def _round_robin() -> Policy:
+    counter = itertools.count()
+
+    def pick(endpoints: List[Endpoint]) -> Endpoint:
+        return endpoints[next(counter) % len(endpoints)]
+    return pick
+
+
+POLICIES: Dict[str, Callable[[], Policy]] = {
+    "least_outstanding": lambda: least_outstanding,
+    "power_of_two": lambda: power_of_two,
+    "round_robin": _round_robin,
+}
+
+
+class LoadBalancer:
+    def __init__(self, endpoints: Sequence[Endpoint], *,
+                 policy: Union[str, Policy] = "least_outstanding", max_failures: int = 3,
+                 ejection_s: float = 30.0, max_ejection_s: float = 300.0,
+                 ewma_alpha: float = 0.2) -> None:
+        if not endpoints:
+            raise ValueError("LoadBalancer needs at least one endpoint")
+        if isinstance(policy, str):
+            if policy not in POLICIES:
+                raise ValueError(f"Unknown balancing policy {policy!r}; "
+                                 f"choose from {sorted(POLICIES)} or pass a callable")
+            policy = POLICIES[policy]()
+        self.endpoints = list(endpoints)
+        self.policy = policy
+        self.max_failures = max_failures
+        self.ejection_s = ejection_s
+        self.max_ejection_s = max_ejection_s
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Endpoint:
+        """Pick an endpoint and count the request as outstanding on it."""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [e for e in self.endpoints if e.available(now)]
+            if healthy:
+                endpoint = self.policy(healthy)
+            else:  # everything ejected: try the one due back first
+                endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: float,
+                error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is not None and is_retryable(error):
+                endpoint.errors += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures:
+                    self._eject(endpoint)
+                return
+            endpoint.consecutive_failures = 0
+            endpoint.ejection_streak = 0
+            endpoint.latencies.append(latency)
+            a = self.ewma_alpha
+            if endpoint.ewma is None:
+                endpoint.ewma = latency
+            else:
+                endpoint.ewma = a * latency + (1 - a) * endpoint.ewma
+
+    def _eject(self, endpoint: Endpoint) -> None:
+        duration = min(self.ejection_s * (2 ** endpoint.ejection_streak), self.max_ejection_s)
+        endpoint.ejections += 1
+        endpoint.ejection_streak += 1
+        # back after `duration` on probation: one more failure ejects it again
+        endpoint.consecutive_failures = self.max_failures - 1
+        endpoint.ejected_until = time.monotonic() + duration
+        logger.warning("Ejecting %s for %.1fs after repeated failures", endpoint.url, duration)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {e.url: e.stats() for e in self.endpoints}
+
+
+# ---------- OpenAI SDK fronts ----------
+
+class _BalancedMethod:
+    """``<surface>.create`` on whichever endpoint the balancer picks."""
+
+    def __init__(self, balancer: LoadBalancer, path: str) -> None:
+        self._balancer = balancer
+        self._path = path.split(".")
+
+    def _target(self, endpoint: Endpoint) -> Any:
+        obj = endpoint.client
+        for name in self._path:
+            obj = getattr(obj, name)
+        return obj
+
+    def create(self, **kwargs: Any) -> Any:
+        endpoint = self._balancer.acquire()
+        start = time.perf_counter()
+        try:
+            result = self._target(endpoint).create(**kwargs)
+        except Exception as e:
+            self._balancer.release(endpoint, time.perf_counter() - start, e)
+            raise
+        if kwargs.get("stream"):
+            return self._track_stream(result, endpoint, start)
+        self._balancer.release(endpoint, time.perf_counter() - start)
+        return result
+
+    def _track_stream(self, stream: Any, endpoint: Endpoint, start: float) -> Any:
+        # the request stays outstanding until the stream is drained, closed or
+        # garbage-collected (even if it was never iterated)
+        return _TrackedStream(stream, self._balancer, endpoint, start)
+
+
+class _AsyncBalancedMethod(_BalancedMethod):
+    async def create(self, **kwargs: Any) -> Any:
+        endpoint = self._balancer.acquire()
+        start = time.perf_counter()
+        try:
+            result = await self._target(endpoint).create(**kwargs)
+        except Exception as e:
+            self._balancer.release(endpoint, time.perf_counter() - start, e)
+            raise
+        if kwargs.get("stream"):
+            return self._track_stream(result, endpoint, start)
+        self._balancer.release(endpoint, time.perf_counter() - start)
+        return result
+
+    def _track_stream(self, stream: Any, endpoint: Endpoint, start: float) -> Any:
+        return _AsyncTrackedStream(stream, self._balancer, endpoint, start)
+
+
+class _TrackedStream:
+    """An SDK stream that gives its endpoint's outstanding slot back exactly
+    once: when exhausted, on error, on ``close()`` or when collected."""
+
+    def __init__(self, stream: Any, balancer: LoadBalancer, endpoint: Endpoint,
+                 start: float) -> None:
+        self._stream = stream
+        self._it: Any = None
+        self._balancer = balancer
+        self._endpoint = endpoint
+        self._start = start
+        self._released = False
+
+    def _release(self, error: Optional[BaseException] = None) -> None:
+        if not self._released:
+            self._released = True
+            self._balancer.release(self._endpoint, time.perf_counter() - self._start, error)
+
+    def __iter__(self) -> "_TrackedStream":
+        return self
+
+    def __next__(self) -> Any:
+        if self._it is None:
+            self._it = iter(self._stream)
+        try:
+            return next(self._it)
+        except StopIteration:
+            self._release()
+            raise
+        except Exception as e:
+            self._release(e)
+            raise
+
+    def close(self) -> None:
+        self._release()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self) -> None:
+        self._release()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):  # not set yet (e.g. in __del__ after a failed init)
+            raise AttributeError(name)
+        return getattr(self._stream, name)
+
+
+class _AsyncTrackedStream(_TrackedStream):
+    def __aiter__(self) -> "_AsyncTrackedStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._it is None:
+            self._it = self._stream.__aiter__()
+        try:
+            return await self._it.__anext__()
+        except StopAsyncIteration:
+            self._release()
+            raise
+        except Exception as e:
+            self._release(e)
+            raise
+
+    async def aclose(self) -> None:
+        self._release()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            await close()
+
+
+class _Surface:
+    def __init__(self, **attrs: Any) -> None:
+        self.__dict__.update(attrs)
+
+
+class BalancedOpenAI:
+    """Duck-types the slice of `openai.OpenAI` the backend uses, over N replicas."""
+
+    _method_cls = _BalancedMethod
+
+    def __init__(self, clients: Dict[str, Any], **balancer_kwargs: Any) -> None:
+        self.balancer = LoadBalancer([Endpoint(url, c) for url, c in clients.items()],
+                                     **balancer_kwargs)
+        self.responses = self._method_cls(self.balancer, "responses")
+        self.chat = _Surface(completions=self._method_cls(self.balancer, "chat.completions"))
+        self.embeddings = self._method_cls(self.balancer, "embeddings")
+
+    def close(self) -> None:
+        for endpoint in self.balancer.endpoints:
+            endpoint.client.close()
+
+
+class BalancedAsyncOpenAI(BalancedOpenAI):
+    _method_cls = _AsyncBalancedMethod
+
+    async def close(self) -> None:
+        for endpoint in self.balancer.endpoints:
+            await endpoint.client.close()
@@ -1,12 +1,30 @@
 from __future__ import annotations                                                                                                        
 from typing import Any, Optional, Dict 
+import asyncio
+import contextvars
+import copy
+from contextlib import contextmanager
+import functools
+from concurrent.futures import ThreadPoolExecutor, wait
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteriaList
+import threading
+import queue
+import time
 
 
 
 
 from .base import Backend
+from .hf_scheduler import ContinuousBatchingScheduler, SUPPORTED_KWARGS
+from .hf_prefix_cache import PrefixCache
+from .hf_constrained import ConstrainedLogitsProcessor, constraint_pattern, token_index
+from .hf_detokenize import StopOnText, TextStream
+from .hf_memory import Footprint, MemoryBudget
+from .hf_models import default_device, get_model_registry
+from ..types import MLHQEmbeddings, MLHQResponse, MLHQStream, MLHQStreamChunk, MLHQAsyncStream
+from ..metrics import Timings, current_timings, phase, record, timed_request, untimed
+from ..cache import samples_by_default
 #from mlhq.logging_config import get_logger
 from mlhq.logging_config import get_logger
 
@@ -15,45 +33,792 @@ logger = get_logger(__name__)
 
 
 
-class HFLocalClient:                                                            
-    def __init__(self, model_name, api_key=""): 
+class HFLocalClient:
+    def __init__(self, model_name, api_key="", max_batch_size=8, max_batch_tokens=16384,
+                 continuous_batching=False, prefix_cache_max_bytes=0, model_memory_budget=None,
+                 torch_dtype=None, quantization=None, compile=False, draft_model=None,
+                 draft_tokens=None, embedding_model=None, embedding_pooling="mean",
+                 snapshot_dir=None, warmup=False, warmup_tokens=8, constraint_cache_dir=None,
+                 kv_memory_budget=None, kv_budget_policy="queue", kv_budget_timeout=None):
         logger.debug("Initializing HuggingFace backend")
-        #self.logger = logging.getLogger(f"{__name__}.HFLocalClient")            
+        #self.logger = logging.getLogger(f"{__name__}.HFLocalClient")
         #self.logger.info(f"Initializing HFLocalClient with model_name={model_name}")
         print(f"Initializing HFLocalClient with model_name={model_name}")
-        self.model_name = model_name                                            
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name,local_files_only=True) 
-        self.model = AutoModelForCausalLM.from_pretrained(model_name, local_files_only=True) 
-                                                                                
-        if torch.cuda.is_available():                                           
-            self.device = "cuda"                                                
-        elif getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
-            self.device = "mps"                                                 
-        else:                                                                   
-            self.device = "cpu"                                                 
-                                                                                
-        self.model = self.model.to(self.device)                                 
-        #self.logger.info(f"Using device={self.device}")       
-        print(f"Using device={self.device}")       
-
-    def text_generation(self, prompt, **kwargs):                                
-        if "stop" in kwargs:                                                    
-            kwargs["stop_strings"] = kwargs["stop"]                             
-            del kwargs["stop"]                                                  
-        logger.debug(f"Text-generation kwargs: {kwargs}")                   
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)    
-        #print(f"DEBUG: Tokenized Input: {inputs}")
-        gen_kwargs = {                                                          
-            "input_ids": inputs.input_ids,                                      
-            "attention_mask": inputs.attention_mask,                            
-            "tokenizer": self.tokenizer                                         
-        }                                                                       
-        kwargs.update(gen_kwargs)                                               
-        response = self.model.generate(**kwargs)                                
-        #self.logger.info(f"Incoming/Outgoing text: {self.tokenizer.decode(response[0])}")
-        return self.tokenizer.decode(response[0][inputs.input_ids.shape[1]:-1]) 
+        if draft_model is not None:
+            if draft_model == model_name:
+                raise ValueError("draft_model must be a different (smaller) model than model")
+            if continuous_batching:
+                raise ValueError("draft_model does not work with continuous_batching")
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.constraint_cache_dir = constraint_cache_dir
+        registry = get_model_registry()
+        if model_memory_budget is not None:
+            # process-wide: a client may loosen, never tighten, other
+            # clients' eviction (configure_model_registry sets it outright)
+            registry.raise_budget(model_memory_budget)
+        self.device = default_device()
+        # load phases (tokenizer, weights, quantize, snapshot, warmup, ...) in seconds
+        startup = Timings()
+        # shared with every other client that loads the same model/dtype/device
+        with timed_request(startup):
+            self._loaded = registry.acquire(model_name, dtype=torch_dtype, device=self.device,
+                                            quantization=quantization, compile=compile,
+                                            snapshot_dir=snapshot_dir)
+        self.tokenizer = self._loaded.tokenizer
+        self.model = self._loaded.model
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        #self.logger.info(f"Using device={self.device}")
+        print(f"Using device={self.device}")
+
+        eos = self.model.generation_config.eos_token_id
+        eos = eos if isinstance(eos, (list, tuple)) else [eos]
+        self._end_ids = {i for i in [*eos, self.tokenizer.eos_token_id] if i is not None}
+        # requests without do_sample/temperature follow the model's defaults
+        self.samples_by_default = samples_by_default(self.model.generation_config)
+
+        # prefix KV reuse across calls (0 disables)
+        self.prefix_cache = PrefixCache(prefix_cache_max_bytes) if prefix_cache_max_bytes else None
+
+        # assisted (speculative) decoding: the draft proposes tokens, the target
+        # verifies them in one forward pass, so greedy outputs are unchanged
+        self._draft = None
+        self._assistant = None
+        if draft_model is not None:
+            with timed_request(startup):
+                self._draft = registry.acquire(draft_model, dtype=torch_dtype,
+                                               device=self.device, snapshot_dir=snapshot_dir)
+            _count_forwards(self.model)
+            _count_forwards(self._draft.model)
+            # generate() reads the speculation length off the assistant's own
+            # generation config (not its kwargs), and the draft is shared across
+            # clients: give this client a view of it (same weights and hooks)
+            # with a private generation config
+            self._assistant = copy.copy(self._draft.model)
+            self._assistant.generation_config = copy.deepcopy(
+                self._draft.model.generation_config)
+            if draft_tokens is not None:
+                self._assistant.generation_config.num_assistant_tokens = draft_tokens
+            # different vocabularies need universal assisted decoding (text
+            # round-trips); compared once here, not on every generate()
+            self._draft_vocab_match = (self._draft.tokenizer.get_vocab()
+                                       == self.tokenizer.get_vocab())
+
+        # embeddings: a dedicated AutoModel loaded on first use, or else the
+        # hidden states of the generation model's base (no LM head)
+        self._embedding_model = embedding_model
+        self._embedder = None
+        self.embedding_pooling = embedding_pooling
+        self._embed_lock = threading.Lock()
+        self._torch_dtype = torch_dtype
+
+        # admission control: every generate() reserves its estimated KV cache
+        # and activation bytes against kv_memory_budget (None disables)
+        self.memory_budget = None
+        if kv_memory_budget is not None:
+            self.memory_budget = MemoryBudget(kv_memory_budget, kv_budget_policy,
+                                              kv_budget_timeout)
+            self._footprint = Footprint(self.model)
+            self._draft_footprint = (Footprint(self._draft.model)
+                                     if self._draft is not None else None)
+
+        self._scheduler = None
+        if continuous_batching:
+            self._scheduler = ContinuousBatchingScheduler(
+                self.model,
+                eos_token_ids=self._end_ids,
+                pad_token_id=self.tokenizer.pad_token_id,
+                max_batch_size=max_batch_size,
+                device=self.device,
+            )
+
+        if warmup:
+            # first forward passes pay for lazy init (allocator, kernels,
+            # torch.compile); pay it here rather than on the first request
+            prompt = warmup if isinstance(warmup, str) else "Hello"
+            with timed_request(startup), phase("warmup"), untimed():
+                self.text_generation(prompt, max_new_tokens=warmup_tokens, do_sample=False)
+        self.startup_timings = {**startup.phases, "total": time.perf_counter() - startup.start}
+        logger.info("hflocal %s ready in %.2fs (%s)", model_name, self.startup_timings["total"],
+                    ", ".join(f"{k}={v:.2f}s" for k, v in startup.phases.items()))
+
+    def _plan_batches(self, lengths, max_new_tokens, budgeted=True):
+        """
+        Bucket prompt indices by token length so each padded batch wastes as
+        little as possible. A batch is capped both by ``max_batch_size`` rows
+        and by ``max_batch_tokens`` (rows * (longest prompt + new tokens)),
+        and for generation (`budgeted`) with a memory budget, by what its
+        estimated footprint allows.
+        """
+        limit = self._budget_bytes() if budgeted else float("inf")
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches, batch = [], []
+        for i in order:
+            rows = len(batch) + 1
+            # sorted ascending, so prompt i is the longest in the batch
+            cost = rows * (lengths[i] + max_new_tokens)
+            if batch and (rows > self.max_batch_size or cost > self.max_batch_tokens
+                          or (budgeted and self._footprint_of(rows, lengths[i],
+                                                              max_new_tokens) > limit)):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    # ---------- memory budget ----------
+
+    def _budget_bytes(self):
+        return self.memory_budget.budget if self.memory_budget is not None else float("inf")
+
+    def _max_new_tokens(self, kwargs, prompt_tokens):
+        """max_new_tokens of a call, with generate()'s defaults."""
+        gc = self.model.generation_config
+        # `is None`, not `or`: an explicit max_new_tokens=0 is a real value
+        max_new_tokens = kwargs.get("max_new_tokens")
+        if max_new_tokens is None:
+            max_new_tokens = gc.max_new_tokens
+        if max_new_tokens is None:
+            max_new_tokens = max(gc.max_length - prompt_tokens, 1)
+        return max_new_tokens
+
+    def _footprint_of(self, rows, prompt_tokens, max_new_tokens):
+        """Estimated peak bytes of one generate() call (0 without a budget)."""
+        if self.memory_budget is None:
+            return 0
+        nbytes = self._footprint.estimate(rows, prompt_tokens, max_new_tokens)
+        if self._draft_footprint is not None:
+            nbytes += self._draft_footprint.estimate(rows, prompt_tokens, max_new_tokens)
+        return nbytes
+
+    def _check_budget(self, calls, kwargs):
+        """Fail a multi-part call up front if any of its generate() calls,
+        given as (rows, prompt tokens), could never fit in the budget."""
+        if self.memory_budget is None:
+            return
+        for rows, prompt_tokens in calls:
+            self.memory_budget.check(self._footprint_of(
+                rows, prompt_tokens, self._max_new_tokens(kwargs, prompt_tokens)))
+
+    def _reserve(self, rows, prompt_tokens, kwargs):
+        """Reserve a call's footprint (queueing or raising per the budget
+        policy); returns the bytes to hand back to `_release`."""
+        if self.memory_budget is None:
+            return 0
+        return self.memory_budget.acquire(
+            self._footprint_of(rows, prompt_tokens, self._max_new_tokens(kwargs, prompt_tokens)))
+
+    def _release(self, nbytes):
+        if self.memory_budget is not None:
+            self.memory_budget.release(nbytes)
+
+    def _finish(self, row):
+        """Generated ids for one row, cut at the first end-of-sequence token,
+        plus the OpenAI-style finish reason."""
+        ids = row.tolist()
+        for pos, tok in enumerate(ids):
+            if tok in self._end_ids:
+                return ids[:pos], "stop"
+        return ids, "length"
+
+    def _prepare(self, kwargs):
+        pattern = constraint_pattern(kwargs)
+        if pattern is not None:
+            # built once per (pattern, tokenizer); a fresh processor per generate()
+            kwargs["constraint"] = token_index(pattern, self.tokenizer, self.constraint_cache_dir)
+        # stop sequences are matched on our own incremental detokenization
+        # (StopOnText), not generate()'s stop_strings
+        stop = _stop_list(kwargs.pop("stop", None))
+        logger.debug("Text-generation kwargs: %s", kwargs)
+        kwargs.setdefault("pad_token_id", self.tokenizer.pad_token_id)
+        if self._draft is not None:
+            kwargs["assistant_model"] = self._assistant
+            if not self._draft_vocab_match:
+                kwargs["tokenizer"] = self.tokenizer
+                kwargs["assistant_tokenizer"] = self._draft.tokenizer
+        return stop
+
+    def _stop_criteria(self, kwargs, streams, start, on_text=None, cancel=None):
+        """generate() kwargs with a StopOnText over `streams` appended."""
+        criteria = StopOnText(streams, start, on_text, cancel)
+        kwargs = dict(kwargs)
+        kwargs["stopping_criteria"] = StoppingCriteriaList(
+            [*(kwargs.get("stopping_criteria") or []), criteria]
+        )
+        return kwargs, criteria
+
+    def _run_generate(self, input_ids, attention_mask, **kwargs):
+        """
+        model.generate() that reuses/stores prefix KV state for single-row
+        calls when the prefix cache is enabled; returns the output ids.
+
+        When the call is being timed, generate() is split into prefill (up to
+        the first logits) and decode (the rest, minus any streamer decoding).
+        """
+        index = kwargs.pop("constraint", None)
+        if index is not None:
+            kwargs["logits_processor"] = LogitsProcessorList([
+                *(kwargs.get("logits_processor") or []),
+                ConstrainedLogitsProcessor(index, self._end_ids),
+            ])
+            try:
+                return self._run_generate(input_ids, attention_mask, **kwargs)
+            finally:
+                index.save()
+        timings = current_timings()
+        if timings is None:
+            return self._generate_ids(input_ids, attention_mask, **kwargs)
+        clock = _PrefillClock()
+        kwargs["logits_processor"] = LogitsProcessorList(
+            [*(kwargs.get("logits_processor") or []), clock]
+        )
+        detokenize = timings.get("detokenize")
+        start = time.perf_counter()
+        out = self._generate_ids(input_ids, attention_mask, **kwargs)
+        end = time.perf_counter()
+        first = clock.first or end
+        timings.add("prefill", first - start)
+        timings.add("decode", max(end - first - (timings.get("detokenize") - detokenize), 0.0))
+        return out
+
+    @torch.inference_mode()
+    def _generate_ids(self, input_ids, attention_mask, **kwargs):
+        # inference_mode (not just generate()'s no_grad) skips version
+        # counting and view tracking on every tensor op
+        if self.prefix_cache is None or input_ids.shape[0] != 1 or "assistant_model" in kwargs:
+            out = self.model.generate(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+            # callers may ask for return_dict_in_generate; we only need the ids
+            return getattr(out, "sequences", out)
+        matched, past = self.prefix_cache.lookup(input_ids[0].tolist())
+        logger.debug("Prefix cache: reused %d/%d prompt tokens", matched, input_ids.shape[1])
+        # merged, so a caller passing the same generate() kwargs is overridden
+        # rather than a "multiple values for keyword argument" TypeError
+        out = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            **{**kwargs, "past_key_values": past, "return_dict_in_generate": True},
+        )
+        self.prefix_cache.store(out.sequences[0].tolist(), out.past_key_values)
+        return out.sequences
+
+    def _generate(self, encoded, **kwargs):
+        """Run generate() over pre-tokenized prompts in padded, length-bucketed
+        batches. Returns one result dict per prompt, in input order."""
+        if not encoded:
+            return []
+        if self._schedulable(kwargs):
+            return self._generate_scheduled(encoded, **kwargs)
+        stop = self._prepare(kwargs)
+        # with generate()'s default when unset (an upper bound over the prompts
+        # if it derives from max_length), so the max_batch_tokens cost holds
+        max_new_tokens = self._max_new_tokens(kwargs, min(len(ids) for ids in encoded))
+        results = [None] * len(encoded)
+        if self._draft is not None:  # assisted generate() is single-row only
+            batches = [[i] for i in range(len(encoded))]
+        else:
+            batches = self._plan_batches([len(ids) for ids in encoded], max_new_tokens)
+        self._check_budget([(len(b), max(len(encoded[i]) for i in b)) for b in batches], kwargs)
+        for batch in batches:
+            inputs = self.tokenizer.pad(
+                {"input_ids": [encoded[i] for i in batch]},
+                padding=True,
+                padding_side="left",
+                return_tensors="pt",
+            ).to(self.device)
+            width = inputs.input_ids.shape[1]
+            call_kwargs, criteria = kwargs, None
+            if stop:
+                # rows are detokenized as they grow so a stop sequence ends them
+                streams = [TextStream(self.tokenizer, stop, self._end_ids) for _ in batch]
+                call_kwargs, criteria = self._stop_criteria(kwargs, streams, width)
+            reserved = self._reserve(len(batch), width, kwargs)
+            try:
+                with _speculating(self.model, self._assistant) as spec:
+                    response = self._run_generate(inputs.input_ids, inputs.attention_mask,
+                                                  **call_kwargs)
+            finally:
+                self._release(reserved)
+            new_tokens = response[:, width:]
+            texts = criteria.finish() if criteria is not None else None
+            for k, (i, row) in enumerate(zip(batch, new_tokens)):
+                ids, finish_reason = self._finish(row)
+                if texts is not None:
+                    text, hit = texts[k]
+                else:
+                    with phase("detokenize"):
+                        text, hit = self.tokenizer.decode(ids, skip_special_tokens=True), False
+                results[i] = {
+                    "text": text,
+                    "finish_reason": "stop" if hit else finish_reason,
+                    "usage": _usage(len(encoded[i]), len(ids)),
+                }
+                if spec is not None:
+                    results[i]["speculative"] = spec.stats(len(row))
+        return results
+
+    def _stream(self, input_ids, **kwargs):
+        """
+        Run generate() for one prompt on a background thread and return an
+        MLHQStream of text deltas as tokens are decoded. Text that could be
+        the start of a stop sequence is held back until it is disambiguated.
+        """
+        if self._schedulable(kwargs):
+            return self._stream_scheduled(input_ids, **kwargs)
+        stop = self._prepare(kwargs)
+        stream = TextStream(self.tokenizer, stop, self._end_ids)
+        deltas = queue.Queue()
+        cancel = threading.Event()
+        kwargs, _ = self._stop_criteria(kwargs, [stream], len(input_ids),
+                                        on_text=lambda _, text: deltas.put(text), cancel=cancel)
+        inputs = torch.tensor([input_ids], device=self.device)
+        result = {}
+        reserved = self._reserve(1, len(input_ids), kwargs)
+
+        def run():
+            try:
+                with _speculating(self.model, self._assistant) as spec:
+                    result["output"] = self._run_generate(inputs, torch.ones_like(inputs),
+                                                          **kwargs)
+                result["speculative"] = spec
+            except BaseException as e:  # surfaced to the consumer below
+                result["error"] = e
+            finally:
+                self._release(reserved)
+                deltas.put(None)
+
+        # the copied context carries the caller's timings into the generate thread
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(run,),
+                                  name="mlhq-hflocal-stream", daemon=True)
+        thread.start()
+
+        def finalize():
+            thread.join()
+            if "error" in result:
+                raise result["error"]
+            row = result["output"][0, inputs.shape[1]:]
+            spec = result["speculative"]
+            meta = {"speculative": spec.stats(len(row))} if spec is not None else None
+            return (*self._finish(row), meta)
+
+        def abort():
+            # stops generate() at its next step; its reservation is released
+            # by the time the thread is done
+            cancel.set()
+            thread.join()
+
+        return self._stream_response(iter(deltas.get, None), finalize, stream, len(input_ids),
+                                     abort)
+
+    def _stream_response(self, deltas, finalize, stream, prompt_tokens, abort):
+        """Wrap an iterator of text deltas (already cut at stop sequences by
+        `stream`, a TextStream) into an MLHQStream; `finalize` returns
+        (completion ids, finish_reason[, raw metadata]) once generation is
+        done; the metadata becomes the final chunk's ``raw``. `abort` cancels
+        the generation and waits for it to stop: on close(), or when the
+        stream is dropped before it is drained."""
+        def chunks():
+            try:
+                for delta in deltas:
+                    yield MLHQStreamChunk(text=delta, model=self.model_name, provider="hflocal")
+                ids, finish_reason, *meta = finalize()
+                rest = stream.finish()
+                yield MLHQStreamChunk(
+                    text=rest,
+                    raw=meta[0] if meta else None,
+                    model=self.model_name,
+                    provider="hflocal",
+                    finish_reason="stop" if stream.hit else finish_reason,
+                    usage=_usage(prompt_tokens, len(ids)),
+                )
+            finally:  # GeneratorExit when abandoned; a no-op once finished
+                abort()
+
+        return MLHQStream(chunks(), model=self.model_name, provider="hflocal", on_close=abort)
+
+    # ---------- continuous batching ----------
+
+    def _schedulable(self, kwargs):
+        return self._scheduler is not None and set(kwargs) <= _SCHEDULED_KWARGS
+
+    def _submit(self, input_ids, kwargs, on_text=None, cancel=None):
+        """Submit one prompt to the scheduler, with generate()-style defaults.
+        With stop sequences or `on_text` (called with each text delta), the
+        output is detokenized as it grows into the returned TextStream; once
+        `cancel` is set the sequence is retired at its next token."""
+        gc = self.model.generation_config
+        # held from admission until the scheduler retires the sequence
+        reserved = self._reserve(1, len(input_ids), kwargs)
+        stop = _stop_list(kwargs.get("stop"))
+        stream = None
+        if stop or on_text is not None:
+            stream = TextStream(self.tokenizer, stop, self._end_ids)
+        # the scheduler thread calls watch(); book its decoding to the caller
+        timings = current_timings()
+
+        def watch(tok):
+            if stream is None:
+                return None
+            start = time.perf_counter()
+            emit = stream.push((tok,))
+            if timings is not None:
+                timings.add("detokenize", time.perf_counter() - start)
+            if emit and on_text is not None:
+                on_text(emit)
+            return stream.hit or (cancel is not None and cancel.is_set())
+
+        do_sample = kwargs.get("do_sample", gc.do_sample)
+        try:
+            future = self._scheduler.submit(
+                input_ids,
+                max_new_tokens=self._max_new_tokens(kwargs, len(input_ids)),
+                do_sample=bool(do_sample),
+                temperature=kwargs.get("temperature", gc.temperature) or 1.0,
+                top_k=kwargs.get("top_k", gc.top_k) or 0,
+                top_p=kwargs.get("top_p", gc.top_p) or 1.0,
+                on_token=watch,
+            )
+        except BaseException:
+            self._release(reserved)
+            raise
+        future.add_done_callback(lambda _: self._release(reserved))
+        return stream, future
+
+    def _generate_scheduled(self, encoded, **kwargs):
+        self._check_budget([(1, len(ids)) for ids in encoded], kwargs)
+        submitted = [self._submit(ids, kwargs) for ids in encoded]
+        results, phases = [], {}
+        for prompt_ids, (stream, future) in zip(encoded, submitted):
+            out = future.result()
+            # prompts of one call run concurrently: keep the longest of each phase
+            for name, seconds in out["timings"].items():
+                phases[name] = max(phases.get(name, 0.0), seconds)
+            with phase("detokenize"):
+                if stream is not None:
+                    stream.finish()
+                    text, hit = stream.text, stream.hit
+                else:
+                    text, hit = self.tokenizer.decode(out["ids"], skip_special_tokens=True), False
+            results.append({
+                "text": text,
+                "finish_reason": "stop" if hit else out["finish_reason"],
+                "usage": _usage(len(prompt_ids), len(out["ids"])),
+            })
+        for name, seconds in phases.items():
+            record(name, seconds)
+        return results
+
+    def _stream_scheduled(self, input_ids, **kwargs):
+        deltas = queue.Queue()
+        cancel = threading.Event()
+        stream, future = self._submit(input_ids, kwargs, on_text=deltas.put, cancel=cancel)
+        future.add_done_callback(lambda _: deltas.put(None))
+        # consumed after dispatch returns, so hold on to the caller's timings
+        timings = current_timings()
+
+        def finalize():
+            out = future.result()
+            if timings is not None:
+                for name, seconds in out["timings"].items():
+                    timings.add(name, seconds)
+            return out["ids"], out["finish_reason"]
+
+        def abort():
+            cancel.set()
+            wait([future])
+
+        return self._stream_response(iter(deltas.get, None), finalize, stream, len(input_ids),
+                                     abort)
+
+    def text_generation(self, prompt, stream=False, details=False, **kwargs):
+        """
+        Generate a completion for `prompt` (a string) or for each prompt in a
+        list of strings. Lists are run through ``generate`` in left-padded,
+        length-bucketed batches; results come back in input order.
+
+        With ``stream=True`` (single prompt only) returns an MLHQStream of text
+        deltas instead of the final string. With ``details=True`` returns
+        MLHQResponse objects (finish_reason, usage, timings) instead of strings.
+
+        ``regex=`` or ``json_schema=`` (also ``response_format=`` on chat)
+        constrain decoding so the output matches; see hf_constrained.
+        """
+        prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+        if not prompts:
+            return []
+        # one fast (Rust-side) batched tokenizer call, unpadded
+        with phase("tokenize"):
+            encoded = self.tokenizer(prompts)["input_ids"]
+        if stream:
+            if not isinstance(prompt, str):
+                raise ValueError("stream=True supports a single prompt, not a list")
+            return self._stream(encoded[0], **kwargs)
+        results = self._generate(encoded, **kwargs)
+        if details:
+            outputs = [self._response(r) for r in results]
+        else:
+            outputs = [r["text"] for r in results]
+        return outputs[0] if isinstance(prompt, str) else outputs
+
+    def _response(self, result):
+        return MLHQResponse(
+            text=result["text"],
+            raw=result,
+            model=self.model_name,
+            provider="hflocal",
+            finish_reason=result["finish_reason"],
+            usage=result["usage"],
+        )
+
+    # ---------- embeddings ----------
+
+    def _embedding_backbone(self):
+        """(model, tokenizer) to embed with."""
+        with self._embed_lock:
+            if self._embedder is None:
+                if self._embedding_model is None:
+                    self._embedder = (None, self.model.base_model, self.tokenizer)
+                else:
+                    entry = get_model_registry().acquire(
+                        self._embedding_model, dtype=self._torch_dtype, device=self.device,
+                        task="embedding")
+                    tokenizer = entry.tokenizer
+                    if tokenizer.pad_token_id is None:
+                        tokenizer.pad_token = tokenizer.eos_token
+                    self._embedder = (entry, entry.model, tokenizer)
+            return self._embedder[1:]
+
+    @torch.inference_mode()
+    def embed(self, inputs, *, pooling=None, normalize=True, dimensions=None, dtype="float32",
+              **ignored):
+        """
+        Embed a string or a list of strings (or token-id lists) into one
+        contiguous (n, dim) NumPy array, rows in input order.
+
+        Inputs are sorted by length and run in padded batches (same
+        ``max_batch_size`` / ``max_batch_tokens`` caps as generation); each
+        batch's pooled vectors are written straight into the preallocated
+        output. `pooling` is "mean" (over real tokens) or "last" (the last
+        real token, for decoder embedding models); `dimensions` keeps the
+        first N dims (before normalizing); ``dtype="float16"`` halves the
+        output's memory.
+        """
+        import numpy as np
+
+        if ignored:
+            logger.debug("embed: ignoring %s", sorted(ignored))
+        pooling = pooling or self.embedding_pooling
+        if pooling not in ("mean", "last"):
+            raise ValueError(f"Unknown pooling {pooling!r}; use 'mean' or 'last'")
+        model, tokenizer = self._embedding_backbone()
+        items = [inputs] if isinstance(inputs, str) or _is_ids(inputs) else list(inputs)
+        limit = min(tokenizer.model_max_length,
+                    getattr(model.config, "max_position_embeddings", None) or 1 << 30)
+        with phase("tokenize"):
+            texts = [i for i, item in enumerate(items) if isinstance(item, str)]
+            encoded = [list(item) if not isinstance(item, str) else None for item in items]
+            if texts:
+                ids = tokenizer([items[i] for i in texts], truncation=True,
+                                max_length=limit)["input_ids"]
+                for i, row in zip(texts, ids):
+                    encoded[i] = row
+        width = dimensions or model.config.hidden_size
+        out = np.empty((len(encoded), width), dtype=np.dtype(dtype))
+        with phase("prefill"):
+            # a single forward pass: no KV cache to budget
+            for batch in self._plan_batches([len(ids) for ids in encoded], 0, budgeted=False):
+                inputs_ = tokenizer.pad({"input_ids": [encoded[i] for i in batch]},
+                                        padding=True, padding_side="right",
+                                        return_tensors="pt").to(self.device)
+                hidden = model(input_ids=inputs_.input_ids,
+                               attention_mask=inputs_.attention_mask).last_hidden_state
+                mask = inputs_.attention_mask
+                if pooling == "mean":
+                    m = mask.unsqueeze(-1).to(hidden.dtype)
+                    pooled = (hidden * m).sum(1) / m.sum(1).clamp(min=1)
+                else:
+                    last = mask.sum(1) - 1
+                    pooled = hidden[torch.arange(hidden.shape[0]), last]
+                pooled = pooled[:, :width].float()
+                if normalize:
+                    pooled = torch.nn.functional.normalize(pooled, dim=-1)
+                out[batch] = pooled.cpu().numpy()
+        total = sum(len(ids) for ids in encoded)
+        return MLHQEmbeddings(
+            data=out,
+            model=self._embedding_model or self.model_name,
+            provider="hflocal",
+            usage={"prompt_tokens": total, "total_tokens": total},
+        )
 
+    def close(self):
+        if self._embedder is not None and self._embedder[0] is not None:
+            get_model_registry().release(self._embedder[0])
+        self._embedder = None
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        if self._loaded is not None:
+            get_model_registry().release(self._loaded)
+            self._loaded = None
+        if self._draft is not None:
+            get_model_registry().release(self._draft)
+            self._draft = self._assistant = None
 
+    def chat_completion(self, messages, stream=False, **kwargs):
+        """OpenAI-style chat completion: apply the chat template, then generate."""
+        kwargs = _openai_to_generate_kwargs(kwargs)
+        with phase("tokenize"):
+            input_ids = self.tokenizer.apply_chat_template(
+                messages, add_generation_prompt=True, tokenize=True
+            )
+        if stream:
+            return self._stream(input_ids, **kwargs)
+        return self._response(self._generate([input_ids], **kwargs)[0])
+
+    def chat_completion_batch(self, conversations, **kwargs):
+        """
+        chat_completion for many conversations sharing the same kwargs, run
+        through the length-bucketed batched generate path. Returns one
+        MLHQResponse per conversation, in input order.
+        """
+        kwargs = _openai_to_generate_kwargs(kwargs)
+        with phase("tokenize"):
+            encoded = [
+                self.tokenizer.apply_chat_template(m, add_generation_prompt=True, tokenize=True)
+                for m in conversations
+            ]
+        return [self._response(r) for r in self._generate(encoded, **kwargs)]
+
+
+# ---------- helpers ----------
+
+class _PrefillClock(LogitsProcessor):
+    """Notes when generate() first asks for logits, i.e. when prefill is done."""
+    def __init__(self):
+        self.first = None
+
+    def __call__(self, input_ids, scores):
+        if self.first is None:
+            self.first = time.perf_counter()
+        return scores
+
+class _Speculation:
+    """Forward passes of the target (verification rounds) and the draft
+    (one per drafted token) during one assisted generate() call."""
+    __slots__ = ("target", "draft", "rounds", "drafted")
+
+    def __init__(self, target, draft):
+        self.target = target
+        self.draft = draft
+        self.rounds = 0
+        self.drafted = 0
+
+    def count(self, module):
+        if module is self.target:
+            self.rounds += 1
+        elif module is self.draft:
+            self.drafted += 1
+
+    def stats(self, new_tokens):
+        # every round keeps its accepted draft tokens plus one target token
+        accepted = max(new_tokens - self.rounds, 0)
+        return {
+            "draft_tokens": self.drafted,
+            "accepted_tokens": accepted,
+            "acceptance_rate": accepted / self.drafted if self.drafted else 0.0,
+            "target_forwards": self.rounds,
+        }
+
+_speculation: contextvars.ContextVar = contextvars.ContextVar("mlhq_speculation", default=None)
+
+@contextmanager
+def _speculating(target, draft):
+    """Count target/draft forward passes of the generate() call in this block
+    (a no-op without a draft)."""
+    if draft is None:
+        yield None
+        return
+    spec = _Speculation(target, draft)
+    token = _speculation.set(spec)
+    try:
+        yield spec
+    finally:
+        _speculation.reset(token)
+
+def _count_forwards(model):
+    """Install (once) a forward hook feeding the active _Speculation. Models
+    are shared across clients, so outside an assisted call it does nothing."""
+    if getattr(model, "_mlhq_counted", False):
+        return
+
+    def hook(module, args, output):
+        spec = _speculation.get()
+        if spec is not None:
+            spec.count(module)
+
+    model.register_forward_hook(hook)
+    model._mlhq_counted = True
+
+_SCHEDULED_KWARGS = SUPPORTED_KWARGS | {"stop"}
+
+# OpenAI request fields with no generate() equivalent; dropped rather than
+# forwarded (generate() rejects unknown kwargs).
+_OPENAI_ONLY_KWARGS = ("model", "n", "user", "stream_options", "logprobs", "top_logprobs",
+                       "presence_penalty", "frequency_penalty")
+
+def _openai_to_generate_kwargs(kwargs):
+    kwargs = dict(kwargs)
+    for key in _OPENAI_ONLY_KWARGS:
+        kwargs.pop(key, None)
+    for key in ("max_completion_tokens", "max_tokens"):
+        if key in kwargs:
+            kwargs["max_new_tokens"] = kwargs.pop(key)
+    if "temperature" in kwargs:
+        temperature = kwargs.pop("temperature")
+        kwargs["do_sample"] = bool(temperature)
+        if temperature:
+            kwargs["temperature"] = temperature
+    return kwargs
+
+def _is_ids(item):
+    """A single pre-tokenized input (list of ints), as opposed to a list of inputs."""
+    return isinstance(item, (list, tuple)) and bool(item) and isinstance(item[0], int)
+
+def _usage(prompt_tokens, completion_tokens):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+def _stop_list(stop):
+    """`stop` (None, a string or a list of strings) as a list."""
+    if not stop:
+        return []
+    return [stop] if isinstance(stop, str) else list(stop)
+
+
+
+class _HFChatCompletions:
+    def __init__(self, client: HFLocalClient): self._client = client
+    def create(self, *, messages, **kwargs: Any):
+        return self._client.chat_completion(messages, **kwargs)
+
+class _HFEmbeddings:
+    def __init__(self, client: HFLocalClient): self._client = client
+    def create(self, *, input, model=None, **kwargs: Any):
+        return self._client.embed(input, **kwargs)
+
+class _HFChat:
+    def __init__(self, client: HFLocalClient):
+        self._completions = _HFChatCompletions(client)
+    @property
+    def completions(self) -> _HFChatCompletions:
+        return self._completions
 
 class HFLocalBackend(Backend):                                                   
     def __init__(                                                               
@@ -64,23 +829,187 @@ class HFLocalBackend(Backend):
         organization: Optional[str] = None,                                     
         project: Optional[str] = None,                                          
         model,
+        max_batch_size: int = 8,
+        max_batch_tokens: int = 16384,
+        continuous_batching: bool = False,
+        prefix_cache_max_bytes: int = 0,
+        model_memory_budget: Optional[int] = None,
+        torch_dtype: Optional[str] = None,
+        quantization: Optional[str] = None,
+        compile: Any = False,
+        draft_model: Optional[str] = None,
+        draft_tokens: Optional[int] = None,
+        embedding_model: Optional[str] = None,
+        embedding_pooling: str = "mean",
+        snapshot_dir: Optional[str] = None,
+        warmup: Any = False,
+        warmup_tokens: int = 8,
+        constraint_cache_dir: Optional[str] = None,
+        kv_memory_budget: Optional[int] = None,
+        kv_budget_policy: str = "queue",
+        kv_budget_timeout: Optional[float] = None,
         **extra: Any,                                                           
     ) -> None:                                                                  
-        self._inner = HFLocalClient(                                                   
-            api_key=api_key,                                                    
-            #base_url=base_url,                                                  
-            #organization=organization,                                          
-            #project=project,                                                    
-            model_name = model, 
+        self._inner = HFLocalClient(
+            api_key=api_key,
+            #base_url=base_url,
+            #organization=organization,
+            #project=project,
+            model_name = model,
+            max_batch_size=max_batch_size,
+            max_batch_tokens=max_batch_tokens,
+            continuous_batching=continuous_batching,
+            prefix_cache_max_bytes=prefix_cache_max_bytes,
+            model_memory_budget=model_memory_budget,
+            torch_dtype=torch_dtype,
+            quantization=quantization,
+            compile=compile,
+            draft_model=draft_model,
+            draft_tokens=draft_tokens,
+            embedding_model=embedding_model,
+            embedding_pooling=embedding_pooling,
+            snapshot_dir=snapshot_dir,
+            warmup=warmup,
+            warmup_tokens=warmup_tokens,
+            constraint_cache_dir=constraint_cache_dir,
+            kv_memory_budget=kv_memory_budget,
+            kv_budget_policy=kv_budget_policy,
+            kv_budget_timeout=kv_budget_timeout,
         )                                                                       
         #self._responses = _OpenAIResponses(self._inner)                         
-        #self._chat = _OpenAIChat(self._inner)
+        self._chat = _HFChat(self._inner)
+        self._embeddings = _HFEmbeddings(self._inner)
         #self._text_generation = self._inner.text_generation
 
     @property                                                                   
     def text_generation(self):  
         return self._inner.text_generation                                                  
                                                                                 
-    #@property                                                                   
-    #def chat(self) -> ChatAPI:                                                  
-    #    return self._chat 
+    @property
+    def chat_completion_batch(self):
+        return self._inner.chat_completion_batch
+
+    @property
+    def chat(self) -> _HFChat:
+        return self._chat
+
+    @property
+    def embeddings(self) -> _HFEmbeddings:
+        return self._embeddings
+
+    @property
+    def prefix_cache(self) -> Optional[PrefixCache]:
+        return self._inner.prefix_cache
+
+    @property
+    def memory_budget(self) -> Optional[MemoryBudget]:
+        return self._inner.memory_budget
+
+    @property
+    def samples_by_default(self) -> bool:
+        return self._inner.samples_by_default
+
+    @property
+    def tokenizer(self):
+        return self._inner.tokenizer
+
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        return self._inner.startup_timings
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+
+class AsyncHFLocalBackend:
+    """
+    asyncio front-end for HFLocalBackend. Generation is CPU/GPU bound, so calls
+    are queued onto a small bounded executor (``max_workers`` threads) rather
+    than one thread per request; any number of coroutines can await results.
+    """
+    def __init__(self, *, max_workers: int = 1, **cfg: Any) -> None:
+        self._sync = HFLocalBackend(**cfg)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mlhq-hflocal"
+        )
+
+        self._chat = _AsyncHFChat(self)
+        self._embeddings = _AsyncHFEmbeddings(self)
+
+    async def _offload(self, fn, *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()  # keep the request's timings in the worker
+        result = await loop.run_in_executor(
+            self._executor, functools.partial(ctx.run, fn, *args, **kwargs)
+        )
+        if isinstance(result, MLHQStream):
+            return MLHQAsyncStream(_aiter_stream(result), model=result._model, provider="hflocal")
+        return result
+
+    async def text_generation(self, prompt, **kwargs: Any):
+        return await self._offload(self._sync.text_generation, prompt, **kwargs)
+
+    async def chat_completion_batch(self, conversations, **kwargs: Any):
+        return await self._offload(self._sync.chat_completion_batch, conversations, **kwargs)
+
+    @property
+    def chat(self) -> _AsyncHFChat:
+        return self._chat
+
+    @property
+    def embeddings(self) -> _AsyncHFEmbeddings:
+        return self._embeddings
+
+    @property
+    def memory_budget(self) -> Optional[MemoryBudget]:
+        return self._sync.memory_budget
+
+    @property
+    def samples_by_default(self) -> bool:
+        return self._sync.samples_by_default
+
+    @property
+    def tokenizer(self):
+        return self._sync.tokenizer
+
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        return self._sync.startup_timings
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._sync.close()
+
+
+class _AsyncHFChatCompletions:
+    def __init__(self, backend: AsyncHFLocalBackend): self._backend = backend
+    async def create(self, **kwargs: Any):
+        return await self._backend._offload(self._backend._sync.chat.completions.create, **kwargs)
+
+class _AsyncHFEmbeddings:
+    def __init__(self, backend: AsyncHFLocalBackend): self._backend = backend
+    async def create(self, **kwargs: Any):
+        return await self._backend._offload(self._backend._sync.embeddings.create, **kwargs)
+
+class _AsyncHFChat:
+    def __init__(self, backend: AsyncHFLocalBackend):
+        self._completions = _AsyncHFChatCompletions(backend)
+    @property
+    def completions(self) -> _AsyncHFChatCompletions:
+        return self._completions
+
+async def _aiter_stream(stream: MLHQStream):
+    # Generation runs on its own thread; only the blocking wait for the next
+    # delta is pushed to the default executor.
+    loop = asyncio.get_running_loop()
+    it = iter(stream)
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, it, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:  # abandoned (aclose, cancelled task): stop the generation
+        await loop.run_in_executor(None, stream.close)
@@ -0,0 +1,848 @@
+"""
+Regex / JSON-schema constrained decoding for hflocal.
+
+    client.text_generation(prompt, regex=r"(yes|no)")
+    client.chat.completions.create(messages=..., response_format={
+        "type": "json_schema", "json_schema": {"schema": {...}}})
+
+A JSON schema is first turned into a regex (``schema_to_regex``). The regex
+is compiled to a byte-level NFA (UTF-8, so character classes work on text,
+not on whatever bytes a token happens to split), and determinized lazily:
+a DFA state is a set of NFA states, created the first time some input
+reaches it.
+
+``TokenIndex`` maps each DFA state to the tokens that can be emitted from it
+and the state each one leads to. A state's row is built by walking the
+tokenizer's vocabulary in sorted byte order, like a trie: bytes shared with
+the previous token are not re-run through the DFA, and once a prefix is
+rejected every token starting with it is skipped with one bisect. Rows are
+built on first use, kept in memory per (pattern, tokenizer), and, with a
+`cache_dir`, saved to disk so the next process starts warm.
+
+At decode time ``ConstrainedLogitsProcessor`` advances each row's state by
+the token just generated (a dict lookup) and masks the logits with the
+state's cached boolean vector; end-of-sequence is allowed only where the
+pattern may end.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from collections import OrderedDict
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+import torch
+from transformers import LogitsProcessor
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+DEAD = -1  # no continuation matches
+DONE = -2  # the row emitted end-of-sequence
+
+_MAX_CODEPOINT = 0x10FFFF
+_INDEX_VERSION = 1
+
+
+# ---------- regex -> NFA ----------
+
+class _NFA:
+    """Thompson NFA over bytes: per state, byte-range edges and epsilon edges."""
+
+    def __init__(self) -> None:
+        self.edges: List[List[Tuple[int, int, int]]] = []
+        self.eps: List[List[int]] = []
+
+    def state(self) -> int:
+        self.edges.append([])
+        self.eps.append([])
+        return len(self.edges) - 1
+
+
+def _utf8_sequences(lo: int, hi: int, out: List[List[Tuple[int, int]]]) -> None:
+    """Byte-range sequences matching exactly the UTF-8 encodings of code
+    points lo..hi (surrogates excluded)."""
+    if lo > hi:
+        return
+    if lo <= 0xDFFF and hi >= 0xD800:
+        _utf8_sequences(lo, 0xD7FF, out)
+        _utf8_sequences(0xE000, hi, out)
+        return
+    for bound in (0x7F, 0x7FF, 0xFFFF):  # different encoded lengths
+        if lo <= bound < hi:
+            _utf8_sequences(lo, bound, out)
+            _utf8_sequences(bound + 1, hi, out)
+            return
+    if hi < 0x80:
+        out.append([(lo, hi)])
+        return
+    for i in range(1, 4):  # split until every continuation byte spans its full range
+        m = (1 << (6 * i)) - 1
+        if lo & ~m != hi & ~m:
+            if lo & m:
+                _utf8_sequences(lo, lo | m, out)
+                _utf8_sequences((lo | m) + 1, hi, out)
+                return
+            if hi & m != m:
+                _utf8_sequences(lo, (hi & ~m) - 1, out)
+                _utf8_sequences(hi & ~m, hi, out)
+                return
+    out.append(list(zip(chr(lo).encode(), chr(hi).encode())))
+
+
+def _normalize(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _negate(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out, start = [], 0
+    for lo, hi in _normalize(ranges):
+        if lo > start:
+            out.append((start, lo - 1))
+        start = hi + 1
+    if start <= _MAX_CODEPOINT:
+        out.append((start, _MAX_CODEPOINT))
+    return out
+
+
+_DIGIT = [(0x30, 0x39)]
+_WORD = [(0x30, 0x39), (0x41, 0x5A), (0x5F, 0x5F), (0x61, 0x7A)]
+_SPACE = [(0x09, 0x0D), (0x20, 0x20)]
+_CLASS_ESCAPES = {"d": _DIGIT, "w": _WORD, "s": _SPACE}
+_CHAR_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+
+
+class _Parser:
+    """
+    Recursive-descent parser for the regex subset constraints need:
+    literals, escapes (\\d \\w \\s and negations, \\n, \\uXXXX, ...), classes,
+    ``.``, groups (capturing or ``(?:``), ``|``, and ``* + ? {m} {m,} {m,n}``.
+    The whole pattern must match (implicit anchors).
+    """
+
+    def __init__(self, pattern: str) -> None:
+        self.p = pattern
+        self.i = 0
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"{message} at position {self.i} in regex {self.p!r}")
+
+    def peek(self) -> Optional[str]:
+        return self.p[self.i] if self.i < len(self.p) else None
+
+    def take(self) -> str:
+        if self.i >= len(self.p):
+            raise self.error("unexpected end")
+        c = self.p[self.i]
+        self.i += 1
+        return c
+
+    def parse(self) -> Any:
+        node = self.alternation()
+        if self.i != len(self.p):
+            raise self.error("unbalanced ')'")
+        return node
+
+    def alternation(self) -> Any:
+        branches = [self.sequence()]
+        while self.peek() == "|":
+            self.i += 1
+            branches.append(self.sequence())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def sequence(self) -> Any:
+        items = []
+        while self.peek() not in (None, "|", ")"):
+            items.append(self.repeat(self.atom()))
+        return ("seq", items)
+
+    def repeat(self, node: Any) -> Any:
+        while True:
+            c = self.peek()
+            if c == "*":
+                lo, hi = 0, None
+            elif c == "+":
+                lo, hi = 1, None
+            elif c == "?":
+                lo, hi = 0, 1
+            elif c == "{" and re.match(r"\{\d+(,\d*)?\}", self.p[self.i:]):
+                m = re.match(r"\{(\d+)(,(\d*))?\}", self.p[self.i:])
+                lo = int(m.group(1))
+                hi = lo if m.group(2) is None else (int(m.group(3)) if m.group(3) else None)
+                if hi is not None and hi < lo:
+                    raise self.error("bad repeat bounds")
+                self.i += len(m.group(0)) - 1
+            else:
+                return node
+            self.i += 1
+            if self.peek() in ("?", "+"):  # lazy / possessive: same language
+                self.i += 1
+            node = ("rep", node, lo, hi)
+
+    def atom(self) -> Any:
+        c = self.take()
+        if c == "(":
+            if self.p.startswith("?:", self.i):
+                self.i += 2
+            elif self.peek() == "?":
+                raise self.error("lookarounds and named groups are not supported")
+            node = self.alternation()
+            if self.take() != ")":
+                raise self.error("missing ')'")
+            return node
+        if c == "[":
+            return ("set", self.char_class())
+        if c == ".":
+            return ("set", _negate([(0x0A, 0x0A)]))
+        if c == "\\":
+            return self.escape()
+        if c in "^$":
+            raise self.error("anchors are implicit; remove ^ and $")
+        if c in "*+?)":
+            raise self.error(f"nothing to repeat before {c!r}")
+        return ("set", [(ord(c), ord(c))])
+
+    def escape(self) -> Any:
+        c = self.take()
+        if c.lower() in _CLASS_ESCAPES:
+            ranges = _CLASS_ESCAPES[c.lower()]
+            return ("set", _negate(ranges) if c.isupper() else list(ranges))
+        if c in _CHAR_ESCAPES:
+            return ("set", [(ord(_CHAR_ESCAPES[c]),) * 2])
+        if c in "xu":
+            n = 2 if c == "x" else 4
+            digits = self.p[self.i:self.i + n]
+            if len(digits) != n or not all(d in "0123456789abcdefABCDEF" for d in digits):
+                raise self.error(f"bad \\{c} escape")
+            self.i += n
+            return ("set", [(int(digits, 16),) * 2])
+        if c.isalnum():
+            raise self.error(f"unsupported escape \\{c}")
+        return ("set", [(ord(c), ord(c))])
+
+    def char_class(self) -> List[Tuple[int, int]]:
+        negate = self.peek() == "^"
+        if negate:
+            self.i += 1
+        ranges: List[Tuple[int, int]] = []
+        first = True
+        while True:
+            c = self.take()
+            if c == "]" and not first:
+                break
+            first = False
+            if c == "\\":
+                lo_set = self.escape()[1]
+            else:
+                lo_set = [(ord(c), ord(c))]
+            if (len(lo_set) == 1 and lo_set[0][0] == lo_set[0][1] and self.peek() == "-"
+                    and self.p[self.i + 1:self.i + 2] not in ("]", "")):
+                self.i += 1
+                c2 = self.take()
+                hi_set = self.escape()[1] if c2 == "\\" else [(ord(c2), ord(c2))]
+                if len(hi_set) != 1 or hi_set[0][0] != hi_set[0][1] or hi_set[0][0] < lo_set[0][0]:
+                    raise self.error("bad character range")
+                ranges.append((lo_set[0][0], hi_set[0][0]))
+            else:
+                ranges.extend(lo_set)
+        return _negate(ranges) if negate else _normalize(ranges)
+
+
+def _build(nfa: _NFA, node: Any, start: int) -> int:
+    """Add `node` to the NFA from `start`; returns its end state."""
+    kind = node[0]
+    if kind == "seq":
+        for item in node[1]:
+            start = _build(nfa, item, start)
+        return start
+    if kind == "alt":
+        end = nfa.state()
+        for branch in node[1]:
+            s = nfa.state()
+            nfa.eps[start].append(s)
+            nfa.eps[_build(nfa, branch, s)].append(end)
+        return end
+    if kind == "set":
+        end = nfa.state()
+        sequences: List[List[Tuple[int, int]]] = []
+        for lo, hi in _normalize(node[1]):
+            _utf8_sequences(lo, min(hi, _MAX_CODEPOINT), sequences)
+        for seq in sequences:
+            s = start
+            for j, (blo, bhi) in enumerate(seq):
+                t = end if j == len(seq) - 1 else nfa.state()
+                nfa.edges[s].append((blo, bhi, t))
+                s = t
+        return end
+    if kind == "rep":
+        _, inner, lo, hi = node
+        for _ in range(lo):
+            start = _build(nfa, inner, start)
+        if hi is None:
+            loop = nfa.state()
+            nfa.eps[start].append(loop)
+            nfa.eps[_build(nfa, inner, loop)].append(loop)
+            return loop
+        end = nfa.state()
+        for _ in range(hi - lo):
+            nfa.eps[start].append(end)
+            start = _build(nfa, inner, start)
+        nfa.eps[start].append(end)
+        return end
+    raise AssertionError(kind)
+
+
+class RegexDFA:
+    """
+    Lazily determinized byte automaton for `pattern` (full match). States are
+    small ints; ``step(state, byte)`` returns the next state or DEAD, building
+    transitions on first use. ``key(state)`` is a stable name for a state
+    (its NFA set), used to persist indexes.
+    """
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self._nfa = _NFA()
+        start = self._nfa.state()
+        self._final = _build(self._nfa, _Parser(pattern).parse(), start)
+        self._keys: List[Tuple[int, ...]] = []
+        self._ids: Dict[Tuple[int, ...], int] = {}
+        self._rows: List[List[Optional[int]]] = []
+        self.accepting: List[bool] = []
+        self._lock = threading.Lock()
+        self.initial = self.state_for(self._closure([start]))
+
+    def _closure(self, states: Iterable[int]) -> Tuple[int, ...]:
+        seen = set(states)
+        todo = list(seen)
+        eps = self._nfa.eps
+        while todo:
+            for t in eps[todo.pop()]:
+                if t not in seen:
+                    seen.add(t)
+                    todo.append(t)
+        return tuple(sorted(seen))
+
+    def state_for(self, key: Tuple[int, ...]) -> int:
+        sid = self._ids.get(key)
+        if sid is None:
+            with self._lock:
+                sid = self._ids.get(key)
+                if sid is None:
+                    sid = len(self._keys)
+                    self._keys.append(key)
+                    self._rows.append([None] * 256)
+                    self.accepting.append(self._final in key)
+                    self._ids[key] = sid
+        return sid
+
+    def key(self, state: int) -> Tuple[int, ...]:
+        return self._keys[state]
+
+    def step(self, state: int, byte: int) -> int:
+        nxt = self._rows[state][byte]
+        if nxt is None:
+            edges = self._nfa.edges
+            targets = [t for s in self._keys[state] for lo, hi, t in edges[s] if lo <= byte <= hi]
+            nxt = self.state_for(self._closure(targets)) if targets else DEAD
+            self._rows[state][byte] = nxt
+        return nxt
+
+    def matches(self, text: str) -> bool:
+        state = self.initial
+        for b in text.encode():
+            state = self.step(state, b)
+            if state == DEAD:
+                return False
+        return self.accepting[state]
+
+
+# ---------- JSON schema -> regex ----------
+
+_WS = "[ ]?"
+_JSON_STRING = r'"([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*"'
+_JSON_CHAR = r'([^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})'
+_JSON_INTEGER = r"-?(0|[1-9][0-9]*)"
+_JSON_NUMBER = r"-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][+-]?[0-9]+)?"
+_FORMATS = {
+    "date": r'"[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])"',
+    "time": r'"([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9](\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"',
+    "date-time": (r'"[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])T([01][0-9]|2[0-3]):'
+                  r'[0-5][0-9]:[0-5][0-9](\.[0-9]+)?(Z|[+-][0-9]{2}:[0-9]{2})?"'),
+    "uuid": r'"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"',
+}
+# free-form values ({} or {"type": "object"} without properties) nest this deep
+_ANY_DEPTH = 2
+
+
+def _literal(value: Any) -> str:
+    return re.escape(json.dumps(value, ensure_ascii=False))
+
+
+def _any_value(depth: int) -> str:
+    scalars = [_JSON_STRING, _JSON_NUMBER, "true", "false", "null"]
+    if depth > 0:
+        scalars += [_any_object(depth - 1), _any_array(depth - 1)]
+    return "(" + "|".join(scalars) + ")"
+
+
+def _any_object(depth: int) -> str:
+    member = f"{_JSON_STRING}{_WS}:{_WS}{_any_value(depth)}"
+    return rf"\{{{_WS}({member}({_WS},{_WS}{member})*)?{_WS}\}}"
+
+
+def _any_array(depth: int) -> str:
+    value = _any_value(depth)
+    return rf"\[{_WS}({value}({_WS},{_WS}{value})*)?{_WS}\]"
+
+
+def _repeat(item: str, lo: int, hi: Optional[int]) -> str:
+    """`item` lo..hi times, comma separated."""
+    sep = f"{_WS},{_WS}"
+    if hi == 0:
+        return ""
+    rest_hi = None if hi is None else hi - 1
+    tail = f"({sep}{item})" + ("{%d,}" % max(lo - 1, 0) if rest_hi is None
+                               else "{%d,%d}" % (max(lo - 1, 0), rest_hi))
+    body = f"{item}{tail}"
+    return body if lo > 0 else f"({body})?"
+
+
+class _SchemaCompiler:
+    def __init__(self, root: Dict[str, Any]) -> None:
+        self.root = root
+        self._resolving: List[str] = []
+
+    def resolve(self, ref: str) -> Dict[str, Any]:
+        if not ref.startswith("#/"):
+            raise ValueError(f"only local $refs are supported, got {ref!r}")
+        node: Any = self.root
+        for part in ref[2:].split("/"):
+            node = node[part.replace("~1", "/").replace("~0", "~")]
+        return node
+
+    def compile(self, schema: Any) -> str:
+        if schema is True or schema == {}:
+            return _any_value(_ANY_DEPTH)
+        if not isinstance(schema, dict):
+            raise ValueError(f"unsupported schema {schema!r}")
+        if "$ref" in schema:
+            ref = schema["$ref"]
+            if ref in self._resolving:
+                raise ValueError(f"recursive schema ({ref}) cannot be turned into a regex")
+            self._resolving.append(ref)
+            try:
+                return self.compile(self.resolve(ref))
+            finally:
+                self._resolving.pop()
+        if "const" in schema:
+            return _literal(schema["const"])
+        if "enum" in schema:
+            return "(" + "|".join(_literal(v) for v in schema["enum"]) + ")"
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                return "(" + "|".join(self.compile(s) for s in schema[key]) + ")"
+        if "allOf" in schema:
+            if len(schema["allOf"]) != 1:
+                raise ValueError("allOf with more than one schema is not supported")
+            return self.compile(schema["allOf"][0])
+        kind = schema.get("type")
+        if isinstance(kind, list):
+            return "(" + "|".join(self.compile({**schema, "type": k}) for k in kind) + ")"
+        if kind is None:
+            if "properties" in schema:
+                kind = "object"
+            elif "items" in schema:
+                kind = "array"
+            else:
+                return _any_value(_ANY_DEPTH)
+        compile_type = getattr(self, f"_{kind}", None)
+        if compile_type is None:
+            raise ValueError(f"unsupported schema type {kind!r}")
+        return compile_type(schema)
+
+    def _object(self, schema: Dict[str, Any]) -> str:
+        props = schema.get("properties")
+        if not props:
+            return _any_object(_ANY_DEPTH - 1)
+        required = set(schema.get("required", ()))
+        members = [(f"{_literal(name)}{_WS}:{_WS}{self.compile(sub)}", name in required)
+                   for name, sub in props.items()]
+        sep = f"{_WS},{_WS}"
+        # properties keep their declared order; optional ones may be left out,
+        # so branch on which property comes first
+        branches = []
+        for k, (member, _) in enumerate(members):
+            rest = "".join(f"{sep}{m}" if req else f"({sep}{m})?" for m, req in members[k + 1:])
+            branches.append(member + rest)
+            if members[k][1]:
+                break
+        body = "(" + "|".join(branches) + ")"
+        if not required:
+            body += "?"
+        return rf"\{{{_WS}{body}{_WS}\}}"
+
+    def _array(self, schema: Dict[str, Any]) -> str:
+        item = self.compile(schema.get("items", {}))
+        body = _repeat(item, schema.get("minItems", 0), schema.get("maxItems"))
+        return rf"\[{_WS}{body}{_WS}\]"
+
+    def _string(self, schema: Dict[str, Any]) -> str:
+        if "pattern" in schema:
+            pattern = schema["pattern"]
+            if pattern.startswith("^"):
+                pattern = pattern[1:]
+            if pattern.endswith("$") and not pattern.endswith("\\$"):
+                pattern = pattern[:-1]
+            return f'"({pattern})"'
+        if "format" in schema and schema["format"] in _FORMATS:
+            return _FORMATS[schema["format"]]
+        lo, hi = schema.get("minLength", 0), schema.get("maxLength")
+        if lo == 0 and hi is None:
+            return _JSON_STRING
+        return f'"{_JSON_CHAR}' + ("{%d,}" % lo if hi is None else "{%d,%d}" % (lo, hi)) + '"'
+
+    def _integer(self, schema: Dict[str, Any]) -> str:
+        # only the sign is enforced: a lower bound admitting no negatives
+        # gives 0 or the positive integers; maxima and larger minima are not
+        low = _integer_floor(schema)
+        if low is None or low < 0:
+            return _JSON_INTEGER
+        return "(0|[1-9][0-9]*)" if low == 0 else "[1-9][0-9]*"
+
+    def _number(self, schema: Dict[str, Any]) -> str:
+        return _JSON_NUMBER
+
+    def _boolean(self, schema: Dict[str, Any]) -> str:
+        return "(true|false)"
+
+    def _null(self, schema: Dict[str, Any]) -> str:
+        return "null"
+
+
+def _integer_floor(schema: Dict[str, Any]) -> Optional[int]:
+    """Smallest integer `schema`'s minimum / exclusiveMinimum allow (draft 4
+    boolean exclusiveMinimum included), or None if unbounded below."""
+    bounds = []
+    minimum, exclusive = schema.get("minimum"), schema.get("exclusiveMinimum")
+    if isinstance(exclusive, bool):  # draft 4: a flag on `minimum`
+        minimum, exclusive = (None, minimum) if exclusive else (minimum, None)
+    if minimum is not None:
+        bounds.append(math.ceil(minimum))
+    if exclusive is not None:
+        bounds.append(math.floor(exclusive) + 1)
+    return max(bounds) if bounds else None
+
+
+def schema_to_regex(schema: Any) -> str:
+    """
+    Regex matching (compact, single-space) JSON documents valid under
+    `schema`: objects keep their declared property order, optional
+    properties may be omitted. Of the numeric bounds only an integer's
+    sign is enforced (``minimum: 0`` gives 0 or more, ``minimum: 0.5`` or
+    ``exclusiveMinimum: 0`` gives 1 or more); maxima, larger minima and
+    number ranges are not. Recursive ``$ref`` raises ValueError.
+    """
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    return _SchemaCompiler(schema).compile(schema)
+
+
+def constraint_pattern(kwargs: Dict[str, Any]) -> Optional[str]:
+    """Pop ``regex`` / ``json_schema`` / OpenAI ``response_format`` from
+    generate kwargs and return the regex to decode with, if any."""
+    regex = kwargs.pop("regex", None)
+    schema = kwargs.pop("json_schema", None)
+    fmt = kwargs.pop("response_format", None)
+    if fmt is not None:
+        fmt = fmt if isinstance(fmt, dict) else dict(fmt)
+        kind = fmt.get("type")
+        if kind == "json_schema":
+            schema = (fmt.get("json_schema") or {}).get("schema", {})
+        elif kind == "json_object":
+            schema = {"type": "object"}
+        elif kind not in (None, "text"):
+            raise ValueError(f"unsupported response_format type {kind!r}")
+    if regex is not None and schema is not None:
+        raise ValueError("pass either regex or json_schema, not both")
+    if schema is not None:
+        return schema_to_regex(schema)
+    return regex
+
+
+# ---------- vocabulary index ----------
+
+def _byte_decoder() -> Dict[str, int]:
+    from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
+    return {c: b for b, c in bytes_to_unicode().items()}
+
+
+_HEX_BYTE = re.compile(r"<0x([0-9A-Fa-f]{2})>")
+
+
+class _Vocab:
+    """The tokenizer's tokens as raw bytes, sorted, with a content fingerprint."""
+
+    def __init__(self, tokenizer: Any) -> None:
+        special = set(tokenizer.all_special_ids)
+        special |= set(getattr(tokenizer, "added_tokens_decoder", {}))
+        decoder = getattr(getattr(tokenizer, "backend_tokenizer", None), "decoder", None)
+        byte_level = type(decoder).__name__ == "ByteLevel" or "ByteLevel" in repr(decoder)
+        table = _byte_decoder() if byte_level else None
+        by_bytes: Dict[bytes, List[int]] = {}
+        for token, tid in tokenizer.get_vocab().items():
+            if tid in special:
+                continue
+            if table is not None:
+                try:
+                    raw = bytes(table[c] for c in token)
+                except KeyError:
+                    raw = token.encode()
+            else:
+                m = _HEX_BYTE.fullmatch(token)
+                raw = bytes([int(m.group(1), 16)]) if m else token.replace("▁", " ").encode()
+            if raw:
+                by_bytes.setdefault(raw, []).append(tid)
+        self.keys: List[bytes] = sorted(by_bytes)
+        self.ids: List[List[int]] = [by_bytes[k] for k in self.keys]
+        h = hashlib.blake2b(digest_size=16)
+        for k, ids in zip(self.keys, self.ids):
+            h.update(len(k).to_bytes(2, "little") + k + repr(ids).encode())
+        self.fingerprint = h.hexdigest()
+
+
+def _vocab(tokenizer: Any) -> _Vocab:
+    vocab = getattr(tokenizer, "_mlhq_vocab", None)
+    if vocab is None:
+        vocab = _Vocab(tokenizer)
+        tokenizer._mlhq_vocab = vocab
+    return vocab
+
+
+def _after(prefix: bytes) -> Optional[bytes]:
+    """Smallest byte string greater than every string starting with `prefix`
+    (None: there is none)."""
+    while prefix and prefix[-1] == 0xFF:
+        prefix = prefix[:-1]
+    return prefix[:-1] + bytes([prefix[-1] + 1]) if prefix else None
+
+
+class TokenIndex:
+    """
+    Per DFA state: the tokens allowed there and the state each leads to.
+    Rows are built on first use (``row``) with a trie walk over the sorted
+    vocabulary; ``save`` persists every built row under `path`.
+    """
+
+    def __init__(self, pattern: str, tokenizer: Any, path: Optional[str] = None) -> None:
+        self.dfa = RegexDFA(pattern)
+        self.vocab = _vocab(tokenizer)
+        self.path = path
+        self._rows: Dict[int, Dict[int, int]] = {}
+        self._masks: Dict[Tuple[int, int, str], torch.Tensor] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+    @property
+    def initial(self) -> int:
+        return self.dfa.initial
+
+    def accepting(self, state: int) -> bool:
+        return state >= 0 and self.dfa.accepting[state]
+
+    def row(self, state: int) -> Dict[int, int]:
+        """{token id: next state} for every token that can follow `state`."""
+        row = self._rows.get(state)
+        if row is None:
+            with self._lock:
+                row = self._rows.get(state)
+                if row is None:
+                    row = self._rows[state] = self._walk(state)
+                    self._dirty = True
+        return row
+
+    def _walk(self, state: int) -> Dict[int, int]:
+        keys, ids, step = self.vocab.keys, self.vocab.ids, self.dfa.step
+        n = len(keys)
+        out: Dict[int, int] = {}
+        stack = [state]  # stack[k]: state after the first k bytes of `prev`
+        prev = b""
+        i = 0
+        while i < n:
+            key = keys[i]
+            k = 0
+            limit = min(len(prev), len(key), len(stack) - 1)
+            while k < limit and prev[k] == key[k]:
+                k += 1
+            del stack[k + 1:]
+            s = stack[-1]
+            dead = False
+            for b in key[k:]:
+                s = step(s, b)
+                if s == DEAD:
+                    dead = True
+                    break
+                stack.append(s)
+            if dead:
+                # every token starting with the rejected prefix is rejected too
+                depth = len(stack)
+                bound = _after(key[:depth])
+                i = n if bound is None else bisect_left(keys, bound, i + 1)
+                prev = key[:depth - 1]
+                continue
+            for tid in ids[i]:
+                out[tid] = s
+            prev = key
+            i += 1
+        return out
+
+    def advance(self, state: int, token: int) -> int:
+        if state < 0:
+            return state
+        return self.row(state).get(token, DEAD)
+
+    def banned(self, state: int, size: int, device: Any, end_ids: Sequence[int]) -> torch.Tensor:
+        """Boolean mask (True = not allowed) over a `size`-wide logits row."""
+        key = (state, size, str(device))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = torch.ones(size, dtype=torch.bool)
+            if state == DONE:
+                mask.zero_()
+            else:
+                allowed = list(self.row(state)) if state >= 0 else []
+                if state < 0 or self.accepting(state) or not allowed:
+                    allowed += list(end_ids)  # may stop here (or has to)
+                allowed = [t for t in allowed if t < size]
+                mask[torch.tensor(allowed, dtype=torch.long)] = False
+            mask = self._masks[key] = mask.to(device)
+        return mask
+
+    def compile(self, max_states: Optional[int] = None) -> int:
+        """Build the rows of every state reachable from the start (eagerly,
+        instead of on first use); returns the number of states."""
+        seen, todo = {self.initial}, [self.initial]
+        while todo and (max_states is None or len(seen) < max_states):
+            for nxt in set(self.row(todo.pop()).values()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    todo.append(nxt)
+        return len(seen)
+
+    # ---------- persistence ----------
+
+    def save(self) -> None:
+        """Write the built rows to `path` (atomically) if any are new."""
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            self._dirty = False
+            rows = dict(self._rows)
+        key = self.dfa.key
+        data = {
+            "version": _INDEX_VERSION,
+            "pattern": self.dfa.pattern,
+            "vocab": self.vocab.fingerprint,
+            "rows": [(key(s), torch.tensor(list(r), dtype=torch.int32),
+                      [key(t) for t in r.values()]) for s, r in rows.items()],
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        torch.save(data, tmp)
+        os.replace(tmp, self.path)
+        logger.debug("Saved %d index rows to %s", len(rows), self.path)
+
+    def _load(self, path: str) -> None:
+        try:
+            data = torch.load(path, weights_only=True)
+        except Exception as e:
+            logger.warning("Ignoring unreadable constraint index %s: %s", path, e)
+            return
+        if (data.get("version") != _INDEX_VERSION or data.get("pattern") != self.dfa.pattern
+                or data.get("vocab") != self.vocab.fingerprint):
+            return
+        state_for = self.dfa.state_for
+        for skey, tokens, nexts in data["rows"]:
+            self._rows[state_for(tuple(skey))] = dict(
+                zip(tokens.tolist(), (state_for(tuple(n)) for n in nexts)))
+        logger.debug("Loaded %d index rows from %s", len(self._rows), path)
+
+
+_indexes: "OrderedDict[Tuple[str, str], TokenIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+MAX_CACHED_INDEXES = 32
+
+
+def token_index(pattern: str, tokenizer: Any, cache_dir: Optional[str] = None) -> TokenIndex:
+    """The TokenIndex for (pattern, tokenizer): from memory, else from
+    `cache_dir` if saved there before, else new."""
+    vocab = _vocab(tokenizer)
+    key = (pattern, vocab.fingerprint)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    path = None
+    if cache_dir is not None:
+        digest = hashlib.blake2b(f"{pattern}\0{vocab.fingerprint}".encode(),
+                                 digest_size=16).hexdigest()
+        path = os.path.join(cache_dir, f"{digest}.pt")
+    index = TokenIndex(pattern, tokenizer, path)
+    with _indexes_lock:
+        index = _indexes.setdefault(key, index)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+class ConstrainedLogitsProcessor(LogitsProcessor):
+    """
+    Masks every row's logits to the tokens its DFA state allows. One
+    instance per generate() call: it tracks each row's state history (so it
+    also copes with assisted decoding rolling back rejected drafts).
+    """
+
+    def __init__(self, index: TokenIndex, end_ids: Iterable[int]) -> None:
+        self.index = index
+        self.end_ids = sorted(end_ids)
+        self._end = set(self.end_ids)
+        self._start: Optional[int] = None
+        self._history: List[List[int]] = []
+
+    def _advance(self, state: int, token: int) -> int:
+        if token in self._end:
+            return DONE
+        return self.index.advance(state, token)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._start is None:
+            self._start = input_ids.shape[1]
+            self._history = [[self.index.initial] for _ in range(input_ids.shape[0])]
+        n = input_ids.shape[1] - self._start
+        if all(len(h) == n for h in self._history):
+            # the usual step: one new token per row
+            for h, token in zip(self._history, input_ids[:, -1].tolist()):
+                h.append(self._advance(h[-1], token))
+        else:
+            for r, h in enumerate(self._history):
+                del h[n + 1:]
+                if len(h) <= n:
+                    new = input_ids[r, self._start + len(h) - 1:].tolist()
+                    for token in new:
+                        h.append(self._advance(h[-1], token))
+        size, device = scores.shape[-1], scores.device
+        masks = [self.index.banned(h[-1], size, device, self.end_ids) for h in self._history]
+        return scores.masked_fill_(torch.stack(masks), float("-inf"))
@@ -0,0 +1,235 @@
+"""
+Incremental detokenization and stop sequences for hflocal.
+
+``IncrementalDetokenizer`` turns a growing list of token ids into text
+deltas by decoding only a small window: ``prefix_offset..read_offset`` is
+text already emitted (kept as context, so tokenizers that merge spaces or
+bytes across tokens decode correctly) and ``read_offset..`` is what is new.
+A delta is released once it no longer ends in an incomplete UTF-8 character,
+so each step costs O(new tokens) instead of re-decoding the whole output.
+
+``StopMatcher`` is an Aho-Corasick automaton over the stop sequences: it is
+fed text deltas, reports the first stop sequence to complete, trims the
+output exactly before it, and holds back only the tail that could still
+turn into one (the depth of the current automaton state).
+
+``TextStream`` pairs the two for one sequence, and ``StopOnText`` adapts a
+batch of them to a generate() stopping criterion, so stop sequences end
+generation without handing the tokenizer to generate().
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+from mlhq.logging_config import get_logger
+from ..metrics import record
+
+logger = get_logger(__name__)
+
+
+class IncrementalDetokenizer:
+    """Decodes one sequence a few tokens at a time; ``push`` returns the new text."""
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True) -> None:
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self._ids: List[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._prefix_text = ""
+
+    def _decode(self, ids: Sequence[int]) -> str:
+        return self.tokenizer.decode(ids, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, ids: Iterable[int]) -> str:
+        self._ids.extend(ids)
+        text = self._decode(self._ids[self._prefix_offset:])
+        if len(text) <= len(self._prefix_text) or text.endswith("\ufffd"):
+            return ""  # nothing printable yet (special token or a partial character)
+        # the tokens just read become the context of the next window
+        self._prefix_offset, self._read_offset = self._read_offset, len(self._ids)
+        delta = text[len(self._prefix_text):]
+        self._prefix_text = self._decode(self._ids[self._prefix_offset:self._read_offset])
+        return delta
+
+    def flush(self) -> str:
+        """Whatever is still held back (e.g. a trailing partial character)."""
+        text = self._decode(self._ids[self._prefix_offset:])
+        delta = text[len(self._prefix_text):]
+        self._prefix_offset = self._read_offset = len(self._ids)
+        self._prefix_text = ""
+        return delta
+
+
+class StopMatcher:
+    """Streaming multi-pattern matcher for stop sequences (Aho-Corasick)."""
+
+    def __init__(self, stops: Iterable[str]) -> None:
+        self.stops = [s for s in stops if s]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._out = [0]  # length of the longest stop sequence ending in this state
+        for s in self.stops:
+            state = 0
+            for ch in s:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._out.append(0)
+                state = nxt
+            self._out[state] = max(self._out[state], len(s))
+        queue = list(self._goto[0].values())
+        for state in queue:  # breadth-first, so fail targets are done first
+            for ch, nxt in self._goto[state].items():
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = max(self._out[nxt], self._out[self._fail[nxt]])
+                queue.append(nxt)
+        self.reset()
+
+    def reset(self) -> None:
+        self._state = 0
+        self._held = ""
+        self.hit = False
+
+    def _step(self, state: int, ch: str) -> int:
+        goto, fail = self._goto, self._fail
+        while state and ch not in goto[state]:
+            state = fail[state]
+        return goto[state].get(ch, 0)
+
+    def feed(self, text: str) -> str:
+        """Feed the next piece of output; returns the part that is safe to
+        emit. After a match ``hit`` is set and everything from the start of
+        the stop sequence on is dropped."""
+        if self.hit or not text:
+            return ""
+        if not self.stops:
+            return text
+        state, out = self._state, self._out
+        for i, ch in enumerate(text):
+            state = self._step(state, ch)
+            if out[state]:
+                self.hit = True
+                kept = self._held + text[:i + 1]
+                return kept[:len(kept) - out[state]]
+        self._state = state
+        kept = self._held + text
+        held = self._depth[state]
+        self._held = kept[len(kept) - held:] if held else ""
+        return kept[:len(kept) - held]
+
+    def flush(self) -> str:
+        """The held-back tail, once the output ends without a match."""
+        held, self._held = self._held, ""
+        return "" if self.hit else held
+
+    def find(self, text: str) -> int:
+        """Index where the first stop sequence to complete in `text` starts, or -1."""
+        state, out = 0, self._out
+        for i, ch in enumerate(text):
+            state = self._step(state, ch)
+            if out[state]:
+                return i + 1 - out[state]
+        return -1
+
+
+class TextStream:
+    """
+    The output text of one sequence as its tokens arrive: incrementally
+    detokenized, cut at the first stop sequence, and finished at an
+    end-of-sequence token. ``push`` returns the text that can be emitted.
+    """
+
+    def __init__(self, tokenizer, stop: Sequence[str] = (), end_ids: Iterable[int] = ()) -> None:
+        self.detokenizer = IncrementalDetokenizer(tokenizer)
+        self.matcher = StopMatcher(stop)
+        self.end_ids = frozenset(end_ids)
+        self.parts: List[str] = []
+        self.done = False
+
+    @property
+    def hit(self) -> bool:
+        return self.matcher.hit
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def push(self, ids: Iterable[int]) -> str:
+        if self.done:
+            return ""
+        new = []
+        for tok in ids:
+            if tok in self.end_ids:
+                self.done = True
+                break
+            new.append(tok)
+        emit = self.matcher.feed(self.detokenizer.push(new)) if new else ""
+        if self.matcher.hit:
+            self.done = True
+        if emit:
+            self.parts.append(emit)
+        return emit
+
+    def finish(self) -> str:
+        """Flush held-back text at the end of generation; returns it."""
+        self.done = True
+        emit = self.matcher.feed(self.detokenizer.flush())
+        emit += self.matcher.flush()
+        if emit:
+            self.parts.append(emit)
+        return emit
+
+
+class StopOnText(StoppingCriteria):
+    """
+    generate() stopping criterion feeding each row's new tokens to its
+    TextStream; rows stop once a stop sequence completes. `on_text(row, text)`
+    receives emitted text as it is produced (for streaming). Decoding time is
+    booked as the ``detokenize`` phase. Setting `cancel` stops every row at
+    the next step (an abandoned stream).
+    """
+
+    def __init__(self, streams: Sequence[TextStream], start: int,
+                 on_text: Optional[Callable[[int, str], None]] = None,
+                 cancel: Optional[threading.Event] = None) -> None:
+        self.streams = list(streams)
+        self.on_text = on_text
+        self.cancel = cancel
+        self._seen = start
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor,
+                 **kwargs) -> torch.BoolTensor:
+        begin = time.perf_counter()
+        new = input_ids[:, self._seen:].tolist()
+        self._seen = input_ids.shape[1]
+        for r, (stream, ids) in enumerate(zip(self.streams, new)):
+            emit = stream.push(ids)
+            if emit and self.on_text is not None:
+                self.on_text(r, emit)
+        record("detokenize", time.perf_counter() - begin)
+        if self.cancel is not None and self.cancel.is_set():
+            return torch.ones(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        return torch.tensor([s.hit for s in self.streams], device=input_ids.device)
+
+    def finish(self) -> List[Tuple[str, bool]]:
+        """Flush every row; returns (text, hit) per row."""
+        out = []
+        for r, stream in enumerate(self.streams):
+            emit = stream.finish()
+            if emit and self.on_text is not None:
+                self.on_text(r, emit)
+            out.append((stream.text, stream.hit))
+        return out
@@ -0,0 +1,172 @@
+"""
+KV-cache memory budgeting and admission control for hflocal.
+
+Before a generate() call (a batch, a stream or a continuous-batching
+request) runs, its peak footprint is estimated from the model config:
+
+    KV cache     rows * (prompt + max_new_tokens) * layers * 2 (K and V)
+                 * kv_heads * head_dim * bytes per element
+    activations  rows * prompt * (4 * hidden + 2 * intermediate) * bytes
+                 + rows * heads * prompt^2 * bytes   (attention scores)
+                 + rows * vocab * 4                  (last-position logits)
+
+(a draft model's own cache is added for assisted decoding). `MemoryBudget`
+admits a request only while the estimates of everything running fit in
+``kv_memory_budget`` bytes: with ``kv_budget_policy="queue"`` the caller
+waits (up to ``kv_budget_timeout`` seconds) for running requests to release
+their reservation, with ``"reject"`` it gets `MemoryBudgetExceeded` at once.
+A request larger than the whole budget is a ValueError either way.
+
+The estimates are deliberately simple upper-bound-ish figures for the
+default (SDPA/eager) attention on CPU; ``MemoryBudget.stats()`` reports
+reserved bytes next to the budget so the margin can be tuned.
+"""
+from __future__ import annotations
+from typing import Any, Dict, Iterator, Optional
+from contextlib import contextmanager
+import threading
+import time
+
+from ..metrics import record
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+POLICIES = ("queue", "reject")
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    """The request does not fit in the memory budget right now."""
+
+
+class Footprint:
+    """Per-model constants for `estimate` (read once from the config)."""
+
+    def __init__(self, model: Any) -> None:
+        cfg = getattr(model.config, "text_config", None) or model.config
+        heads = cfg.num_attention_heads
+        self.layers = cfg.num_hidden_layers
+        self.heads = heads
+        self.kv_heads = getattr(cfg, "num_key_value_heads", None) or heads
+        self.head_dim = getattr(cfg, "head_dim", None) or cfg.hidden_size // heads
+        self.hidden = cfg.hidden_size
+        self.intermediate = getattr(cfg, "intermediate_size", None) or 4 * cfg.hidden_size
+        self.vocab = cfg.vocab_size
+        # activations / KV use the embedding dtype (fp32 for dynamic int8 too)
+        self.itemsize = model.get_input_embeddings().weight.element_size()
+
+    @property
+    def kv_bytes_per_token(self) -> int:
+        return 2 * self.layers * self.kv_heads * self.head_dim * self.itemsize
+
+    def estimate(self, rows: int, prompt_tokens: int, max_new_tokens: int) -> int:
+        """Peak bytes of one generate() call over `rows` padded prompts."""
+        kv = (prompt_tokens + max_new_tokens) * self.kv_bytes_per_token
+        activations = (prompt_tokens * (4 * self.hidden + 2 * self.intermediate) * self.itemsize
+                       + self.heads * prompt_tokens * prompt_tokens * self.itemsize
+                       + self.vocab * 4)
+        return rows * (kv + activations)
+
+
+class MemoryBudget:
+    """Reservations against a byte budget, shared by every generate() path
+    of one client."""
+
+    def __init__(self, budget: int, policy: str = "queue",
+                 timeout: Optional[float] = None) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"kv_budget_policy must be one of {POLICIES}, not {policy!r}")
+        self.budget = int(budget)
+        self.policy = policy
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._reserved = 0
+        self._peak = 0
+        self._running = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = 0
+        self._wait_s = 0.0
+
+    def check(self, nbytes: int) -> None:
+        """ValueError if `nbytes` could never be admitted (more than the whole
+        budget); lets a multi-batch call fail before generating anything."""
+        if nbytes > self.budget:
+            with self._cond:
+                self._rejected += 1
+            raise ValueError(f"request needs ~{_size(nbytes)} of KV cache and activations, "
+                             f"more than the whole budget ({_size(self.budget)}); lower "
+                             "max_new_tokens or the prompt/batch size")
+
+    def acquire(self, nbytes: int) -> int:
+        """Reserve `nbytes` (waiting or raising per the policy); returns the
+        reservation to hand back to `release`. Time spent waiting is booked as
+        the request's ``queue`` phase."""
+        self.check(nbytes)
+        with self._cond:
+            if self._reserved + nbytes > self.budget:
+                if self.policy == "reject":
+                    self._rejected += 1
+                    raise MemoryBudgetExceeded(self._busy(nbytes))
+                start = time.perf_counter()
+                self._waiting += 1
+                self._queued += 1
+                try:
+                    fits = self._cond.wait_for(lambda: self._reserved + nbytes <= self.budget,
+                                               self.timeout)
+                finally:
+                    self._waiting -= 1
+                waited = time.perf_counter() - start
+                self._wait_s += waited
+                record("queue", waited)
+                if not fits:
+                    self._rejected += 1
+                    raise MemoryBudgetExceeded(self._busy(nbytes))
+            self._reserved += nbytes
+            self._peak = max(self._peak, self._reserved)
+            self._running += 1
+            self._admitted += 1
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self._reserved -= nbytes
+            self._running -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[None]:
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def _busy(self, nbytes: int) -> str:
+        return (f"memory budget busy: request needs ~{_size(nbytes)}, "
+                f"{_size(self._reserved)} of {_size(self.budget)} reserved")
+
+    def stats(self) -> Dict[str, Any]:
+        """Budget and currently reserved bytes (plus the peak), requests
+        running / waiting, and admitted, queued and rejected counts."""
+        with self._cond:
+            return {
+                "budget_bytes": self.budget,
+                "reserved_bytes": self._reserved,
+                "peak_reserved_bytes": self._peak,
+                "utilization": self._reserved / self.budget if self.budget else 0.0,
+                "running": self._running,
+                "waiting": self._waiting,
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": self._rejected,
+                "wait_s": self._wait_s,
+            }
+
+
+def _size(nbytes: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if nbytes < 1024:
+            return f"{nbytes:.0f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} GiB"
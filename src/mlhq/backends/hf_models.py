@@ -0,0 +1,395 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from dataclasses import dataclass
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import torch
+import transformers
+from transformers import AutoModel, AutoTokenizer, AutoModelForCausalLM
+
+from ..metrics import phase
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+def default_device() -> str:
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+# short names accepted for ClientConfig.torch_dtype
+DTYPE_ALIASES = {"fp32": "float32", "bf16": "bfloat16", "fp16": "float16"}
+QUANTIZATIONS = ("int8",)
+
+
+def model_nbytes(model) -> int:
+    n = sum(t.nbytes for t in model.parameters()) + sum(t.nbytes for t in model.buffers())
+    # dynamically quantized Linear layers keep packed int8 weights outside parameters()
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if packed is not None and hasattr(packed, "_weight_bias"):
+            weight, bias = packed._weight_bias()
+            n += weight.element_size() * weight.numel()
+            n += bias.nbytes if bias is not None else 0
+    return n
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations
+    quantized on the fly); CPU only, from float32 weights."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def compile_forward(model, backend: str = "inductor") -> None:
+    """
+    Wrap ``model.forward`` in torch.compile (dynamic shapes, since prompt and
+    cache lengths change every call). Compilation happens lazily on the
+    first forward; if it fails there (e.g. no working C++ toolchain for
+    inductor) the model falls back to eager instead of failing the request.
+    """
+    eager = model.forward
+    compiled = torch.compile(eager, backend=backend, dynamic=True)
+
+    def forward(*args, **kwargs):
+        try:
+            return compiled(*args, **kwargs)
+        except Exception as e:
+            logger.warning("torch.compile(backend=%r) failed, running eager: %s", backend, e)
+            model.forward = eager
+            return eager(*args, **kwargs)
+
+    model.forward = forward
+
+
+# what a registry entry is loaded as
+MODEL_CLASSES = {"causal-lm": AutoModelForCausalLM, "embedding": AutoModel}
+
+
+def _variant(quantization: Optional[str], compile: Union[bool, str],
+             task: str = "causal-lm") -> str:
+    parts = [task] if task != "causal-lm" else []
+    if quantization:
+        parts.append(quantization)
+    if compile:
+        parts.append("compile" if compile is True else f"compile-{compile}")
+    return "+".join(parts) or "eager"
+
+
+# ---------- mmap'd safetensors ----------
+
+_ST_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def safetensors_files(name: str) -> List[str]:
+    """The *.safetensors shards of a local model dir or an already-downloaded hub id."""
+    path = name
+    if not os.path.isdir(path):
+        from huggingface_hub import snapshot_download
+        path = snapshot_download(name, local_files_only=True)
+    return sorted(glob.glob(os.path.join(path, "*.safetensors")))
+
+
+def mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of one safetensors file as views of a copy-on-write mmap of it:
+    no bytes are read up front, and every process mapping the same file
+    shares its page-cache pages for as long as nobody writes to them.
+    """
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    base = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = _ST_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        count = (end - start) // dtype.itemsize
+        if count:
+            t = torch.frombuffer(buf, dtype=dtype, count=count, offset=base + start)
+        else:
+            t = torch.empty(0, dtype=dtype)
+        tensors[name] = t.view(info["shape"])
+    return tensors
+
+
+def share_weights(model, name: str) -> int:
+    """
+    Swap the parameters of a loaded `model` for mmap'd views of its
+    safetensors checkpoint, freeing the private copies, so N processes
+    serving the same weights hold them in RAM once. Only parameters whose
+    dtype and shape match the file (i.e. not quantized or cast ones) are
+    swapped. Returns the number of bytes now backed by the mapping.
+    """
+    files = safetensors_files(name)
+    if not files:
+        logger.warning("No safetensors files for %s; weights stay private", name)
+        return 0
+    mapped: Dict[str, torch.Tensor] = {}
+    for path in files:
+        mapped.update(mmap_safetensors(path))
+    shared = 0
+    for pname, param in list(model.named_parameters()):
+        t = mapped.get(pname)
+        if t is None or t.shape != param.shape or t.dtype != param.dtype:
+            continue
+        module_name, _, attr = pname.rpartition(".")
+        module = model.get_submodule(module_name) if module_name else model
+        module._parameters[attr] = torch.nn.Parameter(t, requires_grad=False)
+        shared += t.nbytes
+    model.tie_weights()  # re-point tied heads at the swapped embedding
+    return shared
+
+
+# ---------- persisted snapshots ----------
+
+def _source_fingerprint(name: str) -> List[Tuple[str, int, int]]:
+    """(file, size, mtime) of the checkpoint files, so edits invalidate snapshots."""
+    path = name
+    if not os.path.isdir(path):
+        from huggingface_hub import snapshot_download
+        path = snapshot_download(name, local_files_only=True)  # commit hash is in the path
+    files = [os.path.join(path, "config.json")]
+    files += glob.glob(os.path.join(path, "*.safetensors")) + glob.glob(os.path.join(path, "*.bin"))
+    return sorted((os.path.relpath(f, path) if os.path.isdir(name) else f,
+                   os.stat(f).st_size, os.stat(f).st_mtime_ns)
+                  for f in files if os.path.exists(f))
+
+
+def snapshot_path(snapshot_dir: str, name: str, dtype_name: str, device: str,
+                  variant: str) -> str:
+    """
+    Directory of the post-processed snapshot for one registry variant. The
+    name hashes the source files and the torch/transformers versions (the
+    snapshot is a pickled module), so any change to them means a rebuild.
+    """
+    manifest = {"name": os.path.abspath(name) if os.path.isdir(name) else name,
+                "dtype": dtype_name, "device": device, "variant": variant,
+                "source": _source_fingerprint(name), "torch": torch.__version__,
+                "transformers": transformers.__version__}
+    digest = hashlib.blake2b(json.dumps(manifest, sort_keys=True).encode(),
+                             digest_size=8).hexdigest()
+    label = os.path.basename(os.path.normpath(name)).replace("/", "--")
+    return os.path.join(snapshot_dir, f"{label}-{dtype_name}-{variant}-{digest}")
+
+
+def save_snapshot(path: str, model, tokenizer) -> None:
+    """Write `model` (after dtype conversion / quantization) and its tokenizer
+    to `path`, atomically: readers never see a half-written snapshot."""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    tokenizer.save_pretrained(tmp)
+    torch.save(model, os.path.join(tmp, "model.pt"))
+    try:
+        os.rename(tmp, path)
+    except OSError:  # another process got there first
+        import shutil
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_snapshot(path: str):
+    """(model, tokenizer) from `path`; tensors are mmap'd, not read up front.
+    Only load snapshots this process (or a trusted one) wrote: model.pt is a
+    pickle."""
+    tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True)
+    model = torch.load(os.path.join(path, "model.pt"), mmap=True, weights_only=False)
+    return model.eval(), tokenizer
+
+
+@dataclass
+class LoadedModel:
+    key: Tuple[str, ...]
+    model: Any
+    tokenizer: Any
+    nbytes: int
+    refs: int = 0
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded HF models + tokenizers, keyed by
+    (name, dtype, device, variant) and reference counted, so every
+    HFLocalClient asking for the same weights shares one copy. The variant
+    names post-load transforms (int8 quantization, torch.compile).
+
+    Weights are loaded with ``low_cpu_mem_usage`` (safetensors are mmap'd
+    into a meta-initialised model, no second copy in RAM). With a
+    `snapshot_dir`, a model that needed converting (torch_dtype) or
+    quantizing is saved after that work, and later loads map the snapshot
+    instead of redoing it. Load phases are recorded with ``metrics.phase``.
+
+    Released models stay warm; when the total size of loaded models goes
+    over `memory_budget` bytes, idle (refs == 0) models are dropped least
+    recently used first. Models still in use are never evicted. The budget
+    is process-wide: set it with `configure_model_registry`; a client's
+    ``model_memory_budget`` only ever raises it (`raise_budget`).
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None) -> None:
+        self.memory_budget = memory_budget
+        self._models: "OrderedDict[Tuple[str, ...], LoadedModel]" = OrderedDict()
+        self._loading: Dict[Tuple[str, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(name: str, dtype: Any = None, device: Optional[str] = None,
+            quantization: Optional[str] = None, compile: Union[bool, str] = False,
+            task: str = "causal-lm") -> Tuple[str, ...]:
+        dtype = DTYPE_ALIASES.get(dtype, dtype) if isinstance(dtype, str) else dtype
+        return (name, str(dtype or "auto"), device or default_device(),
+                _variant(quantization, compile, task))
+
+    def acquire(self, name: str, *, dtype: Any = None, device: Optional[str] = None,
+                quantization: Optional[str] = None, compile: Union[bool, str] = False,
+                task: str = "causal-lm", snapshot_dir: Optional[str] = None,
+                **load_kwargs: Any) -> LoadedModel:
+        """
+        Shared model for `name`, loading it on first use. `task` picks the
+        class: "causal-lm" (AutoModelForCausalLM) or "embedding" (AutoModel).
+        """
+        if task not in MODEL_CLASSES:
+            raise ValueError(f"Unknown task {task!r}; choose from {sorted(MODEL_CLASSES)}")
+        key = self.key(name, dtype, device, quantization, compile, task)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry.refs += 1
+                self._models.move_to_end(key)
+                return entry
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        # load outside the registry lock; concurrent acquires of the same key
+        # wait here instead of loading a second copy
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    entry.refs += 1
+                    self._models.move_to_end(key)
+                    return entry
+            entry = self._load(key, dtype, quantization, compile, task, snapshot_dir,
+                               **load_kwargs)
+            with self._lock:
+                entry.refs = 1
+                self._models[key] = entry
+                self._loading.pop(key, None)
+                self._evict()
+        return entry
+
+    def release(self, entry: LoadedModel) -> None:
+        with self._lock:
+            entry.refs = max(entry.refs - 1, 0)
+            self._evict()
+
+    def _load(self, key, dtype, quantization=None, compile=False, task="causal-lm",
+              snapshot_dir=None, **load_kwargs) -> LoadedModel:
+        name, dtype_name, device, variant = key
+        logger.info("Loading %s (dtype=%s, device=%s, %s)", name, dtype_name, device, variant)
+        if quantization is not None:
+            if quantization not in QUANTIZATIONS:
+                raise ValueError(f"Unknown quantization {quantization!r}; "
+                                 f"choose from {QUANTIZATIONS}")
+            if device != "cpu" or dtype_name not in ("auto", "float32", "torch.float32"):
+                raise ValueError("int8 dynamic quantization needs float32 weights on cpu")
+        snapshot = None
+        if snapshot_dir and (dtype is not None or quantization):
+            # compile is redone every start (inductor keeps its own cache)
+            snapshot = snapshot_path(snapshot_dir, name, dtype_name, device,
+                                     _variant(quantization, False, task))
+        if snapshot is not None and os.path.exists(os.path.join(snapshot, "model.pt")):
+            with phase("load_snapshot"):
+                model, tokenizer = load_snapshot(snapshot)
+            logger.info("Loaded snapshot %s", snapshot)
+        else:
+            with phase("load_tokenizer"):
+                tokenizer = AutoTokenizer.from_pretrained(name, local_files_only=True)
+            if isinstance(dtype, str):
+                dtype = DTYPE_ALIASES.get(dtype, dtype)
+            with phase("load_weights"):
+                model = MODEL_CLASSES[task].from_pretrained(
+                    name, local_files_only=True, torch_dtype=dtype, low_cpu_mem_usage=True,
+                    **load_kwargs
+                )
+            with phase("to_device"):
+                model = model.to(device).eval()
+            if quantization == "int8":
+                with phase("quantize"):
+                    model = quantize_int8(model)
+            if snapshot is not None:
+                with phase("save_snapshot"):
+                    save_snapshot(snapshot, model, tokenizer)
+                logger.info("Saved snapshot %s", snapshot)
+        if compile:
+            compile_forward(model, "inductor" if compile is True else compile)
+        self.loads += 1
+        return LoadedModel(key, model, tokenizer, model_nbytes(model))
+
+    def raise_budget(self, nbytes: int) -> None:
+        """Set `memory_budget` if none is set, else raise it to `nbytes`;
+        never lowers a limit other clients of the process rely on."""
+        with self._lock:
+            if self.memory_budget is None or nbytes > self.memory_budget:
+                self.memory_budget = nbytes
+            elif nbytes < self.memory_budget:
+                logger.info("Model memory budget stays at %d bytes (process-wide), "
+                            "not lowered to %d", self.memory_budget, nbytes)
+
+    def _evict(self) -> None:
+        if self.memory_budget is None:
+            return
+        total = sum(e.nbytes for e in self._models.values())
+        for key in list(self._models):
+            if total <= self.memory_budget:
+                break
+            entry = self._models[key]
+            if entry.refs == 0:
+                logger.info("Evicting idle model %s", key)
+                del self._models[key]
+                total -= entry.nbytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": {"/".join(k): {"refs": e.refs, "bytes": e.nbytes}
+                           for k, e in self._models.items()},
+                "bytes": sum(e.nbytes for e in self._models.values()),
+                "memory_budget": self.memory_budget,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    """The process-wide registry used by every HFLocalClient."""
+    return _registry
+
+
+def configure_model_registry(*, memory_budget: Optional[int] = None) -> ModelRegistry:
+    """Set the registry's `memory_budget` (bytes of loaded models to keep,
+    None = no limit) for every HFLocalClient in the process; idle models
+    over the new budget are evicted right away."""
+    with _registry._lock:
+        _registry.memory_budget = memory_budget
+        _registry._evict()
+    return _registry
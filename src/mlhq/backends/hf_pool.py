@@ -0,0 +1,677 @@
+"""
+``hflocal-pool``: N worker processes, each running its own HFLocalClient.
+
+One Python process leaves most cores of a big CPU box idle (and threaded
+callers share one GIL), so this backend spawns `pool_workers` processes.
+Each worker pins itself to its own slice of cores (`pool_threads` intra-op
+threads, CPU affinity on Linux) and, after loading, swaps its parameters
+for read-only mmap views of the model's safetensors files
+(`hf_models.share_weights`): the weights sit in the page cache once, not
+once per worker.
+
+Calls travel over one multiprocessing pipe per worker and go to the worker
+with the fewest requests in flight; list prompts are split across workers.
+Workers that die are respawned (their in-flight calls fail), and
+``pool.restart()`` replaces workers one at a time, draining each first, so
+the pool keeps serving. ``pool.stats()`` reports per-worker and pool-wide
+throughput.
+
+The parent process never imports torch: everything model related happens
+in the workers.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from concurrent.futures import Future
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+from ..cache import samples_by_default
+from ..metrics import current_timings
+from ..types import MLHQAsyncStream, MLHQStream
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+# HFLocalClient arguments forwarded to every worker
+_CLIENT_KEYS = ("max_batch_size", "max_batch_tokens", "continuous_batching",
+                "prefix_cache_max_bytes", "torch_dtype", "quantization", "compile",
+                "draft_model", "draft_tokens", "embedding_model", "embedding_pooling",
+                "snapshot_dir", "warmup", "warmup_tokens", "constraint_cache_dir",
+                "kv_memory_budget", "kv_budget_policy", "kv_budget_timeout")
+_STOP = None  # parent -> worker: finish what is queued, then exit
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpus(workers: Optional[int], threads: Optional[int],
+              cpus: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """
+    Split the usable cores into one contiguous slice per worker. By default
+    every worker gets 4 cores (at least one worker); when the pool asks for
+    more cores than exist, slices wrap around and share.
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    if workers is None:
+        workers = max(1, len(cpus) // (threads or 4))
+    if threads is None:
+        threads = max(1, len(cpus) // workers)
+    return [[cpus[(i * threads + j) % len(cpus)] for j in range(threads)]
+            for i in range(workers)]
+
+
+# ---------- worker process ----------
+
+def _worker_main(conn, index: int, cpus: List[int], model: str,
+                 client_kwargs: Dict[str, Any], share: bool) -> None:
+    # thread counts must be set before torch initializes its pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(len(cpus))
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    try:
+        import torch
+        from .hf_backend import HFLocalClient
+        from .hf_models import share_weights
+        from ..metrics import Timings, timed_request
+
+        torch.set_num_threads(len(cpus))
+        client = HFLocalClient(model, **client_kwargs)
+        shared = share_weights(client.model, model) if share else 0
+    except BaseException as e:
+        conn.send(("startup", "error", _portable(e)))
+        return
+    conn.send(("startup", "ok", {"pid": os.getpid(), "cpus": cpus,
+                                 "shared_weight_bytes": shared,
+                                 "startup": client.startup_timings}))
+
+    # a reader thread queues requests so we know how long each one waited
+    inbox: "queue.Queue[Any]" = queue.Queue()
+
+    def read():
+        try:
+            while True:
+                msg = conn.recv()
+                inbox.put((time.perf_counter(), msg))
+                if msg is _STOP:
+                    return
+        except (EOFError, OSError):  # parent went away
+            inbox.put((time.perf_counter(), _STOP))
+
+    threading.Thread(target=read, name="mlhq-pool-reader", daemon=True).start()
+    methods = {
+        "text_generation": client.text_generation,
+        "chat_completion": client.chat_completion,
+        "chat_completion_batch": client.chat_completion_batch,
+        "embed": client.embed,
+    }
+    while True:
+        received, msg = inbox.get()
+        if msg is _STOP:
+            break
+        req_id, method, args, kwargs = msg
+        timings = Timings()
+        timings.add("queue", time.perf_counter() - received)
+        details = kwargs.get("details", False)
+        if method == "text_generation" and not kwargs.get("stream"):
+            kwargs["details"] = True  # so tokens can be counted; stripped below
+        try:
+            with timed_request(timings):
+                result = methods[method](*args, **kwargs)
+                if isinstance(result, MLHQStream):
+                    for chunk in result:
+                        conn.send((req_id, "chunk", chunk))
+                    tokens = _completion_tokens(result.response)
+                    result = None
+                else:
+                    tokens = _completion_tokens(result)
+                    if method == "text_generation" and not details:
+                        result = ([r.text for r in result] if isinstance(result, list)
+                                  else result.text)
+            conn.send((req_id, "ok", (result, timings.phases, tokens)))
+        except Exception as e:
+            conn.send((req_id, "error", _portable(e)))
+    client.close()
+    conn.close()
+
+
+def _portable(e: BaseException) -> BaseException:
+    """`e` if it survives pickling, else a RuntimeError carrying its repr."""
+    import pickle
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(repr(e))
+
+
+# ---------- parent side ----------
+
+class _Call:
+    """One in-flight request: a future, or a chunk queue for streams."""
+    __slots__ = ("future", "chunks", "timings")
+
+    def __init__(self, stream: bool) -> None:
+        self.future: Future = Future()
+        self.chunks: Optional["queue.Queue[Any]"] = queue.Queue() if stream else None
+        # streams are consumed after dispatch returns: keep the caller's recorder
+        self.timings = current_timings()
+
+
+class _Worker:
+    def __init__(self, index: int, cpus: List[int]) -> None:
+        self.index = index
+        self.cpus = cpus
+        self.process: Any = None
+        self.conn: Any = None
+        self.info: Dict[str, Any] = {}
+        self.calls: Dict[int, _Call] = {}
+        self.send_lock = threading.Lock()
+        self.draining = False
+        self.alive = False
+        self.requests = 0
+        self.errors = 0
+        self.tokens = 0
+        self.busy_s = 0.0
+        self.restarts = 0
+
+    @property
+    def outstanding(self) -> int:
+        return len(self.calls)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": self.info.get("pid"),
+            "cpus": self.cpus,
+            "alive": self.alive,
+            "draining": self.draining,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "completion_tokens": self.tokens,
+            "busy_s": self.busy_s,
+            "restarts": self.restarts,
+            "shared_weight_bytes": self.info.get("shared_weight_bytes", 0),
+            "startup_s": (self.info.get("startup") or {}).get("total"),
+            **_memory(self.info.get("pid") if self.alive else None),
+        }
+
+
+class WorkerPool:
+    """
+    Spawns and supervises the worker processes and routes calls to them.
+
+    `submit(method, args, kwargs)` returns a concurrent Future (or, with
+    ``stream=True``, an MLHQStream) for the least-loaded live worker.
+    """
+
+    def __init__(self, model: str, *, workers: Optional[int] = None,
+                 threads: Optional[int] = None, share_weights: bool = True,
+                 start_timeout: float = 600.0, **client_kwargs: Any) -> None:
+        self.model = model
+        self._client_kwargs = client_kwargs
+        self._share = share_weights
+        self._start_timeout = start_timeout
+        self._ctx = mp.get_context("spawn")
+        self._lock = threading.Condition()
+        self._ids = itertools.count()
+        self._closed = False
+        self.started = time.monotonic()
+        self.workers = [_Worker(i, cpus) for i, cpus in enumerate(plan_cpus(workers, threads))]
+        # load all workers in parallel, fail fast if any cannot start
+        errors = []
+        starters = [threading.Thread(target=lambda w=w: self._guard(self._start, w, errors))
+                    for w in self.workers]
+        for t in starters:
+            t.start()
+        for t in starters:
+            t.join()
+        if errors:
+            self.close()
+            raise errors[0]
+        logger.info("hflocal-pool: %d workers serving %s", len(self.workers), model)
+
+    @staticmethod
+    def _guard(fn: Callable[..., Any], worker: _Worker, errors: List[BaseException]) -> None:
+        try:
+            fn(worker)
+        except BaseException as e:
+            errors.append(e)
+
+    def _start(self, worker: _Worker) -> None:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child, worker.index, worker.cpus, self.model, self._client_kwargs, self._share),
+            name=f"mlhq-pool-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        if not parent.poll(self._start_timeout):
+            process.kill()
+            raise RuntimeError(f"hflocal-pool worker {worker.index} did not start "
+                               f"within {self._start_timeout}s")
+        try:
+            _, status, payload = parent.recv()
+        except EOFError:
+            raise RuntimeError(f"hflocal-pool worker {worker.index} exited during startup "
+                               f"(exit code {process.join(5) or process.exitcode})") from None
+        if status == "error":
+            process.join(5)
+            raise payload
+        with self._lock:
+            worker.process, worker.conn, worker.info = process, parent, payload
+            worker.alive, worker.draining = True, False
+            self._lock.notify_all()
+        threading.Thread(target=self._read, args=(worker, parent), daemon=True,
+                         name=f"mlhq-pool-read-{worker.index}").start()
+        logger.debug("hflocal-pool worker %d up: pid %s, cpus %s", worker.index,
+                     payload["pid"], worker.cpus)
+
+    def _read(self, worker: _Worker, conn: Any) -> None:
+        """Resolve calls from one worker's replies until its pipe closes."""
+        try:
+            while True:
+                req_id, status, payload = conn.recv()
+                with self._lock:
+                    call = worker.calls.get(req_id)
+                if call is None:
+                    continue
+                if status == "chunk":
+                    call.chunks.put(payload)
+                    continue
+                with self._lock:
+                    worker.calls.pop(req_id, None)
+                    if status == "ok":
+                        result, phases, tokens = payload
+                        payload = (result, phases)
+                        worker.busy_s += sum(v for k, v in phases.items() if k != "queue")
+                        worker.tokens += tokens
+                    else:
+                        worker.errors += 1
+                    self._lock.notify_all()
+                if status == "ok":
+                    call.future.set_result(payload)
+                else:
+                    call.future.set_exception(payload)
+                if call.chunks is not None:
+                    call.chunks.put(_STOP)
+        except (EOFError, OSError):
+            pass
+        self._lost(worker, conn)
+
+    def _lost(self, worker: _Worker, conn: Any) -> None:
+        with self._lock:
+            if worker.conn is not conn:  # already replaced by a restart
+                return
+            worker.alive = False
+            calls, worker.calls = worker.calls, {}
+            self._lock.notify_all()
+            respawn = not self._closed and not worker.draining
+        for call in calls.values():
+            call.future.set_exception(RuntimeError(
+                f"hflocal-pool worker {worker.index} exited with a request in flight"))
+            if call.chunks is not None:
+                call.chunks.put(_STOP)
+        if respawn:
+            logger.warning("hflocal-pool worker %d died (exit code %s); respawning",
+                           worker.index, worker.process.exitcode)
+            worker.restarts += 1
+            try:
+                self._start(worker)
+            except BaseException:
+                logger.exception("hflocal-pool worker %d failed to restart", worker.index)
+
+    def _pick(self) -> _Worker:
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError("hflocal-pool is closed")
+                ready = [w for w in self.workers if w.alive and not w.draining]
+                if ready:
+                    return min(ready, key=lambda w: (w.outstanding, w.requests))
+                # everything restarting: wait for a worker to come back
+                if not self._lock.wait(timeout=self._start_timeout):
+                    raise RuntimeError("no hflocal-pool worker available")
+
+    def submit(self, method: str, args: tuple = (), kwargs: Optional[Dict[str, Any]] = None,
+               worker: Optional[_Worker] = None) -> Any:
+        kwargs = kwargs or {}
+        stream = bool(kwargs.get("stream"))
+        call = _Call(stream)
+        req_id = next(self._ids)
+        with self._lock:
+            worker = worker or self._pick()
+            worker.calls[req_id] = call
+            worker.requests += 1
+            conn = worker.conn
+        try:
+            with worker.send_lock:
+                conn.send((req_id, method, args, kwargs))
+        except (OSError, ValueError) as e:
+            with self._lock:
+                worker.calls.pop(req_id, None)
+            raise RuntimeError(f"hflocal-pool worker {worker.index} is gone") from e
+        if stream:
+            return self._stream(call)
+        return call.future
+
+    def _stream(self, call: _Call) -> MLHQStream:
+        def chunks():
+            for chunk in iter(call.chunks.get, _STOP):
+                yield chunk
+            _, phases = call.future.result()
+            _book(call.timings, phases)
+
+        return MLHQStream(chunks(), model=self.model, provider="hflocal")
+
+    def call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """Run one call on the least-loaded worker and wait for it."""
+        result = self.submit(method, args, kwargs)
+        if isinstance(result, MLHQStream):
+            return result
+        value, phases = result.result()
+        _book(current_timings(), phases)
+        return value
+
+    def map(self, method: str, items: List[Any], **kwargs: Any) -> List[Any]:
+        """Split `items` (prompts / conversations) into one contiguous slice per
+        live worker, run the slices in parallel, and return results in order."""
+        if not items:
+            return []
+        with self._lock:
+            n = max(1, sum(1 for w in self.workers if w.alive and not w.draining))
+        size = -(-len(items) // n)
+        futures = [self.submit(method, (items[i:i + size],), kwargs)
+                   for i in range(0, len(items), size)]
+        results: List[Any] = []
+        phases: Dict[str, float] = {}
+        for f in futures:
+            value, worker_phases = f.result()
+            results.extend(value)
+            # slices ran side by side: keep the longest of each phase
+            for name, seconds in worker_phases.items():
+                phases[name] = max(phases.get(name, 0.0), seconds)
+        _book(current_timings(), phases)
+        return results
+
+    def restart(self, index: Optional[int] = None, timeout: Optional[float] = None) -> None:
+        """
+        Gracefully replace worker `index` (or every worker, one at a time):
+        stop routing to it, let its in-flight calls finish, then stop and
+        respawn it. The rest of the pool keeps serving meanwhile.
+
+        If a worker still has calls in flight after `timeout` seconds, it is
+        put back in service untouched and TimeoutError is raised (workers
+        already restarted stay restarted).
+        """
+        targets = self.workers if index is None else [self.workers[index]]
+        for worker in targets:
+            with self._lock:
+                worker.draining = True
+                if not self._lock.wait_for(lambda: not worker.calls, timeout=timeout):
+                    worker.draining = False
+                    in_flight = len(worker.calls)
+                    logger.warning("hflocal-pool worker %d still has %d calls after %.1fs; "
+                                   "not restarting it", worker.index, in_flight, timeout)
+                    raise TimeoutError(f"worker {worker.index} did not drain within "
+                                       f"{timeout}s ({in_flight} calls in flight)")
+                conn, process = worker.conn, worker.process
+            self._stop(worker, conn, process)
+            worker.restarts += 1
+            self._start(worker)
+
+    def _stop(self, worker: _Worker, conn: Any, process: Any, timeout: float = 30.0) -> None:
+        try:
+            with worker.send_lock:
+                conn.send(_STOP)
+        except (OSError, ValueError):
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning("hflocal-pool worker %d did not exit; killing it", worker.index)
+            process.kill()
+            process.join()
+        with self._lock:
+            worker.alive = False
+        conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            workers = [w.stats() for w in self.workers]
+        uptime = time.monotonic() - self.started
+        tokens = sum(w["completion_tokens"] for w in workers)
+        busy = sum(w["busy_s"] for w in workers)
+        return {
+            "workers": workers,
+            "alive": sum(w["alive"] for w in workers),
+            "outstanding": sum(w["outstanding"] for w in workers),
+            "requests": sum(w["requests"] for w in workers),
+            "errors": sum(w["errors"] for w in workers),
+            "completion_tokens": tokens,
+            "uptime_s": uptime,
+            "tokens_per_s": tokens / uptime if uptime else 0.0,
+            # fraction of worker-seconds spent generating
+            "utilization": busy / (uptime * len(workers)) if uptime else 0.0,
+            "restarts": sum(w["restarts"] for w in workers),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+        for worker in self.workers:
+            if worker.process is not None and worker.conn is not None:
+                worker.draining = True
+                self._stop(worker, worker.conn, worker.process)
+
+
+def _memory(pid: Optional[int]) -> Dict[str, Optional[float]]:
+    """RSS and PSS (shared pages split between the processes mapping them) of
+    `pid` in MB; PSS is what actually grows per worker. Linux only."""
+    out: Dict[str, Optional[float]] = {"rss_mb": None, "pss_mb": None}
+    if pid is None:
+        return out
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    out[key.lower() + "_mb"] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return out
+
+
+def _completion_tokens(result: Any) -> int:
+    results = result if isinstance(result, list) else [result]
+    return sum((getattr(r, "usage", None) or {}).get("completion_tokens") or 0 for r in results)
+
+
+def _book(timings: Any, phases: Dict[str, float]) -> None:
+    """Fold a worker's phase timings into the caller's request timings."""
+    if timings is not None:
+        for name, seconds in phases.items():
+            timings.add(name, seconds)
+
+
+# ---------- backends ----------
+
+class _PoolChatCompletions:
+    def __init__(self, pool: WorkerPool): self._pool = pool
+    def create(self, *, messages, **kwargs: Any):
+        return self._pool.call("chat_completion", messages, **kwargs)
+
+class _PoolEmbeddings:
+    def __init__(self, pool: WorkerPool): self._pool = pool
+    def create(self, *, input, model=None, **kwargs: Any):
+        return self._pool.call("embed", input, **kwargs)
+
+class _PoolChat:
+    def __init__(self, completions: Any):
+        self._completions = completions
+    @property
+    def completions(self) -> Any:
+        return self._completions
+
+
+class HFPoolBackend:
+    def __init__(
+        self,
+        *,
+        model,
+        pool_workers: Optional[int] = None,
+        pool_threads: Optional[int] = None,
+        pool_share_weights: bool = True,
+        **cfg: Any,
+    ) -> None:
+        self._pool = WorkerPool(
+            model,
+            workers=pool_workers,
+            threads=pool_threads,
+            share_weights=pool_share_weights,
+            model_memory_budget=None,
+            **{k: cfg[k] for k in _CLIENT_KEYS if k in cfg},
+        )
+        self._chat = _PoolChat(_PoolChatCompletions(self._pool))
+        self._embeddings = _PoolEmbeddings(self._pool)
+        self._tokenizer = None
+        self._samples_by_default: Optional[bool] = None
+
+    def text_generation(self, prompt, stream=False, **kwargs: Any):
+        """HFLocalClient.text_generation on the pool; list prompts are split
+        across workers."""
+        if isinstance(prompt, str):
+            return self._pool.call("text_generation", prompt, stream=stream, **kwargs)
+        if stream:
+            raise ValueError("stream=True supports a single prompt, not a list")
+        return self._pool.map("text_generation", list(prompt), **kwargs)
+
+    def chat_completion_batch(self, conversations, **kwargs: Any):
+        return self._pool.map("chat_completion_batch", list(conversations), **kwargs)
+
+    @property
+    def chat(self) -> _PoolChat:
+        return self._chat
+
+    @property
+    def embeddings(self) -> _PoolEmbeddings:
+        return self._embeddings
+
+    @property
+    def pool(self) -> WorkerPool:
+        return self._pool
+
+    @property
+    def tokenizer(self):
+        """The model's tokenizer, loaded in this process on first use (the
+        workers hold the model)."""
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self._pool.model,
+                                                            local_files_only=True)
+        return self._tokenizer
+
+    @property
+    def samples_by_default(self) -> bool:
+        """Whether the model's generation_config samples (read here, like the
+        tokenizer; no weights are loaded)."""
+        if self._samples_by_default is None:
+            from transformers import GenerationConfig
+            try:
+                config = GenerationConfig.from_pretrained(self._pool.model,
+                                                          local_files_only=True)
+            except OSError:  # no generation_config.json: HF defaults (greedy)
+                config = None
+            self._samples_by_default = samples_by_default(config)
+        return self._samples_by_default
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+class AsyncHFPoolBackend:
+    """asyncio front-end for HFPoolBackend; the pool's reader threads resolve
+    futures, so awaiting costs no executor thread per call."""
+
+    def __init__(self, **cfg: Any) -> None:
+        self._sync = HFPoolBackend(**cfg)
+        self._chat = _PoolChat(_AsyncPoolChatCompletions(self))
+        self._embeddings = _AsyncPoolEmbeddings(self)
+
+    async def _run(self, method: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        pool = self._sync.pool
+        result = pool.submit(method, args, kwargs)
+        if isinstance(result, MLHQStream):
+            return MLHQAsyncStream(_aiter(result), model=pool.model, provider="hflocal")
+        value, phases = await asyncio.wrap_future(result)
+        _book(current_timings(), phases)
+        return value
+
+    async def text_generation(self, prompt, **kwargs: Any):
+        if isinstance(prompt, str):
+            return await self._run("text_generation", (prompt,), kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: self._sync.text_generation(prompt, **kwargs))
+
+    async def chat_completion_batch(self, conversations, **kwargs: Any):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: self._sync.chat_completion_batch(conversations, **kwargs))
+
+    @property
+    def chat(self) -> _PoolChat:
+        return self._chat
+
+    @property
+    def embeddings(self) -> "_AsyncPoolEmbeddings":
+        return self._embeddings
+
+    @property
+    def pool(self) -> WorkerPool:
+        return self._sync.pool
+
+    @property
+    def tokenizer(self):
+        return self._sync.tokenizer
+
+    @property
+    def samples_by_default(self) -> bool:
+        return self._sync.samples_by_default
+
+    async def close(self) -> None:
+        self._sync.close()
+
+
+class _AsyncPoolChatCompletions:
+    def __init__(self, backend: AsyncHFPoolBackend): self._backend = backend
+    async def create(self, *, messages, **kwargs: Any):
+        return await self._backend._run("chat_completion", (messages,), kwargs)
+
+
+class _AsyncPoolEmbeddings:
+    def __init__(self, backend: AsyncHFPoolBackend): self._backend = backend
+    async def create(self, *, input, model=None, **kwargs: Any):
+        return await self._backend._run("embed", (input,), kwargs)
+
+
+async def _aiter(stream: MLHQStream):
+    loop = asyncio.get_running_loop()
+    it = iter(stream)
+    done = object()
+    while True:
+        chunk = await loop.run_in_executor(None, next, it, done)
+        if chunk is done:
+            return
+        yield chunk
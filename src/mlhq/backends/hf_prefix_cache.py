@@ -0,0 +1,123 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from collections import OrderedDict
+import itertools
+import threading
+from transformers import DynamicCache
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+def _block_hashes(ids: Sequence[int], block_size: int, limit: int) -> List[int]:
+    """Chained hash of every full `block_size` prefix of ids[:limit]; the
+    k-th hash identifies the whole prefix ids[:(k + 1) * block_size]."""
+    hashes, h = [], 0
+    for end in range(block_size, limit + 1, block_size):
+        h = hash((h, tuple(ids[end - block_size:end])))
+        hashes.append(h)
+    return hashes
+
+
+def _cache_nbytes(cache: DynamicCache) -> int:
+    return sum(k.nbytes + v.nbytes for k, v in cache.to_legacy_cache())
+
+
+class PrefixCache:
+    """
+    Bounded LRU of ``past_key_values`` for previously seen token sequences.
+
+    Entries are indexed by the chained hash of each full ``block_size`` token
+    block, so a new prompt hits any entry sharing a block-aligned prefix with
+    it: the previous turn of a conversation, or just a common system prompt.
+    On a hit only the unmatched suffix needs prefill. Cached tensors are
+    never written to (DynamicCache.update concatenates into new tensors), so
+    hits hand out cheap views rather than copies.
+    """
+
+    def __init__(self, max_bytes: int, block_size: int = 16) -> None:
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._entries: "OrderedDict[int, Tuple[Tuple[int, ...], DynamicCache, int]]" = OrderedDict()
+        self._index: Dict[int, Set[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_tokens = 0
+
+    def lookup(self, ids: Sequence[int]) -> Tuple[int, Optional[DynamicCache]]:
+        """Longest cached block-aligned prefix of `ids`, leaving at least one
+        token to prefill. Returns (matched length, cache holding that prefix)."""
+        hashes = _block_hashes(ids, self.block_size, len(ids) - 1)
+        with self._lock:
+            for k in range(len(hashes) - 1, -1, -1):
+                length = (k + 1) * self.block_size
+                for entry_id in self._index.get(hashes[k], ()):
+                    entry_ids, cache, _ = self._entries[entry_id]
+                    if list(entry_ids[:length]) == list(ids[:length]):  # guard against collisions
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        self.hit_tokens += length
+                        return length, DynamicCache.from_legacy_cache(tuple(
+                            (k_[:, :, :length], v_[:, :, :length])
+                            for k_, v_ in cache.to_legacy_cache()
+                        ))
+            self.misses += 1
+        return 0, None
+
+    def store(self, ids: Sequence[int], cache: DynamicCache) -> None:
+        """Remember `cache` (batch size 1) as the KV state for ids[:seq_len]."""
+        length = cache.get_seq_length()
+        if length < self.block_size:
+            return
+        ids = tuple(ids[:length])
+        cache = DynamicCache.from_legacy_cache(tuple(
+            (k.contiguous(), v.contiguous()) for k, v in cache.to_legacy_cache()
+        ))
+        nbytes = _cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        hashes = _block_hashes(ids, self.block_size, length)
+        with self._lock:
+            # an existing entry already covers exactly this sequence
+            for entry_id in self._index.get(hashes[-1], ()):
+                if self._entries[entry_id][0] == ids:
+                    self._entries.move_to_end(entry_id)
+                    return
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (ids, cache, nbytes)
+            for h in hashes:
+                self._index.setdefault(h, set()).add(entry_id)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entry_id, (ids, _, nbytes) = self._entries.popitem(last=False)
+        for h in _block_hashes(ids, self.block_size, len(ids)):
+            owners = self._index.get(h)
+            if owners is not None:
+                owners.discard(entry_id)
+                if not owners:
+                    del self._index[h]
+        self.bytes -= nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hit_tokens": self.hit_tokens,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
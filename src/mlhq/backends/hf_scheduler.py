@@ -0,0 +1,272 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import threading
+import time
+import torch
+from transformers import DynamicCache
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+# generate() kwargs the scheduler understands; anything else makes
+# HFLocalClient fall back to a plain generate() call.
+SUPPORTED_KWARGS = frozenset({"max_new_tokens", "do_sample", "temperature", "top_k", "top_p"})
+
+
+@dataclass
+class _Request:
+    input_ids: List[int]
+    max_new_tokens: int
+    do_sample: bool = False
+    temperature: float = 1.0
+    top_k: int = 0
+    top_p: float = 1.0
+    # called with each new token id; returning True finishes the request
+    on_token: Optional[Callable[[int], Optional[bool]]] = None
+    future: Future = field(default_factory=Future)
+    generated: List[int] = field(default_factory=list)
+    # perf_counter() stamps for the per-request queue/prefill/decode timings
+    submitted: float = field(default_factory=time.perf_counter)
+    started: Optional[float] = None
+    first_token: Optional[float] = None
+
+    def timings(self, now: float) -> Dict[str, float]:
+        started = self.started or now
+        first = self.first_token or now
+        return {"queue": started - self.submitted, "prefill": first - started,
+                "decode": now - first}
+
+
+class ContinuousBatchingScheduler:
+    """
+    In-process continuous batching in front of one causal LM.
+
+    Requests from any thread are queued; a single worker thread decodes all
+    active sequences one token per step in one shared batch. Sequences that
+    finish leave the batch and queued ones are prefilled and join at the next
+    step boundary, so concurrent callers share forward passes instead of each
+    running its own generate() loop.
+
+    The batch KV cache is left-padded: every row has the same physical length
+    and an attention mask marks its real positions; position ids are derived
+    from the mask so padding never shifts a sequence's positions.
+    """
+
+    def __init__(self, model, *, eos_token_ids, pad_token_id: int,
+                 max_batch_size: int = 8, device: str = "cpu") -> None:
+        self.model = model
+        self.eos_token_ids = set(eos_token_ids)
+        self.pad_token_id = pad_token_id
+        self.max_batch_size = max_batch_size
+        self.device = device
+
+        self._queue: List[_Request] = []
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # running batch state (worker thread only)
+        self._active: List[_Request] = []
+        self._cache: Optional[DynamicCache] = None
+        self._mask: Optional[torch.Tensor] = None
+        self._next: Optional[torch.Tensor] = None
+
+        self._steps = 0
+        self._tokens = 0
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="mlhq-cb-scheduler", daemon=True)
+        self._thread.start()
+
+    # ---------- public ----------
+
+    def submit(self, input_ids: List[int], *, max_new_tokens: int, **sampling: Any) -> Future:
+        """Queue one prompt; the Future resolves to {"ids": [...], "finish_reason": ...,
+        "timings": {"queue", "prefill", "decode"}}."""
+        req = _Request(list(input_ids), max_new_tokens, **sampling)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is closed")
+            self._queue.append(req)
+            self._cond.notify()
+        return req.future
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self._started
+        return {
+            "active": len(self._active),
+            "queued": len(self._queue),
+            "steps": self._steps,
+            "tokens": self._tokens,
+            "tokens_per_s": self._tokens / elapsed if elapsed else 0.0,
+            "avg_batch": self._tokens / self._steps if self._steps else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    # ---------- worker ----------
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._active and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    pending = self._queue + self._active
+                    self._queue = []
+                    break
+                free = self.max_batch_size - len(self._active)
+                joining, self._queue = self._queue[:free], self._queue[free:]
+            try:
+                with torch.inference_mode():
+                    if joining:
+                        self._prefill(joining)
+                    if self._active:
+                        self._decode_step()
+            except BaseException as e:  # fail everything in flight, keep serving
+                logger.exception("continuous batching step failed")
+                for req in joining + self._active:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+                self._active, self._cache = [], None
+        for req in pending:
+            if not req.future.done():
+                req.future.set_exception(RuntimeError("scheduler is closed"))
+
+    def _prefill(self, joining: List[_Request]) -> None:
+        start = time.perf_counter()
+        for req in joining:
+            req.started = start
+        width = max(len(r.input_ids) for r in joining)
+        ids = torch.full((len(joining), width), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(joining), width), dtype=torch.long)
+        for row, req in enumerate(joining):
+            n = len(req.input_ids)
+            ids[row, width - n:] = torch.tensor(req.input_ids)
+            mask[row, width - n:] = 1
+        ids, mask = ids.to(self.device), mask.to(self.device)
+        cache = DynamicCache()
+        out = self.model(
+            input_ids=ids,
+            attention_mask=mask,
+            position_ids=(mask.cumsum(-1) - 1).clamp(min=0),
+            past_key_values=cache,
+            use_cache=True,
+        )
+        first = self._sample(out.logits[:, -1, :], joining)
+        keep = self._record(joining, first)
+        if not keep:
+            return
+        cache = out.past_key_values
+        if len(keep) < len(joining):
+            index = torch.tensor(keep, device=self.device)
+            cache.batch_select_indices(index)
+            mask, first = mask.index_select(0, index), first.index_select(0, index)
+            joining = [joining[i] for i in keep]
+        self._merge(joining, cache, mask, first)
+
+    def _decode_step(self) -> None:
+        mask = torch.cat([self._mask, self._mask.new_ones((self._mask.shape[0], 1))], dim=1)
+        out = self.model(
+            input_ids=self._next.unsqueeze(-1),
+            attention_mask=mask,
+            position_ids=mask.sum(-1, keepdim=True) - 1,
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self._cache, self._mask = out.past_key_values, mask
+        self._next = self._sample(out.logits[:, -1, :], self._active)
+        keep = self._record(self._active, self._next)
+        if len(keep) < len(self._active):
+            self._select(keep)
+
+    def _record(self, reqs: List[_Request], tokens: torch.Tensor) -> List[int]:
+        """Record one new token per row, resolve finished requests and
+        return the rows that keep decoding."""
+        self._steps += 1
+        self._tokens += tokens.shape[0]
+        now = time.perf_counter()
+        keep = []
+        for row, (req, tok) in enumerate(zip(reqs, tokens.tolist())):
+            if req.first_token is None:
+                req.first_token = now
+            finish = None
+            if tok in self.eos_token_ids:
+                finish = "stop"
+            else:
+                req.generated.append(tok)
+                if req.on_token is not None and req.on_token(tok):
+                    finish = "stop"
+                elif len(req.generated) >= req.max_new_tokens:
+                    finish = "length"
+            if finish is None:
+                keep.append(row)
+            else:
+                req.future.set_result({"ids": req.generated, "finish_reason": finish,
+                                       "timings": req.timings(now)})
+        return keep
+
+    def _select(self, keep: List[int]) -> None:
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._cache = self._mask = self._next = None
+            return
+        index = torch.tensor(keep, device=self.device)
+        mask = self._mask.index_select(0, index)
+        # drop leading columns that are padding for every remaining row
+        lead = int((mask.cumsum(-1) == 0).sum(-1).min())
+        self._mask = mask[:, lead:]
+        self._next = self._next.index_select(0, index)
+        self._cache = DynamicCache.from_legacy_cache(tuple(
+            (k.index_select(0, index)[:, :, lead:], v.index_select(0, index)[:, :, lead:])
+            for k, v in self._cache.to_legacy_cache()
+        ))
+
+    def _merge(self, joining: List[_Request], cache, mask: torch.Tensor,
+               first: torch.Tensor) -> None:
+        """Append prefilled rows to the running batch, left-padding whichever side is shorter."""
+        if not self._active:
+            self._active, self._cache, self._mask, self._next = list(joining), cache, mask, first
+            return
+        old, new = self._cache.to_legacy_cache(), cache.to_legacy_cache()
+        width = max(self._mask.shape[1], mask.shape[1])
+
+        def pad(t, dim):
+            missing = width - t.shape[dim]
+            if not missing:
+                return t
+            shape = list(t.shape)
+            shape[dim] = missing
+            return torch.cat([t.new_zeros(shape), t], dim=dim)
+
+        self._cache = DynamicCache.from_legacy_cache(tuple(
+            (torch.cat([pad(ko, 2), pad(kn, 2)]), torch.cat([pad(vo, 2), pad(vn, 2)]))
+            for (ko, vo), (kn, vn) in zip(old, new)
+        ))
+        self._mask = torch.cat([pad(self._mask, 1), pad(mask, 1)])
+        self._next = torch.cat([self._next, first])
+        self._active = self._active + list(joining)
+
+    # ---------- sampling ----------
+
+    @staticmethod
+    def _sample(logits: torch.Tensor, reqs: List[_Request]) -> torch.Tensor:
+        tokens = logits.argmax(-1)
+        for row, req in enumerate(reqs):
+            if not req.do_sample:
+                continue
+            scores = logits[row].float() / max(req.temperature, 1e-5)
+            if req.top_k:
+                kth = torch.topk(scores, min(req.top_k, scores.shape[-1])).values[-1]
+                scores = scores.masked_fill(scores < kth, float("-inf"))
+            if req.top_p < 1.0:
+                sorted_scores, order = torch.sort(scores, descending=True)
+                cum = sorted_scores.softmax(-1).cumsum(-1)
+                drop = cum - sorted_scores.softmax(-1) > req.top_p
+                scores = scores.masked_fill(drop.scatter(0, order, drop), float("-inf"))
+            tokens[row] = torch.multinomial(scores.softmax(-1), 1)[0]
+        return tokens
@@ -0,0 +1,227 @@
+"""
+HTTP connection pools for the OpenAI backend.
+
+The OpenAI SDK gets an ``httpx`` client configured from ClientConfig: pool
+size (``http_max_connections``), idle keep-alive connections
+(``http_max_keepalive``, ``http_keepalive_expiry``), HTTP/2 and
+connect/read timeouts. With ``http_shared=True`` (the default) every sync
+Client in the process with the same settings uses one ``httpx.Client``, so
+its connections (to every replica) are reused instead of each Client
+opening and keeping its own; the pool is closed when the last one closes.
+
+Every request carries httpcore's ``trace`` extension, which is how
+``HTTPPool.stats()`` knows when a request got a connection (its pool wait),
+whether the connection was new or reused, and when it was given back
+(utilization = connections in use / ``http_max_connections``).
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+from collections import deque
+import threading
+import time
+
+import httpx
+
+from ..metrics import percentile
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+# percentiles of the pool wait are over this many recent requests
+WAIT_WINDOW = 1024
+
+
+def http_settings(*, http_max_connections: int = 1000, http_max_keepalive: int = 100,
+                  http_keepalive_expiry: Optional[float] = 5.0, http2: bool = False,
+                  http_connect_timeout: float = 5.0, http_read_timeout: float = 600.0,
+                  **_: Any) -> Tuple[Any, ...]:
+    """The pool-relevant subset of the backend kwargs, as a hashable key."""
+    return (http_max_connections, http_max_keepalive, http_keepalive_expiry, bool(http2),
+            http_connect_timeout, http_read_timeout)
+
+
+class HTTPPool:
+    """An httpx client with the configured limits plus its usage stats."""
+
+    def __init__(self, settings: Tuple[Any, ...], asynchronous: bool = False) -> None:
+        (self.max_connections, max_keepalive, keepalive_expiry, http2,
+         connect_timeout, read_timeout) = settings
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                raise ImportError("http2=True needs the h2 package: "
+                                  "pip install 'mlhq[http2]'") from None
+        self.settings = settings
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=max_keepalive,
+                              keepalive_expiry=keepalive_expiry)
+        transport = (_AsyncTracedTransport if asynchronous else _TracedTransport)(
+            self, limits=limits, http2=http2)
+        client_cls = httpx.AsyncClient if asynchronous else httpx.Client
+        self.client: Any = client_cls(transport=transport, timeout=self.timeout)
+        self._lock = threading.Lock()
+        self._users = 0
+        self._requests = 0
+        self._waiting = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired_n = 0
+        self._opened = 0
+        self._errors = 0
+        self._waits: deque = deque(maxlen=WAIT_WINDOW)
+
+    # ---------- tracing ----------
+
+    def _begin(self) -> None:
+        with self._lock:
+            self._requests += 1
+            self._waiting += 1
+
+    def _acquired(self, wait: float, new: bool) -> None:
+        with self._lock:
+            self._waiting -= 1
+            self._acquired_n += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._opened += new
+            self._waits.append(wait)
+
+    def _released(self, acquired: bool, failed: bool) -> None:
+        with self._lock:
+            if acquired:
+                self._in_use -= 1
+            else:
+                self._waiting -= 1
+            self._errors += failed
+
+    # ---------- public ----------
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size, connections in use (now / peak, and as utilization),
+        requests waiting for a connection, connections opened vs reused and
+        the pool wait (seconds) over the last WAIT_WINDOW requests."""
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "max_connections": self.max_connections,
+                "requests": self._requests,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "peak_in_use": self._peak_in_use,
+                "utilization": self._in_use / self.max_connections,
+                "peak_utilization": self._peak_in_use / self.max_connections,
+                "connections_opened": self._opened,
+                "connections_reused": self._acquired_n - self._opened,
+                "errors": self._errors,
+                "pool_wait_s": {
+                    "mean": sum(waits) / len(waits) if waits else 0.0,
+                    "p50": percentile(waits, 50),
+                    "p95": percentile(waits, 95),
+                    "p99": percentile(waits, 99),
+                    "max": max(waits, default=0.0),
+                },
+            }
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class _Trace:
+    """httpcore trace callback for one request: the first connection-level
+    event ends the pool wait, ``response_closed`` (or a failure) ends its use
+    of the connection."""
+
+    __slots__ = ("pool", "start", "acquired", "done")
+
+    def __init__(self, pool: HTTPPool) -> None:
+        self.pool = pool
+        self.start = time.perf_counter()
+        self.acquired = False
+        self.done = False
+        pool._begin()
+
+    def event(self, name: str, info: Dict[str, Any]) -> None:
+        if self.done:
+            return
+        if not self.acquired and name.endswith(".started"):
+            self.acquired = True
+            self.pool._acquired(time.perf_counter() - self.start,
+                                name == "connection.connect_tcp.started")
+        if name.endswith("response_closed.complete"):
+            self.done = True
+            self.pool._released(self.acquired, False)
+        elif name.endswith(".failed"):
+            self.fail()
+
+    async def aevent(self, name: str, info: Dict[str, Any]) -> None:
+        self.event(name, info)
+
+    def fail(self) -> None:
+        if not self.done:
+            self.done = True
+            self.pool._released(self.acquired, True)
+
+
+class _TracedTransport(httpx.HTTPTransport):
+    """HTTPTransport attaching a _Trace to every request (a request that
+    fails before reaching a connection, e.g. a pool timeout, still counts)."""
+
+    def __init__(self, pool: HTTPPool, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._owner = pool
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        trace = _Trace(self._owner)
+        request.extensions["trace"] = trace.event
+        try:
+            return super().handle_request(request)
+        except BaseException:
+            trace.fail()
+            raise
+
+
+class _AsyncTracedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, pool: HTTPPool, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._owner = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        trace = _Trace(self._owner)
+        request.extensions["trace"] = trace.aevent
+        try:
+            return await super().handle_async_request(request)
+        except BaseException:
+            trace.fail()
+            raise
+
+
+# ---------- process-wide sharing ----------
+
+_shared: Dict[Tuple[Any, ...], HTTPPool] = {}
+_shared_lock = threading.Lock()
+
+
+def acquire_pool(settings: Tuple[Any, ...]) -> HTTPPool:
+    """The process-wide (sync) pool for `settings`; pair with release_pool."""
+    with _shared_lock:
+        pool = _shared.get(settings)
+        if pool is None:
+            pool = _shared[settings] = HTTPPool(settings)
+            logger.debug("Opened shared HTTP pool %s", settings)
+        pool._users += 1
+        return pool
+
+
+def release_pool(pool: HTTPPool) -> None:
+    """Drop one user of a shared pool; the last one closes it."""
+    with _shared_lock:
+        pool._users -= 1
+        if pool._users > 0:
+            return
+        if _shared.get(pool.settings) is pool:
+            del _shared[pool.settings]
+    pool.close()
@@ -1,8 +1,12 @@
 from __future__ import annotations
-from typing import Any, Optional, Dict
-from openai import OpenAI
+from typing import Any, Optional, Dict, List, Union
+import base64
+from openai import OpenAI, AsyncOpenAI
 from .base import Backend, ResponsesAPI, ChatAPI, ChatCompletionsAPI
-from ..types import MLHQResponse
+from .balancer import BalancedAsyncOpenAI, BalancedOpenAI, LoadBalancer
+from .http_pool import HTTPPool, acquire_pool, http_settings, release_pool
+from ..types import MLHQEmbeddings, MLHQResponse, MLHQStream, MLHQStreamChunk, MLHQAsyncStream
+from ..metrics import phase
 
 # ---------- helpers to normalize OpenAI payloads ----------
 
@@ -104,35 +108,95 @@ def _extract_openai_common(obj: Any) -> Dict[str, Any]:
 
 # ---------- adapters ----------
 
+def _to_mlhq_response(raw: Any, text: str) -> MLHQResponse:
+    meta = _extract_openai_common(raw)
+    return MLHQResponse(
+        text=text,
+        raw=raw,
+        model=meta["model"],
+        provider="openai",
+        finish_reason=meta["finish_reason"],
+        usage=meta["usage"],
+    )
+
+def _to_mlhq_chunk(raw: Any) -> MLHQStreamChunk:
+    # With stream_options.include_usage the last chunk has usage and no choices.
+    text = _extract_openai_chat_text(raw) if getattr(raw, "choices", None) else ""
+    meta = _extract_openai_common(raw)
+    return MLHQStreamChunk(
+        text=text,
+        raw=raw,
+        model=meta["model"],
+        provider="openai",
+        finish_reason=meta["finish_reason"],
+        usage=meta["usage"],
+    )
+
+def _embedding_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = dict(kwargs)
+    kwargs.pop("dtype", None)
+    # base64 float32 is ~4x smaller on the wire than JSON floats and decodes
+    # straight into the output array (the SDK leaves it undecoded when asked)
+    kwargs.setdefault("encoding_format", "base64")
+    return kwargs
+
+def _to_mlhq_embeddings(raw: Any, dtype: str = "float32") -> MLHQEmbeddings:
+    import numpy as np
+
+    items = raw.data
+    rows = []
+    for item in items:
+        vec = item.embedding
+        if isinstance(vec, str):
+            rows.append(np.frombuffer(base64.b64decode(vec), dtype="<f4"))
+        else:  # servers that ignore encoding_format
+            rows.append(np.asarray(vec, dtype=np.float32))
+    out = np.empty((len(rows), len(rows[0]) if rows else 0), dtype=np.dtype(dtype))
+    for item, row in zip(items, rows):
+        out[item.index] = row
+    return MLHQEmbeddings(
+        data=out,
+        model=getattr(raw, "model", None),
+        provider="openai",
+        usage=_extract_openai_common(raw)["usage"],
+        raw=None,  # the vectors are in `data`; don't keep the base64 payload alive
+    )
+
+def _stream_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # ask for usage unless the caller chose stream_options; None omits the
+    # field for OpenAI-compatible servers that reject it
+    kwargs = dict(kwargs)
+    if "stream_options" not in kwargs:
+        kwargs["stream_options"] = {"include_usage": True}
+    elif kwargs["stream_options"] is None:
+        del kwargs["stream_options"]
+    return kwargs
+
 class _OpenAIResponses(ResponsesAPI):
     def __init__(self, client: OpenAI): self._client = client
     def create(self, **kwargs: Any) -> MLHQResponse:
-        raw = self._client.responses.create(**kwargs)
-        text = _extract_openai_responses_text(raw)
-        meta = _extract_openai_common(raw)
-        return MLHQResponse(
-            text=text,
-            raw=raw,
-            model=meta["model"],
-            provider="openai",
-            finish_reason=meta["finish_reason"],
-            usage=meta["usage"],
-        )
+        with phase("network"):
+            raw = self._client.responses.create(**kwargs)
+        return _to_mlhq_response(raw, _extract_openai_responses_text(raw))
 
 class _OpenAIChatCompletions(ChatCompletionsAPI):
     def __init__(self, client: OpenAI): self._client = client
     def create(self, **kwargs: Any) -> MLHQResponse:
-        raw = self._client.chat.completions.create(**kwargs)
-        text = _extract_openai_chat_text(raw)
-        meta = _extract_openai_common(raw)
-        return MLHQResponse(
-            text=text,
-            raw=raw,
-            model=meta["model"],
-            provider="openai",
-            finish_reason=meta["finish_reason"],
-            usage=meta["usage"],
-        )
+        if kwargs.get("stream"):
+            with phase("network"):  # until the response headers; chunks arrive as consumed
+                raw = self._client.chat.completions.create(**_stream_kwargs(kwargs))
+            return MLHQStream((_to_mlhq_chunk(c) for c in raw), model=kwargs.get("model"),
+                              provider="openai")
+        with phase("network"):
+            raw = self._client.chat.completions.create(**kwargs)
+        return _to_mlhq_response(raw, _extract_openai_chat_text(raw))
+
+class _OpenAIEmbeddings:
+    def __init__(self, client: OpenAI): self._client = client
+    def create(self, **kwargs: Any) -> MLHQEmbeddings:
+        with phase("network"):
+            raw = self._client.embeddings.create(**_embedding_kwargs(kwargs))
+        return _to_mlhq_embeddings(raw, kwargs.get("dtype", "float32"))
 
 class _OpenAIChat(ChatAPI):
     def __init__(self, client: OpenAI):
@@ -142,29 +206,180 @@ class _OpenAIChat(ChatAPI):
         return self._completions
 
 class OpenAIBackend(Backend):
+    # Client wraps calls in its RequestPolicy (rate limits, retries, hedging)
+    uses_request_policy = True
+    # the API samples at temperature 1 unless a request says otherwise
+    samples_by_default = True
+
     def __init__(
         self,
         *,
         api_key: Optional[str] = None,
-        base_url: Optional[str] = None,
+        base_url: Union[str, List[str], None] = None,
         organization: Optional[str] = None,
         project: Optional[str] = None,
+        balancer_policy: Any = "least_outstanding",
+        balancer_max_failures: int = 3,
+        balancer_ejection_s: float = 30.0,
+        http_shared: bool = True,
         **extra: Any,
     ) -> None:
-        self._inner = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            organization=organization,
-            project=project,
-        )
+        # one pooled httpx client for every replica; shared process-wide
+        settings = http_settings(**extra)
+        self._http_shared = http_shared
+        self._http = acquire_pool(settings) if http_shared else HTTPPool(settings)
+
+        def make(url):
+            return OpenAI(
+                api_key=api_key,
+                base_url=url,
+                organization=organization,
+                project=project,
+                max_retries=0,  # Client retries (jittered, rate-limit aware); don't double up
+                timeout=self._http.timeout,
+                http_client=self._http.client,
+            )
+        self._inner = _connect(make, BalancedOpenAI, base_url, balancer_policy,
+                               balancer_max_failures, balancer_ejection_s)
         self._responses = _OpenAIResponses(self._inner)
         self._chat = _OpenAIChat(self._inner)
+        self._embeddings = _OpenAIEmbeddings(self._inner)
 
     @property
     def responses(self) -> ResponsesAPI:
         return self._responses
 
+    @property
+    def embeddings(self) -> _OpenAIEmbeddings:
+        return self._embeddings
+
     @property
     def chat(self) -> ChatAPI:
         return self._chat
 
+    @property
+    def balancer(self) -> Optional[LoadBalancer]:
+        return getattr(self._inner, "balancer", None)
+
+    @property
+    def http_pool(self) -> HTTPPool:
+        return self._http
+
+    def close(self) -> None:
+        if self._http_shared:
+            release_pool(self._http)  # closing the SDK client would close the shared pool
+        else:
+            self._inner.close()
+
+
+def _connect(make, balanced_cls, base_url, policy, max_failures, ejection_s):
+    """One SDK client for a single base_url; a balanced front over one client
+    per replica when base_url is a list."""
+    if not isinstance(base_url, (list, tuple)):
+        return make(base_url)
+    return balanced_cls(
+        {url: make(url) for url in base_url},
+        policy=policy,
+        max_failures=max_failures,
+        ejection_s=ejection_s,
+    )
+
+
+# ---------- asyncio variants (used by AsyncClient) ----------
+
+class _AsyncOpenAIResponses:
+    def __init__(self, client: AsyncOpenAI): self._client = client
+    async def create(self, **kwargs: Any) -> MLHQResponse:
+        with phase("network"):
+            raw = await self._client.responses.create(**kwargs)
+        return _to_mlhq_response(raw, _extract_openai_responses_text(raw))
+
+class _AsyncOpenAIChatCompletions:
+    def __init__(self, client: AsyncOpenAI): self._client = client
+    async def create(self, **kwargs: Any) -> MLHQResponse:
+        if kwargs.get("stream"):
+            with phase("network"):  # until the response headers; chunks arrive as consumed
+                raw = await self._client.chat.completions.create(**_stream_kwargs(kwargs))
+            return MLHQAsyncStream((_to_mlhq_chunk(c) async for c in raw),
+                                   model=kwargs.get("model"), provider="openai")
+        with phase("network"):
+            raw = await self._client.chat.completions.create(**kwargs)
+        return _to_mlhq_response(raw, _extract_openai_chat_text(raw))
+
+class _AsyncOpenAIEmbeddings:
+    def __init__(self, client: AsyncOpenAI): self._client = client
+    async def create(self, **kwargs: Any) -> MLHQEmbeddings:
+        with phase("network"):
+            raw = await self._client.embeddings.create(**_embedding_kwargs(kwargs))
+        return _to_mlhq_embeddings(raw, kwargs.get("dtype", "float32"))
+
+class _AsyncOpenAIChat:
+    def __init__(self, client: AsyncOpenAI):
+        self._completions = _AsyncOpenAIChatCompletions(client)
+    @property
+    def completions(self) -> _AsyncOpenAIChatCompletions:
+        return self._completions
+
+class AsyncOpenAIBackend:
+    """
+    Native asyncio OpenAI backend. Requests are coroutines multiplexed on the
+    caller's event loop over one pooled HTTP client, so thousands of in-flight
+    calls cost no threads.
+    """
+    uses_request_policy = True
+    samples_by_default = True
+
+    def __init__(
+        self,
+        *,
+        api_key: Optional[str] = None,
+        base_url: Union[str, List[str], None] = None,
+        organization: Optional[str] = None,
+        project: Optional[str] = None,
+        balancer_policy: Any = "least_outstanding",
+        balancer_max_failures: int = 3,
+        balancer_ejection_s: float = 30.0,
+        **extra: Any,
+    ) -> None:
+        # async connections belong to the event loop that opened them, so the
+        # pool is per backend rather than process-wide
+        self._http = HTTPPool(http_settings(**extra), asynchronous=True)
+
+        def make(url):
+            return AsyncOpenAI(
+                api_key=api_key,
+                base_url=url,
+                organization=organization,
+                project=project,
+                max_retries=0,  # Client retries (jittered, rate-limit aware); don't double up
+                timeout=self._http.timeout,
+                http_client=self._http.client,
+            )
+        self._inner = _connect(make, BalancedAsyncOpenAI, base_url, balancer_policy,
+                               balancer_max_failures, balancer_ejection_s)
+        self._responses = _AsyncOpenAIResponses(self._inner)
+        self._chat = _AsyncOpenAIChat(self._inner)
+        self._embeddings = _AsyncOpenAIEmbeddings(self._inner)
+
+    @property
+    def responses(self) -> _AsyncOpenAIResponses:
+        return self._responses
+
+    @property
+    def embeddings(self) -> _AsyncOpenAIEmbeddings:
+        return self._embeddings
+
+    @property
+    def chat(self) -> _AsyncOpenAIChat:
+        return self._chat
+
+    @property
+    def balancer(self) -> Optional[LoadBalancer]:
+        return getattr(self._inner, "balancer", None)
+
+    @property
+    def http_pool(self) -> HTTPPool:
+        return self._http
+
+    async def close(self) -> None:
+        await self._inner.close()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import Any, Dict, List
+from importlib import import_module
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+# Entry-point group third-party packages can use to ship their own backends:
+#
+#   [project.entry-points."mlhq.backends"]
+#   mybackend = "mypkg.backend:MyBackend"
+#
+# Async variants (used by AsyncClient) go in "mlhq.async_backends".
+ENTRY_POINT_GROUP = "mlhq.backends"
+ASYNC_ENTRY_POINT_GROUP = "mlhq.async_backends"
+
+# name -> "module:attr" (not imported) or the backend class itself (imported)
+_BACKENDS: Dict[str, Any] = {
+    "openai": "mlhq.backends.openai_backend:OpenAIBackend",
+    "hflocal": "mlhq.backends.hf_backend:HFLocalBackend",
+    "hflocal-pool": "mlhq.backends.hf_pool:HFPoolBackend",
+}
+_ASYNC_BACKENDS: Dict[str, Any] = {
+    "openai": "mlhq.backends.openai_backend:AsyncOpenAIBackend",
+    "hflocal": "mlhq.backends.hf_backend:AsyncHFLocalBackend",
+    "hflocal-pool": "mlhq.backends.hf_pool:AsyncHFPoolBackend",
+}
+_entry_points_loaded = False
+
+
+def register_backend(name: str, target: Any, *, asynchronous: bool = False) -> None:
+    """Register a backend under `name`.
+
+    Args:
+        name: Value users pass as ``ClientConfig.backend``.
+        target: Either the backend class or a lazy ``"module:attr"`` string.
+            Strings are only imported the first time the backend is selected.
+        asynchronous: Register the variant used by ``AsyncClient``.
+    """
+    (_ASYNC_BACKENDS if asynchronous else _BACKENDS)[name] = target
+
+
+def _load_entry_points() -> None:
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+
+    groups = ((ENTRY_POINT_GROUP, _BACKENDS), (ASYNC_ENTRY_POINT_GROUP, _ASYNC_BACKENDS))
+    for group, table in groups:
+        try:
+            eps = entry_points(group=group)
+        except TypeError:  # python < 3.10
+            eps = entry_points().get(group, [])
+        for ep in eps:
+            # built-ins win; entry points only add new names
+            table.setdefault(ep.name, ep.value)
+
+
+def available_backends(*, asynchronous: bool = False) -> List[str]:
+    _load_entry_points()
+    return sorted(_ASYNC_BACKENDS if asynchronous else _BACKENDS)
+
+
+def get_backend(name: str, *, asynchronous: bool = False) -> Any:
+    """Resolve a backend name to its class, importing its module on first use."""
+    table = _ASYNC_BACKENDS if asynchronous else _BACKENDS
+    target = table.get(name)
+    if target is None:
+        _load_entry_points()
+        target = table.get(name)
+    if target is None:
+        available = available_backends(asynchronous=asynchronous)
+        raise ValueError(f"Unsupported backend: {name!r} (available: {available})")
+
+    if isinstance(target, str):
+        module_name, _, attr = target.partition(":")
+        logger.debug("Importing backend %r from %s", name, target)
+        obj: Any = import_module(module_name)
+        for part in attr.split("."):
+            obj = getattr(obj, part)
+        table[name] = target = obj
+    return target
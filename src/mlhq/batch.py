@@ -0,0 +1,297 @@
+"""
+Resumable bulk JSONL runner behind ``mlhq batch run``.
+
+Each input line is one request, either OpenAI-batch style::
+
+    {"custom_id": "q1", "url": "/v1/chat/completions", "body": {"model": ..., "messages": [...]}}
+
+or just the request body (``{"messages": [...], "max_tokens": 64}``), with an
+optional ``"method"`` of ``chat.completions`` (default), ``responses`` or
+``text_generation`` (body ``{"prompt": ..., ...}``).
+
+Input is read lazily and run with bounded concurrency; every finished row
+is appended to the output as ``{"index", "custom_id", "response" | "error"}``
+(in completion order); a line that is not a valid request gets an error
+record naming the line, and the job carries on. The output doubles as the checkpoint: re-running
+the same job skips rows already in it, so a crashed job resumes where it
+stopped. On backends that generate in batches (hflocal), consecutive rows
+with the same parameters are grouped into one batched generate call.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+
+from .client import Client
+from .types import MLHQResponse
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+METHODS = ("chat.completions", "responses", "text_generation")
+_URL_METHODS = {"/v1/chat/completions": "chat.completions", "/v1/responses": "responses",
+                "/v1/completions": "text_generation"}
+_ROW_KEYS = ("custom_id", "method", "url", "body")
+# the per-row prompt field of each method; everything else must match to share a batch
+_PROMPT_KEY = {"chat.completions": "messages", "responses": "input", "text_generation": "prompt"}
+
+
+class _Row:
+    __slots__ = ("index", "custom_id", "method", "body")
+
+    def __init__(self, index: int, custom_id: Any, method: str, body: Dict[str, Any]) -> None:
+        self.index = index
+        self.custom_id = custom_id
+        self.method = method
+        self.body = body
+
+
+def _parse(index: int, line: str, default_method: str) -> _Row:
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"line {index + 1}: invalid JSON ({e})") from None
+    if not isinstance(data, dict):
+        raise ValueError(f"line {index + 1}: expected a JSON object")
+    method = data.get("method") or _URL_METHODS.get(data.get("url")) or default_method
+    if method not in METHODS:
+        raise ValueError(f"line {index + 1}: unknown method {method!r}")
+    body = data["body"] if "body" in data else {
+        k: v for k, v in data.items() if k not in _ROW_KEYS
+    }
+    if not isinstance(body, dict):
+        raise ValueError(f"line {index + 1}: body must be a JSON object")
+    return _Row(index, data.get("custom_id"), method, dict(body))
+
+
+def _read_rows(path: str, default_method: str, done: Set[int],
+               on_error: Callable[[_Row, Exception], None]) -> Iterator[_Row]:
+    """Parsed rows not in `done`; a line that doesn't parse goes to
+    `on_error` (with a placeholder row) instead of stopping the job."""
+    with open(path, "r") as f:
+        for index, line in enumerate(f):
+            if index in done or not line.strip():
+                continue
+            try:
+                row = _parse(index, line, default_method)
+            except ValueError as e:
+                on_error(_Row(index, None, default_method, {}), e)
+                continue
+            yield row
+
+
+def load_checkpoint(output_path: str, retry_errors: bool = True) -> Set[int]:
+    """
+    Indices already finished in `output_path`. A torn last line (crash
+    mid-write) is dropped, as are error rows when `retry_errors`; the file
+    is rewritten without them so the resumed run can simply append.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done: Set[int] = set()
+    kept: List[str] = []
+    dropped = 0
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                dropped += 1
+                continue
+            if retry_errors and record.get("error") is not None:
+                dropped += 1
+                continue
+            done.add(record["index"])
+            kept.append(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        tmp = output_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.writelines(kept)
+        os.replace(tmp, output_path)
+    logger.info("Resuming %s: %d rows done, %d dropped", output_path, len(done), dropped)
+    return done
+
+
+def _dump_response(result: Any) -> Dict[str, Any]:
+    if isinstance(result, MLHQResponse):
+        return {"text": result.text, "finish_reason": result.finish_reason,
+                "usage": result.usage, "model": result.model, "provider": result.provider}
+    return {"text": result}
+
+
+class _Writer:
+    """Appends records and keeps the running totals; shared by worker threads."""
+
+    def __init__(self, path: str, resume: bool) -> None:
+        self._f = open(path, "a" if resume else "w")
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.tokens = 0
+
+    def write(self, row: _Row, result: Any = None, error: Optional[BaseException] = None) -> None:
+        record: Dict[str, Any] = {"index": row.index, "custom_id": row.custom_id}
+        if error is None:
+            record["response"] = _dump_response(result)
+            record["error"] = None
+        else:
+            record["error"] = {"type": type(error).__name__, "message": str(error)}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            if error is None:
+                self.succeeded += 1
+                usage = getattr(result, "usage", None) or {}
+                self.tokens += usage.get("completion_tokens") or usage.get("output_tokens") or 0
+            else:
+                self.failed += 1
+
+    def sync(self) -> None:
+        with self._lock:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+
+
+def _call(client: Client, row: _Row) -> Any:
+    body = dict(row.body)
+    if row.method == "chat.completions":
+        return client.chat.completions.create(**body)
+    if row.method == "responses":
+        return client.responses.create(**body)
+    return client.text_generation(body.pop("prompt"), details=True, **body)
+
+
+def _call_group(client: Client, rows: List[_Row]) -> List[Any]:
+    """One batched generate call for rows that differ only in their prompt."""
+    method = rows[0].method
+    key = _PROMPT_KEY[method]
+    kwargs = {k: v for k, v in rows[0].body.items() if k != key}
+    prompts = [row.body[key] for row in rows]
+    if method == "text_generation":
+        return client.text_generation(prompts, details=True, **kwargs)
+    return client.chat_completion_batch(prompts, **kwargs)
+
+
+def _group_key(row: _Row) -> Optional[str]:
+    if row.method == "responses" or _PROMPT_KEY[row.method] not in row.body:
+        return None
+    rest = {k: v for k, v in row.body.items() if k != _PROMPT_KEY[row.method]}
+    return row.method + json.dumps(rest, sort_keys=True, default=str)
+
+
+def _units(rows: Iterator[_Row], batch_size: int) -> Iterator[Tuple[bool, List[_Row]]]:
+    """Group consecutive batchable rows with identical parameters; yields
+    (grouped, rows) work units."""
+    group: List[_Row] = []
+    key = None
+    for row in rows:
+        row_key = _group_key(row) if batch_size > 1 else None
+        if group and (row_key is None or row_key != key or len(group) >= batch_size):
+            yield True, group
+            group = []
+        if row_key is None:
+            yield False, [row]
+            continue
+        group.append(row)
+        key = row_key
+    if group:
+        yield True, group
+
+
+def run_batch(client: Client, input_path: str, output_path: str, *,
+              method: str = "chat.completions", concurrency: Optional[int] = None,
+              batch_size: Optional[int] = None, resume: bool = True, retry_errors: bool = True,
+              progress_interval: float = 5.0,
+              on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Run every request in `input_path` through `client`, appending results to
+    `output_path`, and return the final stats dict.
+
+    `concurrency` bounds the calls in flight (default 8, or 1 when rows are
+    grouped into batched generate calls); `batch_size` is the rows per
+    group on batching backends (default 4 * max_batch_size, so the backend's
+    length bucketing has room to work). With `resume`, rows already in
+    `output_path` are skipped. `on_progress` receives the stats dict every
+    `progress_interval` seconds and once at the end.
+    """
+    batched = getattr(client, "chat_completion_batch", None) is not None
+    if batch_size is None:
+        batch_size = 4 * client.config.max_batch_size if batched else 1
+    if not batched:
+        batch_size = 1
+    if concurrency is None:
+        concurrency = 1 if batch_size > 1 else 8
+
+    done = load_checkpoint(output_path, retry_errors) if resume else set()
+    writer = _Writer(output_path, resume)
+    started = time.perf_counter()
+    # keep only a bounded number of units queued so the input is read lazily
+    slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def stats() -> Dict[str, Any]:
+        elapsed = time.perf_counter() - started
+        finished = writer.succeeded + writer.failed
+        return {
+            "skipped": len(done),
+            "succeeded": writer.succeeded,
+            "failed": writer.failed,
+            "elapsed_s": elapsed,
+            "rows_per_s": finished / elapsed if elapsed else 0.0,
+            "tokens_per_s": writer.tokens / elapsed if elapsed else 0.0,
+        }
+
+    def report() -> None:
+        current = stats()
+        logger.info("batch: %(succeeded)d ok, %(failed)d failed, %(rows_per_s).1f rows/s, "
+                    "%(tokens_per_s).1f tok/s", current)
+        if on_progress is not None:
+            on_progress(current)
+
+    def work(grouped: bool, unit: List[_Row]) -> None:
+        try:
+            if grouped:
+                results = _call_group(client, unit)
+            else:
+                results = [_call(client, unit[0])]
+        except Exception as e:
+            logger.debug("batch unit failed: %r", e)
+            for row in unit:
+                writer.write(row, error=e)
+        else:
+            for row, result in zip(unit, results):
+                writer.write(row, result)
+        finally:
+            slots.release()
+
+    last_report = started
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mlhq-batch") as pool:
+            rows = _read_rows(input_path, method, done,
+                              lambda row, e: writer.write(row, error=e))
+            for grouped, unit in _units(rows, batch_size):
+                # wake up periodically so progress keeps flowing while we wait
+                while not slots.acquire(timeout=progress_interval):
+                    report()
+                    last_report = time.perf_counter()
+                pool.submit(work, grouped, unit)
+                if time.perf_counter() - last_report >= progress_interval:
+                    writer.sync()
+                    report()
+                    last_report = time.perf_counter()
+            # drain: every slot back means every unit has been written
+            for _ in range(concurrency * 2):
+                while not slots.acquire(timeout=progress_interval):
+                    report()
+    finally:
+        writer.close()
+    report()
+    return stats()
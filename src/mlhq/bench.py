@@ -0,0 +1,338 @@
+"""
+Load-testing driver behind ``mlhq bench``.
+
+Drives a Client either closed-loop (`concurrency` workers issuing back to back)
+or open-loop (`rate` requests/s) and reports latency, time-to-first-token,
+inter-token latency, throughput and process memory as a JSON-able dict.
+`compare_modes` runs the hflocal benchmark once per CPU acceleration mode,
+each in a fresh process so resident memory is comparable. `logging_overhead`
+measures what mlhq's log calls cost the calling thread.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from .client import Client
+from .metrics import percentile
+from mlhq.logging_config import get_logger, setup_logging, shutdown_logging
+logger = get_logger(__name__)
+
+DEFAULT_PROMPT = "Write a haiku about benchmarking."
+
+
+@dataclass
+class _Sample:
+    latency: float
+    ttft: Optional[float] = None
+    itl: List[float] = field(default_factory=list)
+    output_tokens: int = 0
+    error: Optional[str] = None
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process (Linux), in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024  # bytes vs KiB
+
+
+def parse_mode(mode: str) -> Dict[str, Any]:
+    """
+    ``"bf16+compile"`` -> ClientConfig kwargs. Parts: a dtype (fp32, bf16,
+    fp16), ``int8`` (dynamic quantization) and ``compile`` or
+    ``compile-<backend>``.
+    """
+    kwargs: Dict[str, Any] = {}
+    for part in filter(None, mode.split("+")):
+        if part in ("fp32", "bf16", "fp16"):
+            kwargs["torch_dtype"] = part
+        elif part == "int8":
+            kwargs["quantization"] = "int8"
+        elif part == "compile":
+            kwargs["compile"] = True
+        elif part.startswith("compile-"):
+            kwargs["compile"] = part[len("compile-"):]
+        else:
+            raise ValueError(f"Unknown mode part {part!r} in {mode!r}")
+    return kwargs
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+    }
+
+
+def _one_request(client: Client, api: str, model: Optional[str], prompt: str,
+                 max_tokens: int, stream: bool) -> _Sample:
+    start = time.perf_counter()
+    try:
+        if api == "responses":
+            resp = client.responses.create(model=model, input=prompt, max_output_tokens=max_tokens)
+            usage = resp.usage or {}
+            return _Sample(time.perf_counter() - start,
+                           output_tokens=usage.get("output_tokens") or 0)
+
+        if api == "text":
+            kwargs = {"max_new_tokens": max_tokens}
+            if not stream:
+                kwargs["details"] = True  # MLHQResponse with usage instead of a str
+            result = client.text_generation(prompt, stream=stream, **kwargs)
+        else:
+            messages = [{"role": "user", "content": prompt}]
+            result = client.chat.completions.create(
+                model=model, messages=messages, max_tokens=max_tokens, stream=stream
+            )
+        if not stream:
+            usage = getattr(result, "usage", None) or {}
+            return _Sample(time.perf_counter() - start,
+                           output_tokens=usage.get("completion_tokens") or 0)
+
+        sample = _Sample(0.0)
+        last = None
+        for chunk in result:
+            if not chunk.text:
+                continue
+            now = time.perf_counter()
+            if last is None:
+                sample.ttft = now - start
+            else:
+                sample.itl.append(now - last)
+            last = now
+            sample.output_tokens += 1
+        sample.latency = time.perf_counter() - start
+        usage = result.response.usage or {}
+        sample.output_tokens = usage.get("completion_tokens") or sample.output_tokens
+        return sample
+    except Exception as e:  # counted, not fatal
+        logger.debug("bench request failed: %r", e)
+        return _Sample(time.perf_counter() - start, error=type(e).__name__)
+
+
+def run_bench(client: Client, *, api: str = "chat", model: Optional[str] = None,
+              prompt: str = DEFAULT_PROMPT, max_tokens: int = 64, stream: bool = True,
+              concurrency: int = 8, requests: int = 100, rate: Optional[float] = None,
+              duration: Optional[float] = None, warmup: int = 0) -> Dict[str, Any]:
+    """
+    Run a load test against `client` and return the report dict.
+
+    Closed loop by default: `concurrency` workers each issue requests back to
+    back until `requests` have completed (or `duration` seconds pass). With
+    `rate`, requests are instead started on a fixed schedule (open loop), so
+    queueing delay shows up in the latency numbers; `concurrency` then caps
+    in-flight requests.
+    """
+    if api == "responses":
+        stream = False
+
+    def call() -> _Sample:
+        return _one_request(client, api, model, prompt, max_tokens, stream)
+
+    for _ in range(warmup):
+        call()
+
+    samples: List[_Sample] = []
+    lock = threading.Lock()
+    issued = 0
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def take_ticket() -> bool:
+        nonlocal issued
+        with lock:
+            if issued >= requests or (deadline and time.perf_counter() >= deadline):
+                return False
+            issued += 1
+            return True
+
+    if rate:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = []
+            i = 0
+            while take_ticket():
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(call))
+                i += 1
+            samples = [f.result() for f in futures]
+    else:
+        def worker() -> None:
+            while take_ticket():
+                sample = call()
+                with lock:
+                    samples.append(sample)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    wall = time.perf_counter() - started
+    ok = [s for s in samples if s.error is None]
+    tokens = sum(s.output_tokens for s in ok)
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if s.error:
+            errors[s.error] = errors.get(s.error, 0) + 1
+    report: Dict[str, Any] = {
+        "backend": client.config.backend,
+        "model": model or client.config.model,
+        "api": api,
+        "stream": stream,
+        "mode": "open-loop" if rate else "closed-loop",
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "errors": errors,
+        "duration_s": wall,
+        "requests_per_s": len(ok) / wall if wall else 0.0,
+        "output_tokens": tokens,
+        "tokens_per_s": tokens / wall if wall else 0.0,
+        "latency_s": summarize([s.latency for s in ok]),
+    }
+    if stream:
+        report["ttft_s"] = summarize([s.ttft for s in ok if s.ttft is not None])
+        report["itl_s"] = summarize([gap for s in ok for gap in s.itl])
+    if client.http_pool is not None:
+        report["http_pool"] = client.http_pool.stats()
+    if client.memory_budget is not None:
+        report["kv_memory"] = client.memory_budget.stats()
+    report["rss_mb"] = rss_mb()
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def compare_modes(model: str, modes: List[str], *, api: str = "text",
+                  prompt: str = DEFAULT_PROMPT, max_tokens: int = 64, requests: int = 8,
+                  concurrency: int = 1, warmup: int = 1) -> Dict[str, Any]:
+    """
+    Benchmark hflocal `model` under each mode (see `parse_mode`), one fresh
+    ``mlhq bench`` subprocess per mode. Returns {mode: summary} with
+    tokens/s, latency, load time and resident memory, or the error.
+    """
+    results: Dict[str, Any] = {}
+    for mode in modes:
+        parse_mode(mode)  # fail fast on typos
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "report.json")
+            cmd = [sys.executable, "-m", "mlhq", "bench", "--backend", "hflocal",
+                   "--model", model, "--mode", mode, "--api", api, "--no-stream",
+                   "--prompt", prompt, "--max-tokens", str(max_tokens),
+                   "--requests", str(requests), "--concurrency", str(concurrency),
+                   "--warmup", str(warmup), "--output", out]
+            logger.info("Benchmarking mode %s", mode)
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  text=True)
+            if proc.returncode != 0 or not os.path.exists(out):
+                results[mode] = {"error": proc.stderr.strip().splitlines()[-1:]}
+                continue
+            with open(out) as f:
+                report = json.load(f)
+        results[mode] = {
+            "succeeded": report["succeeded"],
+            "errors": report["errors"],
+            "tokens_per_s": report["tokens_per_s"],
+            "latency_p50_s": report["latency_s"]["p50"],
+            "latency_p95_s": report["latency_s"]["p95"],
+            "load_s": report.get("load_s"),
+            "rss_mb": report["rss_mb"],
+            "peak_rss_mb": report["peak_rss_mb"],
+        }
+    return results
+
+
+class _SlowSink(io.StringIO):
+    """A log stream whose every write takes `latency` seconds (a slow pipe or
+    network filesystem)."""
+
+    def __init__(self, latency: float) -> None:
+        super().__init__()
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        time.sleep(self.latency)
+        self.lines += 1
+        return len(text)
+
+
+# label -> (setup_logging kwargs or None for level INFO, lazy arguments?)
+_LOGGING_MODES = {
+    "disabled_fstring": (None, False),
+    "disabled": (None, True),
+    "sync": ({"background": False}, True),
+    "background": ({}, True),
+    "background_json": ({"json_lines": True}, True),
+    "background_sampled_1pct": ({"sample": {"mlhq": 0.01}}, True),
+}
+
+
+def logging_overhead(calls: int = 1000, sink_latency: float = 0.0005) -> Dict[str, Any]:
+    """
+    Time the per-request DEBUG records of a generate call (the generate kwargs
+    plus the request summary with timings) under each logging setup, writing
+    to a sink that takes `sink_latency` per line. Reports microseconds per
+    call on the calling thread; the mlhq logger's configuration is restored
+    afterwards.
+    """
+    root = logging.getLogger("mlhq")
+    saved = (root.level, list(root.handlers), root.propagate)
+    kwargs = {"max_new_tokens": 64, "do_sample": True, "temperature": 0.7, "top_p": 0.9,
+              "stop": ["\n\n"], "pad_token_id": 0}
+    phases = {"tokenize": 0.0002, "prefill": 0.031, "decode": 0.42, "detokenize": 0.001,
+              "dispatch": 0.0001, "total": 0.45}
+    usage = {"prompt_tokens": 12, "completion_tokens": 64, "total_tokens": 76}
+    report: Dict[str, Any] = {"calls": calls, "sink_latency_s": sink_latency}
+    try:
+        for label, (setup, lazy) in _LOGGING_MODES.items():
+            sink = _SlowSink(sink_latency)
+            setup_logging("INFO" if setup is None else "DEBUG", stream=sink,
+                          **(setup or {}))
+            start = time.perf_counter()
+            for i in range(calls):
+                if lazy:
+                    logger.debug("Text-generation kwargs: %s", kwargs)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("%s %s in %.4fs", "text_generation", "ok", phases["total"],
+                                     extra={"request_id": i, "timings": phases, "usage": usage})
+                else:
+                    logger.debug(f"Text-generation kwargs: {kwargs}")
+                    logger.debug(f"text_generation ok in {phases['total']:.4f}s {phases}")
+            elapsed = time.perf_counter() - start
+            shutdown_logging()  # drain, so the next mode starts idle
+            report[label] = {"us_per_call": elapsed / calls * 1e6, "lines": sink.lines}
+    finally:
+        shutdown_logging()
+        root.setLevel(saved[0])
+        root.handlers[:] = saved[1]
+        root.propagate = saved[2]
+    return report
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .types import MLHQResponse
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+
+# ---------- keys ----------
+
+def _normalize(obj: Any) -> Any:
+    """Canonical, JSON-able form of request kwargs (key order, 1 vs 1.0, None fields)."""
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v) for k, v in sorted(obj.items()) if v is not None}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    if isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    if hasattr(obj, "model_dump"):
+        return _normalize(obj.model_dump())
+    return repr(obj)
+
+
+# load-time settings of local backends that change what a model outputs
+LOCAL_KEY_SETTINGS = ("torch_dtype", "quantization", "draft_model", "embedding_model",
+                      "embedding_pooling")
+
+
+def is_sampled(kwargs: Dict[str, Any], default: bool = False) -> bool:
+    """Whether a request asks for random samples (which must not be replayed
+    from the cache): several choices, or sampling not explicitly turned off
+    (``temperature=0`` / ``do_sample=False``) while temperature > 0,
+    ``do_sample=True`` or ``top_p`` < 1 ask for it. A request that says
+    neither gets the backend's `default` (OpenAI samples at temperature 1)."""
+    if (kwargs.get("n") or 1) > 1:
+        return True
+    if kwargs.get("do_sample") is False or kwargs.get("temperature") == 0:
+        return False
+    top_p = kwargs.get("top_p")
+    if (kwargs.get("do_sample") or (kwargs.get("temperature") or 0) > 0
+            or (top_p is not None and top_p < 1)):
+        return True
+    return default
+
+
+def samples_by_default(generation_config: Any) -> bool:
+    """Whether a HF generation config samples when a request leaves
+    do_sample/temperature out."""
+    temperature = getattr(generation_config, "temperature", None)
+    return (bool(getattr(generation_config, "do_sample", False))
+            and (temperature is None or temperature > 0))
+
+
+def cache_key(backend: str, model: Optional[str], method: str, args: Tuple[Any, ...],
+              kwargs: Dict[str, Any], settings: Optional[Dict[str, Any]] = None) -> str:
+    """Content hash of a request; `settings` are client-level options that
+    change outputs (e.g. LOCAL_KEY_SETTINGS for hflocal)."""
+    payload = {
+        "backend": backend,
+        "model": kwargs.get("model", model),
+        "method": method,
+        "args": args,
+        "kwargs": kwargs,
+        "settings": settings,
+    }
+    blob = json.dumps(_normalize(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+# ---------- (de)serialization ----------
+
+def _dump_raw(raw: Any) -> Any:
+    if hasattr(raw, "model_dump"):
+        return raw.model_dump()
+    try:
+        json.dumps(raw)
+        return raw
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_result(result: Any) -> Optional[str]:
+    """JSON for a cacheable call result, or None if it can't be cached."""
+    if isinstance(result, MLHQResponse):
+        data = result.to_dict()
+        data["raw"] = _dump_raw(result.raw)
+        data.pop("cached", None)
+        data.pop("timings", None)  # per call, not per result
+        return json.dumps({"response": data})
+    if isinstance(result, str) or (isinstance(result, list)
+                                   and all(isinstance(r, str) for r in result)):
+        return json.dumps({"text": result})
+    return None
+
+
+def decode_result(blob: str) -> Any:
+    data = json.loads(blob)
+    if "response" in data:
+        return MLHQResponse(**data["response"], cached=True)
+    return data["text"]
+
+
+# ---------- tiers ----------
+
+class MemoryLRU:
+    """In-process LRU of encoded results with optional TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            created, blob = item
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return blob
+
+    def set(self, key: str, blob: str, created: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (created or time.time(), blob)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache:
+    """
+    Persistent tier in a single sqlite file (WAL mode, safe to share between
+    processes). Entries expire after `ttl` seconds; once the stored payload
+    exceeds `max_bytes` the least recently read entries are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1 << 30, ttl: Optional[float] = None) -> None:
+        if os.path.isdir(path) or path.endswith(os.sep):
+            path = os.path.join(path, "responses.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            blob, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return created, blob
+
+    def set(self, key: str, blob: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            freed += size
+            if total - freed <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU, then optional sqlite) content-addressed result cache."""
+
+    def __init__(self, *, max_entries: int = 1024, ttl: Optional[float] = None,
+                 path: Optional[str] = None, max_bytes: int = 1 << 30) -> None:
+        self.memory = MemoryLRU(max_entries, ttl)
+        self.disk = DiskCache(path, max_bytes, ttl) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        blob = self.memory.get(key)
+        if blob is None and self.disk is not None:
+            blob = self._promote(key, self.disk.get(key))
+        return self._decode(blob)
+
+    def set(self, key: str, result: Any) -> None:
+        blob = encode_result(result)
+        if blob is None:
+            return
+        self.memory.set(key, blob)
+        if self.disk is not None:
+            self.disk.set(key, blob)
+
+    # for AsyncClient: the sqlite tier is read/written on a worker thread so
+    # disk I/O never blocks the event loop; memory hits stay inline
+
+    async def aget(self, key: str) -> Any:
+        blob = self.memory.get(key)
+        if blob is None and self.disk is not None:
+            blob = self._promote(key, await asyncio.to_thread(self.disk.get, key))
+        return self._decode(blob)
+
+    async def aset(self, key: str, result: Any) -> None:
+        blob = encode_result(result)
+        if blob is None:
+            return
+        self.memory.set(key, blob)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, blob)
+
+    def _promote(self, key: str, item: Optional[Tuple[float, str]]) -> Optional[str]:
+        if item is None:
+            return None
+        created, blob = item
+        self.memory.set(key, blob, created)
+        return blob
+
+    def _decode(self, blob: Optional[str]) -> Any:
+        if blob is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_result(blob)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory._data),
+            "disk_bytes": self.disk.size() if self.disk is not None else 0,
+        }
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
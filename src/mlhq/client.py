@@ -1,11 +1,16 @@
 from __future__ import annotations
-from typing import Optional, Any
+from typing import Optional, Any, Callable, Dict, List, Union
 from dataclasses import dataclass
 import json 
+import logging
 
 from .backends.base import Backend
-from .backends.openai_backend import OpenAIBackend
-from .backends.hf_backend import HFLocalBackend
+from .backends.registry import get_backend
+from .cache import LOCAL_KEY_SETTINGS, ResponseCache, cache_key, is_sampled
+from .metrics import Metrics, Timings, timed_request
+from .ratelimit import RequestPolicy
+from .tokens import Tokens
+from .types import MLHQEmbeddings, MLHQResponse, _StreamAccumulator
 
 from mlhq.logging_config import get_logger
 logger = get_logger(__name__)
@@ -16,63 +21,419 @@ class ClientConfig:
     def __init__(self, config=None,
             backend: str = "openai",
             api_key: Optional[str] = None, 
-            base_url: Optional[str] = None,
+            base_url: Union[str, List[str], None] = None, # a list balances across replicas
             organization: Optional[str] = None,
             project: Optional[str] = None,
-            model: Optional[str] = None # NOTE needed for HFLocal HFClient 
+            model: Optional[str] = None, # NOTE needed for HFLocal HFClient 
+            max_workers: int = 1, # executor threads for blocking backends under AsyncClient
+            max_batch_size: int = 8, # hflocal: max prompts per generate() call
+            max_batch_tokens: int = 16384, # hflocal: max rows * (prompt + new tokens) per batch
+            continuous_batching: bool = False, # hflocal: share decode steps across concurrent calls
+            # hflocal: memory cap for reused prefix KV state (0=off)
+            prefix_cache_max_bytes: int = 0,
+            # hflocal: bytes of shared models to keep; process-wide, only raised
+            model_memory_budget: Optional[int] = None,
+            # hflocal: "bfloat16"/"bf16", "float16", "float32"; None = fp32
+            torch_dtype: Optional[str] = None,
+            # hflocal: "int8" = dynamic int8 Linear layers (cpu, fp32)
+            quantization: Optional[str] = None,
+            # hflocal: torch.compile the forward (str = compile backend)
+            compile: Union[bool, str] = False,
+            # hflocal: small same-family model for assisted decoding
+            draft_model: Optional[str] = None,
+            # hflocal: tokens drafted per round (None = HF default)
+            draft_tokens: Optional[int] = None,
+            # hflocal: AutoModel for embeddings (None = the LM's hidden states)
+            embedding_model: Optional[str] = None,
+            # hflocal: "mean" or "last" (last token, decoder embedders)
+            embedding_pooling: str = "mean",
+            # hflocal: keep converted/quantized weights here, map them on later starts
+            snapshot_dir: Optional[str] = None,
+            # hflocal: True or a prompt, generated once before the client is ready
+            warmup: Any = False,
+            warmup_tokens: int = 8, # hflocal: tokens generated by the warm-up
+            # hflocal: persist regex/JSON-schema token indexes here
+            constraint_cache_dir: Optional[str] = None,
+            # hflocal: bytes of KV cache + activations in flight (None = no admission control)
+            kv_memory_budget: Optional[int] = None,
+            # hflocal: "queue" (wait for memory) or "reject" when over kv_memory_budget
+            kv_budget_policy: str = "queue",
+            # hflocal: seconds to wait under "queue" before rejecting (None = forever)
+            kv_budget_timeout: Optional[float] = None,
+            # hflocal-pool: worker processes (None = one per 4 cores)
+            pool_workers: Optional[int] = None,
+            pool_threads: Optional[int] = None, # hflocal-pool: pinned cores/threads per worker
+            # hflocal-pool: mmap the safetensors weights across workers
+            pool_share_weights: bool = True,
+            # client.tokens: memoized counts/encodings per tokenizer
+            token_cache_entries: int = 65536,
+            cache: bool = False, # response cache for identical (e.g. temperature=0) requests
+            cache_sampled: bool = False, # also cache sampled requests (replays one sample)
+            cache_dir: Optional[str] = None, # adds a persistent sqlite tier under this path
+            cache_ttl: Optional[float] = None, # seconds; None = never expire
+            cache_max_entries: int = 1024, # memory tier size
+            cache_max_bytes: int = 1 << 30, # disk tier size
+            metrics: bool = True, # per-request phase timings + aggregated counters/histograms
+            # gets every request event
+            metrics_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+            # {"gpt-4o": {"rpm": 500, "tpm": 30000}, "*": {...}}
+            rate_limits: Optional[Dict[str, Dict[str, float]]] = None,
+            # retries of 429/5xx/connection errors, jittered exponential backoff
+            max_retries: int = 2,
+            retry_base_delay: float = 0.5, # seconds; backoff cap doubles per attempt
+            retry_max_delay: float = 30.0, # seconds
+            hedge_percentile: Optional[float] = None, # e.g. 95: duplicate calls slower than the p95
+            hedge_min_samples: int = 20, # latencies observed before hedging kicks in
+            balancer_policy: Any = "least_outstanding", # or "power_of_two", "round_robin", callable
+            balancer_max_failures: int = 3, # consecutive failures before a replica is ejected
+            balancer_ejection_s: float = 30.0, # first ejection; doubles on repeats
+            # openai: connection pool size (requests beyond it wait)
+            http_max_connections: int = 1000,
+            http_max_keepalive: int = 100, # openai: idle connections kept open for reuse
+            # openai: seconds an idle connection is kept
+            http_keepalive_expiry: Optional[float] = 5.0,
+            http2: bool = False, # openai: negotiate HTTP/2 (pip install 'mlhq[http2]')
+            http_connect_timeout: float = 5.0, # openai: seconds to establish a connection
+            # openai: seconds without response data (also write/pool wait)
+            http_read_timeout: float = 600.0,
+            # openai: one httpx pool per process for Clients with equal settings
+            http_shared: bool = True,
         ): 
+        self.backend = backend
+        self.api_key = api_key
+        self.base_url = base_url
+        self.organization = organization
+        self.project = project
+        self.model = model
+        self.max_workers = max_workers
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.continuous_batching = continuous_batching
+        self.prefix_cache_max_bytes = prefix_cache_max_bytes
+        self.model_memory_budget = model_memory_budget
+        self.torch_dtype = torch_dtype
+        self.quantization = quantization
+        self.compile = compile
+        self.draft_model = draft_model
+        self.draft_tokens = draft_tokens
+        self.embedding_model = embedding_model
+        self.embedding_pooling = embedding_pooling
+        self.snapshot_dir = snapshot_dir
+        self.warmup = warmup
+        self.warmup_tokens = warmup_tokens
+        self.constraint_cache_dir = constraint_cache_dir
+        self.kv_memory_budget = kv_memory_budget
+        self.kv_budget_policy = kv_budget_policy
+        self.kv_budget_timeout = kv_budget_timeout
+        self.pool_workers = pool_workers
+        self.pool_threads = pool_threads
+        self.pool_share_weights = pool_share_weights
+        self.token_cache_entries = token_cache_entries
+        self.cache = cache
+        self.cache_sampled = cache_sampled
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self.cache_max_bytes = cache_max_bytes
+        self.metrics = metrics
+        self.metrics_callback = metrics_callback
+        self.rate_limits = rate_limits
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.balancer_policy = balancer_policy
+        self.balancer_max_failures = balancer_max_failures
+        self.balancer_ejection_s = balancer_ejection_s
+        self.http_max_connections = http_max_connections
+        self.http_max_keepalive = http_max_keepalive
+        self.http_keepalive_expiry = http_keepalive_expiry
+        self.http2 = http2
+        self.http_connect_timeout = http_connect_timeout
+        self.http_read_timeout = http_read_timeout
+        self.http_shared = http_shared
+
         config_data = {} 
         if config: 
             with open(config, 'r') as f:
                 config_data = json.load(f)
-            logger.debug(f"Config fields: {config_data}")
+            logger.debug("Config fields: %s", config_data)
 
         for k,v in config_data.items(): 
             self.__dict__[k] = v 
        
-        if "api_key" not in self.__dict__: 
+        if self.api_key is None: 
             self.api_key = "abc123"
 
+class _Create:
+    """Routes ``<surface>.create(...)`` through Client._dispatch."""
+
+    def __init__(self, client: "Client", method: str, target: Any) -> None:
+        self._client = client
+        self._method = method
+        self._target = target
+
+    def create(self, **kwargs: Any) -> Any:
+        return self._client._dispatch(self._method, self._target.create, (), kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+
+class _AsyncCreate(_Create):
+    async def create(self, **kwargs: Any) -> Any:
+        return await self._client._dispatch(self._method, self._target.create, (), kwargs)
+
+
+class _Chat:
+    def __init__(self, client: "Client", target: Any) -> None:
+        self._target = target
+        self.completions = client._create_cls(client, "chat.completions", target.completions)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target, name)
+
+
 class Client:
     """
     Provider-agnostic façade exposing:
       - client.responses.create(...)
       - client.chat.completions.create(...)
+      - client.embeddings.create(...)
     """
 
     # populated after backend selection
     responses: Any
     chat: Any
+    embeddings: Any
+
+    _asynchronous = False
+    _create_cls = _Create
 
     def __init__(self, **kwargs):
-        logger.info(f"Initializing MLHQ Client : {kwargs}")
+        logger.debug("Initializing MLHQ Client : %s", kwargs)
 
         cfg = ClientConfig(**kwargs)
 
         self._cfg = cfg
 
-        if cfg.backend == "openai":
-            self._backend: Backend = OpenAIBackend(
-                api_key=cfg.api_key,
-                base_url=cfg.base_url,
-                organization=cfg.organization,
-                project=cfg.project,
-            )
-            self.responses = self._backend.responses
-            self.chat = self._backend.chat
-        elif cfg.backend == "hflocal": 
-            self._backend = HFLocalBackend(
-                model = cfg.model,
-            )
-        else:
-            raise ValueError(f"Unsupported backend: {cfg.backend!r}")
+        # Backend modules (and their heavy deps, e.g. torch) are only
+        # imported here, the first time a backend name is selected.
+        backend_cls = get_backend(cfg.backend, asynchronous=self._asynchronous)
+        self._backend: Backend = backend_cls(**vars(cfg))
+
         # TODO: note that witin each backend we are remapping the method
         # access up from the backend to the self. we need to normalize 
         # these other simply get the HFFace Local and Infereclient up 
         # to the OpenAI standard. 
+        self._cache = None
+        if cfg.cache:
+            self._cache = ResponseCache(
+                max_entries=cfg.cache_max_entries,
+                ttl=cfg.cache_ttl,
+                path=cfg.cache_dir,
+                max_bytes=cfg.cache_max_bytes,
+            )
+        # two local clients of one model at different precision (or with another
+        # draft/embedding model) must not share entries
+        self._key_settings = None
+        if cfg.backend in ("hflocal", "hflocal-pool"):
+            self._key_settings = {k: getattr(cfg, k) for k in LOCAL_KEY_SETTINGS}
+        # what a request that leaves temperature/do_sample out does (openai:
+        # samples at T=1; hflocal: the model's generation_config)
+        self._samples_by_default = False
+        if cfg.cache:
+            self._samples_by_default = bool(getattr(self._backend, "samples_by_default", False))
+
+        self._metrics = None
+        if cfg.metrics:
+            self._metrics = Metrics()
+            if cfg.metrics_callback is not None:
+                self._metrics.add_callback(cfg.metrics_callback)
+            budget = getattr(self._backend, "memory_budget", None)
+            if budget is not None:
+                labels = (("backend", cfg.backend), ("model", cfg.model or ""))
+                self._metrics.add_gauge("mlhq_kv_reserved_bytes",
+                                        lambda: budget.stats()["reserved_bytes"], labels)
+                self._metrics.add_gauge("mlhq_kv_budget_bytes", lambda: budget.budget, labels)
+
+        self._tokens = Tokens(self._backend, cfg.model, cfg.token_cache_entries)
+
+        # only for backends that opt in (remote APIs): re-running or hedging a
+        # local generate would just burn CPU and repeat the failure
+        self._policy = None
+        if getattr(self._backend, "uses_request_policy", False):
+            self._policy = RequestPolicy(
+                rate_limits=cfg.rate_limits,
+                max_retries=cfg.max_retries,
+                retry_base_delay=cfg.retry_base_delay,
+                retry_max_delay=cfg.retry_max_delay,
+                hedge_percentile=cfg.hedge_percentile,
+                hedge_min_samples=cfg.hedge_min_samples,
+            )
+
+        # Every call goes through _dispatch (cache lookup, timings, rate limits,
+        # retries, ...) before the backend.
+        if getattr(self._backend, "responses", None) is not None:
+            self.responses = self._create_cls(self, "responses", self._backend.responses)
+        if getattr(self._backend, "chat", None) is not None:
+            self.chat = _Chat(self, self._backend.chat)
+        if getattr(self._backend, "embeddings", None) is not None:
+            self.embeddings = self._create_cls(self, "embeddings", self._backend.embeddings)
+        if getattr(self._backend, "text_generation", None) is not None:
+            self.text_generation = self._bind("text_generation", self._backend.text_generation)
+        if getattr(self._backend, "chat_completion_batch", None) is not None:
+            # many conversations in one batched generate pass (hflocal)
+            self.chat_completion_batch = self._bind(
+                "chat_completion_batch", self._backend.chat_completion_batch
+            )
+
+    def _bind(self, method: str, fn: Any) -> Any:
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return self._dispatch(method, fn, args, kwargs)
+        call.__doc__ = fn.__doc__
+        return call
 
+    def _cache_key(self, method: str, args: tuple, kwargs: dict) -> Optional[str]:
+        if self._cache is None or kwargs.get("stream"):
+            return None
+        if (not self._cfg.cache_sampled and method != "embeddings"
+                and is_sampled(kwargs, self._samples_by_default)):
+            return None
+        return cache_key(self._cfg.backend, self._cfg.model, method, args, kwargs,
+                         self._key_settings)
 
-        self.text_generation = self._backend.text_generation
+    def _dispatch(self, method: str, fn: Any, args: tuple, kwargs: dict) -> Any:
+        timings = Timings() if self._metrics is not None else None
+        with timed_request(timings):
+            key = self._cache_key(method, args, kwargs)
+            if key is not None:
+                hit = self._cache.get(key)
+                if hit is not None:
+                    return self._observe(method, hit, timings)
+            try:
+                if self._policy is None:
+                    result = fn(*args, **kwargs)
+                else:
+                    result = self._policy.call(method, self._model(kwargs), fn, args, kwargs)
+            except Exception:
+                self._observe(method, None, timings, status="error")
+                raise
+            if key is not None:
+                self._cache.set(key, result)
+            return self._observe(method, result, timings)
+
+    def _model(self, kwargs: dict) -> Optional[str]:
+        return kwargs.get("model") or self._cfg.model
+
+    def _observe(self, method: str, result: Any, timings: Optional[Timings],
+                 status: str = "ok") -> Any:
+        """Attach phase timings to `result` and feed the metrics; streams are
+        reported once drained."""
+        if timings is None:
+            return result
+        if isinstance(result, _StreamAccumulator):
+            # time spent between chunks belongs to the caller, so the stream's
+            # dispatch overhead is what was unattributed when it was handed out
+            overhead = timings.unattributed()
+
+            def done(response: MLHQResponse) -> None:
+                phases = timings.finish()
+                phases["dispatch"] = overhead
+                if result.first_token_at is not None:
+                    phases["ttft"] = result.first_token_at - timings.start
+                self._report(method, response, phases, status, timings.request_id)
+
+            result._on_finish.append(done)
+            return result
+        self._report(method, result, timings.finish(), status, timings.request_id)
+        return result
+
+    def _report(self, method: str, result: Any, phases: Dict[str, float], status: str,
+                request_id: Optional[int] = None) -> None:
+        responses = [r for r in (result if isinstance(result, list) else [result])
+                     if isinstance(r, (MLHQResponse, MLHQEmbeddings))]
+        usage: Dict[str, int] = {}
+        for r in responses:
+            r.timings = phases
+            for k, v in (r.usage or {}).items():
+                if isinstance(v, int):
+                    usage[k] = usage.get(k, 0) + v
+        self._metrics.observe({
+            "method": method,
+            "backend": self._cfg.backend,
+            "model": self._cfg.model or next((r.model for r in responses if r.model), None),
+            "status": status,
+            "cached": any(r.cached for r in responses),
+            "timings": phases,
+            "usage": usage,
+        })
+        if logger.isEnabledFor(logging.DEBUG):  # skip building `extra` otherwise
+            logger.debug("%s %s in %.4fs", method, status, phases["total"],
+                         extra={"request_id": request_id, "method": method, "status": status,
+                                "timings": phases, "usage": usage})
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return self._cache
+
+    @property
+    def balancer(self) -> Any:
+        """The LoadBalancer when `base_url` lists several replicas (``.stats()``
+        gives per-endpoint load, errors and latency), else None."""
+        return getattr(self._backend, "balancer", None)
+
+    @property
+    def tokens(self) -> Tokens:
+        """Count / encode prompts with the model's tokenizer, without generating
+        (``tokens.count(...)``, ``tokens.encode(...)``)."""
+        return self._tokens
+
+    @property
+    def pool(self) -> Any:
+        """The WorkerPool of the ``hflocal-pool`` backend (``.stats()``,
+        ``.restart()``), else None."""
+        return getattr(self._backend, "pool", None)
+
+    @property
+    def http_pool(self) -> Any:
+        """The HTTPPool of the OpenAI backend (``.stats()``: utilization,
+        pool wait, connections opened/reused), else None."""
+        return getattr(self._backend, "http_pool", None)
+
+    @property
+    def memory_budget(self) -> Any:
+        """The hflocal MemoryBudget when ``kv_memory_budget`` is set
+        (``.stats()``: reserved vs budget bytes, queued/rejected), else None."""
+        return getattr(self._backend, "memory_budget", None)
+
+    @property
+    def policy(self) -> Optional[RequestPolicy]:
+        """Rate limiter / retry / hedging state (see ``policy.stats()``); None
+        for backends that run locally (no rate limits, retries or hedging)."""
+        return self._policy
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        """Aggregated request metrics (``.to_prometheus()``, ``.snapshot()``), or
+        None when created with ``metrics=False``."""
+        return self._metrics
+
+    def close(self) -> None:
+        if self._cache is not None:
+            self._cache.close()
+        if self._policy is not None:
+            self._policy.close()
+        close = getattr(self._backend, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
 
     @property
     def config(self) -> ClientConfig:
@@ -80,5 +441,70 @@ class Client:
 
     def __repr__(self) -> str:
         redacted = "***" if self._cfg.api_key else None
-        return f"Client(backend={self._cfg.backend!r}, base_url={self._cfg.base_url!r}, api_key={redacted})"
+        return (
+            f"{type(self).__name__}(backend={self._cfg.backend!r}, "
+            f"base_url={self._cfg.base_url!r}, api_key={redacted})"
+        )
+
+
+class AsyncClient(Client):
+    """
+    asyncio twin of Client with the same surface; every call is awaitable:
+      - await client.responses.create(...)
+      - await client.chat.completions.create(...)
+      - await client.text_generation(...)
+
+    OpenAI uses AsyncOpenAI natively; blocking backends (hflocal) are offloaded
+    to a bounded executor sized by ``ClientConfig.max_workers``.
+    """
+
+    _asynchronous = True
+    _create_cls = _AsyncCreate
+
+    def _bind(self, method: str, fn: Any) -> Any:
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._dispatch(method, fn, args, kwargs)
+        call.__doc__ = fn.__doc__
+        return call
+
+    async def _dispatch(self, method: str, fn: Any, args: tuple, kwargs: dict) -> Any:
+        timings = Timings() if self._metrics is not None else None
+        with timed_request(timings):
+            key = self._cache_key(method, args, kwargs)
+            if key is not None:
+                hit = await self._cache.aget(key)
+                if hit is not None:
+                    return self._observe(method, hit, timings)
+            try:
+                if self._policy is None:
+                    result = await fn(*args, **kwargs)
+                else:
+                    result = await self._policy.acall(method, self._model(kwargs), fn,
+                                                      args, kwargs)
+            except Exception:
+                self._observe(method, None, timings, status="error")
+                raise
+            if key is not None:
+                await self._cache.aset(key, result)
+            return self._observe(method, result, timings)
+
+    async def close(self) -> None:
+        if self._cache is not None:
+            self._cache.close()
+        if self._policy is not None:
+            self._policy.close()
+        close = getattr(self._backend, "close", None)
+        if close is not None:
+            await close()
+
+    def __enter__(self) -> "AsyncClient":
+        # close() is a coroutine: a plain `with` would drop it unawaited and
+        # leak the backend, its executor and HTTP pool
+        raise TypeError("AsyncClient is an async context manager: use 'async with'")
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
 
@@ -1,47 +1,220 @@
+"""
+Logging for the mlhq package.
+
+``setup_logging`` attaches one handler to the ``mlhq`` logger. By default it
+is a queue handler: the calling thread only merges the message with its
+arguments and enqueues the record; a background listener thread formats it
+and writes it out, so a slow sink (a pipe, a network filesystem) never
+stalls a request or a generate() thread. When the queue is full, records
+are dropped and counted rather than blocking.
+
+    setup_logging("DEBUG", json_lines=True, sample={"mlhq.hf_backend": 0.01})
+
+``json_lines=True`` writes one JSON object per record with the request id
+of the call being served (when there is one) and any structured ``extra``
+fields such as ``timings`` and ``usage``. ``sample`` keeps only a fraction
+of the DEBUG records of the named loggers; INFO and above always pass.
+
+Log calls in mlhq pass their arguments lazily (``logger.debug("%s", x)``),
+so a disabled level costs one level check.
+"""
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import sys
-from typing import Optional
+import threading
+from typing import Any, Dict, IO, Optional
+
+_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# structured fields copied into JSON lines when a record carries them
+# (via ``extra=``)
+_EXTRA_FIELDS = ("request_id", "method", "status", "timings", "usage")
+
+_listener: Optional[logging.handlers.QueueListener] = None  # background writer
+_lock = threading.Lock()
+
+
+class _RequestIdFilter(logging.Filter):
+    """Stamps records with the id of the request being served, if any."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            from .metrics import current_timings  # metrics imports this module
+            timings = current_timings()
+            record.request_id = timings.request_id if timings is not None else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the DEBUG records of some loggers: `rates` maps a
+    logger name (or a parent, e.g. "mlhq") to the share to keep. Sampling is
+    deterministic (every 1/rate-th record), so counts stay proportional.
+    """
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = {name: min(max(float(r), 0.0), 1.0) for name, r in rates.items()}
+        self._credit: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name: str) -> Optional[float]:
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return rate
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1.0:
+            return True
+        with self._lock:
+            credit = self._credit.get(record.name, 1.0 - rate) + rate
+            keep = credit >= 1.0
+            self._credit[record.name] = credit - 1.0 if keep else credit
+        return keep
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, request_id and the
+    structured extras (timings, usage, ...) present on the record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in _EXTRA_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                out[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: only the message is rendered on the
+    calling thread (the arguments may change after the call); everything
+    else is left to the listener. Full queue -> the record is dropped."""
 
-def setup_logging(level: str = "INFO") -> None:
+    def __init__(self, q: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)  # wait for room: the queue may be full
+
+
+def setup_logging(level: str = "INFO", *, json_lines: bool = False,
+                  stream: Optional[IO[str]] = None, background: bool = True,
+                  sample: Optional[Dict[str, float]] = None,
+                  max_queue: int = 10000) -> logging.Handler:
     """Configure logging for the entire mlhq package.
-    
+
     Args:
         level: Log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+        json_lines: write JSON lines (with request ids / timings) instead of text
+        stream: where to write (default: stdout)
+        background: write from a listener thread behind a bounded queue
+        sample: {logger name: share of its DEBUG records to keep}
+        max_queue: records buffered before new ones are dropped
+
+    Returns:
+        The handler attached to the ``mlhq`` logger (``.dropped`` counts
+        records lost to a full queue when `background`).
     """
+    global _listener
     # Validate log level
     level = level.upper()
-    if level not in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']:
+    if level not in _LEVELS:
         raise ValueError(f"Invalid log level: {level}")
-    
+
+    shutdown_logging()
+
     # Configure root logger for the mlhq package
     logger = logging.getLogger('mlhq')
     logger.setLevel(getattr(logging, level))
-    
+
     # Remove any existing handlers to avoid duplicates
     logger.handlers.clear()
-    
-    # Create console handler
-    handler = logging.StreamHandler(sys.stdout)
+
+    # Create the writing handler and its formatter
+    handler = logging.StreamHandler(stream or sys.stdout)
     handler.setLevel(getattr(logging, level))
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    
+    if json_lines:
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+
+    front: logging.Handler = handler
+    if background:
+        front = _QueueHandler(queue.Queue(max_queue))
+        with _lock:
+            _listener = _QueueListener(front.queue, handler, respect_handler_level=True)
+            _listener.start()
+    # filters run on the calling thread, before the record is queued
+    if sample:
+        front.addFilter(SamplingFilter(sample))
+    front.addFilter(_RequestIdFilter())
+
     # Add handler to logger
-    logger.addHandler(handler)
-    
+    logger.addHandler(front)
+
     # Prevent propagation to root logger to avoid duplicate messages
     logger.propagate = False
+    return front
+
+
+def shutdown_logging() -> None:
+    """Stop the background writer (if any) after it has written every
+    queued record. Runs at exit."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(shutdown_logging)
 
 def get_logger(name: str) -> logging.Logger:
     """Get a logger for the given module name.
-    
+
     Args:
         name: Usually __name__ from the calling module
-        
+
     Returns:
         Configured logger instance
     """
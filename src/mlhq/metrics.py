@@ -0,0 +1,290 @@
+"""
+Per-request phase timings and aggregated client metrics.
+
+Every Client call gets a `Timings` recorder (a contextvar, so it follows the
+call into executor threads and generate() worker threads); backends add the
+phases they own with ``phase("tokenize")`` / ``record("prefill", dt)``:
+
+    dispatch    time inside mlhq outside the phases below (config, cache, wrapping)
+    queue       waiting for a continuous-batching slot or KV memory (hflocal)
+    tokenize    prompt / chat template -> ids (hflocal)
+    prefill     prompt forward pass up to the first token (hflocal)
+    decode      remaining generation steps (hflocal)
+    detokenize  ids -> text (hflocal)
+    network     provider round trip (openai)
+    throttle    waiting on the client-side rate limiter
+    backoff     sleeping between retries
+
+Finished requests are folded into `Metrics` counters and histograms, which can
+be exported in Prometheus text format or pushed to callbacks.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import itertools
+import math
+import threading
+import time
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+PHASES = ("dispatch", "queue", "tokenize", "prefill", "decode", "detokenize", "network",
+          "throttle", "backoff")
+
+# seconds; roughly Prometheus' defaults stretched for LLM latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_request_ids = itertools.count(1)
+
+
+class Timings:
+    """Accumulates seconds per phase for one request; `request_id` tags the
+    request's log records."""
+
+    __slots__ = ("phases", "start", "request_id")
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.start = time.perf_counter()
+        self.request_id = next(_request_ids)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def get(self, name: str) -> float:
+        return self.phases.get(name, 0.0)
+
+    def unattributed(self, end: Optional[float] = None) -> float:
+        """Wall time since `start` not covered by any recorded phase."""
+        total = (end or time.perf_counter()) - self.start
+        return max(total - sum(self.phases.values()), 0.0)
+
+    def finish(self, end: Optional[float] = None) -> Dict[str, float]:
+        """Close the request: phases plus `total` and `dispatch` (the unattributed rest)."""
+        end = end or time.perf_counter()
+        out = dict(self.phases)
+        out["dispatch"] = self.unattributed(end)
+        out["total"] = end - self.start
+        return out
+
+
+_current: ContextVar[Optional[Timings]] = ContextVar("mlhq_timings", default=None)
+
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+
+def record(name: str, seconds: float) -> None:
+    """Add `seconds` to phase `name` of the request being served, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time the enclosed block as phase `name` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+@contextmanager
+def untimed() -> Iterator[None]:
+    """Run the enclosed block outside any request's timings (e.g. a hedge)."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed_request(timings: Optional[Timings]) -> Iterator[Optional[Timings]]:
+    """Make `timings` the current recorder for the enclosed block."""
+    if timings is None:
+        yield None
+        return
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+# ---------- aggregation ----------
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear-interpolated percentile of `values` (p in [0, 100])."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _fmt_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Metrics:
+    """
+    Thread-safe counters and histograms over finished requests.
+
+    ``observe(event)`` takes the per-request event dict Client builds
+    (method, backend, model, status, cached, timings, usage) and updates:
+
+      mlhq_requests_total{backend,model,method,status}
+      mlhq_tokens_total{backend,model,method,kind=prompt|completion}
+      mlhq_request_duration_seconds{backend,model,method}        (histogram)
+      mlhq_phase_duration_seconds{backend,model,method,phase}    (histogram)
+      mlhq_time_to_first_token_seconds{backend,model,method}     (histogram, streams)
+
+    Gauges registered with `add_gauge` are read when rendered; Client adds
+    mlhq_kv_reserved_bytes / mlhq_kv_budget_bytes{backend,model} for an
+    hflocal ``kv_memory_budget``.
+
+    Callbacks registered with `add_callback` (or ``ClientConfig(metrics_callback=...)``)
+    receive every event; exceptions they raise are logged, never propagated.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._gauges: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+        self._callbacks: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_callback(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+        self._callbacks.append(fn)
+
+    def add_gauge(self, name: str, fn: Callable[[], float], labels: Labels = ()) -> None:
+        """Export the current value of `fn()` as gauge `name`."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[labels] = fn
+
+    def _inc(self, name: str, labels: Labels, value: float = 1.0) -> None:
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0.0) + value
+
+    def _observe(self, name: str, labels: Labels, value: float) -> None:
+        series = self._histograms.setdefault(name, {})
+        hist = series.get(labels)
+        if hist is None:
+            hist = series[labels] = _Histogram(self.buckets)
+        hist.observe(value)
+
+    def observe(self, event: Dict[str, Any]) -> None:
+        base: Labels = (("backend", event.get("backend") or ""),
+                        ("model", event.get("model") or ""),
+                        ("method", event.get("method") or ""))
+        timings = event.get("timings") or {}
+        usage = event.get("usage") or {}
+        with self._lock:
+            self._inc("mlhq_requests_total", base + (("status", event.get("status", "ok")),))
+            if event.get("cached"):
+                self._inc("mlhq_cache_hits_total", base)
+            for kind in ("prompt", "completion"):
+                n = usage.get(f"{kind}_tokens") or usage.get(
+                    "input_tokens" if kind == "prompt" else "output_tokens")
+                if n:
+                    self._inc("mlhq_tokens_total", base + (("kind", kind),), n)
+            if "total" in timings:
+                self._observe("mlhq_request_duration_seconds", base, timings["total"])
+            if "ttft" in timings:
+                self._observe("mlhq_time_to_first_token_seconds", base, timings["ttft"])
+            for name, seconds in timings.items():
+                if name not in ("total", "ttft"):
+                    self._observe("mlhq_phase_duration_seconds", base + (("phase", name),),
+                                  seconds)
+        for fn in self._callbacks:
+            try:
+                fn(event)
+            except Exception:
+                logger.exception("metrics callback %r failed", fn)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-dict view: counters by label set, histograms as count/sum/mean."""
+        with self._lock:
+            return {
+                "counters": {name: {_fmt_labels(k): v for k, v in series.items()}
+                             for name, series in self._counters.items()},
+                "histograms": {name: {_fmt_labels(k): {"count": h.count, "sum": h.sum,
+                                                       "mean": h.sum / h.count if h.count else 0.0}
+                                      for k, h in series.items()}
+                               for name, series in self._histograms.items()},
+                "gauges": {name: {_fmt_labels(k): fn() for k, fn in series.items()}
+                           for name, series in self._gauges.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in series.items():
+                    cumulative = 0
+                    for bound, n in zip(self.buckets + (math.inf,), h.counts):
+                        cumulative += n
+                        le = (("le", _fmt_value(bound)),)
+                        lines.append(f"{name}_bucket{_fmt_labels(labels, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(h.sum)}")
+                    lines.append(f"{name}_count{_fmt_labels(labels)} {h.count}")
+            for name, gauges in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for labels, fn in gauges.items():
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(fn())}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
@@ -0,0 +1,397 @@
+"""
+Client-side rate limiting, retries and request hedging.
+
+`RequestPolicy` wraps each backend call Client/AsyncClient makes to a remote
+backend (one with ``uses_request_policy = True``, i.e. openai):
+
+  1. per-model token buckets for requests/min and (estimated) tokens/min
+     (``ClientConfig.rate_limits``) delay calls instead of letting the
+     provider answer with 429s; token estimates are settled against the
+     real ``usage`` afterwards;
+  2. retryable failures (429, 408/409, 5xx, connection errors) are retried
+     with full-jitter exponential backoff, honouring ``Retry-After``;
+  3. with ``hedge_percentile`` set, a non-streaming call still running past
+     that percentile of recent latencies gets a duplicate request, and
+     whichever finishes first wins.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+import asyncio
+import contextvars
+import json
+import random
+import threading
+import time
+
+from .metrics import percentile, record, untimed
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# matched by name so openai/httpx needn't be imported here
+_RETRY_ERRORS = frozenset({"APIConnectionError", "APITimeoutError", "ConnectError",
+                           "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"})
+
+# completion budget assumed when a request sets no max tokens
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled at `rate` tokens/s up to `capacity`.
+
+    ``reserve(n)`` always takes the tokens, possibly driving the balance
+    negative, and returns how long the caller must wait before acting; later
+    callers queue behind that debt, so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, n: float = 1.0) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= n
+            return max(-self._tokens / self.rate, 0.0)
+
+    def try_reserve(self, n: float = 1.0) -> bool:
+        """Take `n` tokens only if available right now."""
+        with self._lock:
+            self._refill()
+            if self._tokens < n:
+                return False
+            self._tokens -= n
+            return True
+
+    def refund(self, n: float) -> None:
+        """Give back (n > 0) or charge extra (n < 0) tokens."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + n)
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class RateLimiter:
+    """
+    Per-model RPM/TPM buckets from a mapping like::
+
+        {"gpt-4o": {"rpm": 500, "tpm": 30000}, "*": {"rpm": 60}}
+
+    ``"*"`` applies to models without their own entry. Buckets hold
+    `burst_s` seconds worth of quota (default 10s), so a full minute's
+    allowance is never fired at once.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]]) -> None:
+        self.limits = limits
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, model: Optional[str], kind: str) -> Optional[TokenBucket]:
+        name = model if model in self.limits else "*"
+        spec = self.limits.get(name)
+        if not spec or not spec.get(kind):
+            return None
+        key = (name, kind)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                per_s = spec[kind] / 60.0
+                capacity = max(per_s * spec.get("burst_s", 10.0), 1.0)
+                bucket = self._buckets[key] = TokenBucket(per_s, capacity)
+        return bucket
+
+    def reserve(self, model: Optional[str], tokens: int) -> float:
+        """Reserve one request and `tokens` tokens; returns the wait in seconds."""
+        delay = 0.0
+        for kind, n in (("rpm", 1), ("tpm", tokens)):
+            bucket = self._bucket(model, kind)
+            if bucket is not None:
+                delay = max(delay, bucket.reserve(n))
+        return delay
+
+    def try_reserve(self, model: Optional[str], tokens: int) -> bool:
+        rpm, tpm = self._bucket(model, "rpm"), self._bucket(model, "tpm")
+        if rpm is not None and not rpm.try_reserve(1):
+            return False
+        if tpm is not None and not tpm.try_reserve(tokens):
+            if rpm is not None:
+                rpm.refund(1)
+            return False
+        return True
+
+    def settle(self, model: Optional[str], estimated: int, actual: Optional[int]) -> None:
+        """Correct a token reservation once the real usage is known."""
+        bucket = self._bucket(model, "tpm")
+        if bucket is not None and actual is not None:
+            bucket.refund(estimated - actual)
+
+
+def estimate_tokens(args: tuple, kwargs: Dict[str, Any]) -> int:
+    """Rough prompt (~4 chars/token) + completion budget for a request."""
+    prompt = [a for a in args if isinstance(a, (str, list))]
+    prompt += [kwargs.get(k) for k in ("messages", "input", "prompt", "instructions")
+               if kwargs.get(k)]
+    chars = sum(len(p) if isinstance(p, str) else len(json.dumps(p, default=str))
+                for p in prompt)
+    budget = next((kwargs[k] for k in ("max_completion_tokens", "max_tokens",
+                                       "max_output_tokens", "max_new_tokens")
+                   if kwargs.get(k)), DEFAULT_COMPLETION_TOKENS)
+    return chars // 4 + int(budget)
+
+
+def _usage_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    if not isinstance(usage, dict):
+        return None
+    if "total_tokens" in usage:
+        return usage["total_tokens"]
+    return (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in RETRY_STATUSES
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in _RETRY_ERRORS for cls in type(exc).__mro__)
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:  # HTTP-date form; fall back to our own backoff
+        pass
+    return None
+
+
+class RequestPolicy:
+    """Rate limiting + retry + hedging around one backend call; see module docs."""
+
+    def __init__(self, *, rate_limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 max_retries: int = 2, retry_base_delay: float = 0.5,
+                 retry_max_delay: float = 30.0, hedge_percentile: Optional[float] = None,
+                 hedge_min_samples: int = 20, latency_window: int = 512) -> None:
+        self.limiter = RateLimiter(rate_limits) if rate_limits else None
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._latency_window = latency_window
+        self._rng = random.Random()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # ---------- pieces ----------
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """Full jitter: uniform(0, min(max_delay, base * 2**attempt)), or Retry-After."""
+        hinted = _retry_after(exc)
+        if hinted is not None:
+            return min(hinted, self.retry_max_delay)
+        cap = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return self._rng.uniform(0, cap)
+
+    def hedge_delay(self, method: str) -> Optional[float]:
+        if self.hedge_percentile is None:
+            return None
+        window = self._latencies.get(method)
+        if not window or len(window) < self.hedge_min_samples:
+            return None
+        return percentile(list(window), self.hedge_percentile)
+
+    def _observe_latency(self, method: str, seconds: float) -> None:
+        window = self._latencies.get(method)
+        if window is None:
+            window = self._latencies.setdefault(method, deque(maxlen=self._latency_window))
+        window.append(seconds)
+
+    def _hedgeable(self, model: Optional[str], tokens: int) -> bool:
+        return self.limiter is None or self.limiter.try_reserve(model, tokens)
+
+    def _refund(self, model: Optional[str], tokens: int) -> None:
+        # a failed attempt used (about) no tokens; a retry reserves its own
+        if self.limiter is not None:
+            self.limiter.settle(model, tokens, 0)
+
+    def _settle_hedge(self, model: Optional[str], tokens: int, future: Any) -> None:
+        """Done-callback settling the duplicate's own reservation (from
+        `_hedgeable`) against its usage, whether it won or not."""
+        if self.limiter is None:
+            return
+        if future.cancelled() or future.exception() is not None:
+            self._refund(model, tokens)
+        else:
+            self.limiter.settle(model, tokens, _usage_tokens(future.result()))
+
+    # ---------- sync ----------
+
+    def call(self, method: str, model: Optional[str], fn: Callable[..., Any],
+             args: tuple, kwargs: Dict[str, Any]) -> Any:
+        tokens = estimate_tokens(args, kwargs) if self.limiter is not None else 0
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                delay = self.limiter.reserve(model, tokens)
+                if delay:
+                    record("throttle", delay)
+                    time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                result = self._call_once(method, model, tokens, fn, args, kwargs)
+            except Exception as e:
+                self._refund(model, tokens)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning("Retrying %s after %r (attempt %d, %.2fs)",
+                               method, e, attempt + 1, delay)
+                self.retries += 1
+                attempt += 1
+                record("backoff", delay)
+                time.sleep(delay)
+                continue
+            if not kwargs.get("stream"):
+                self._observe_latency(method, time.perf_counter() - start)
+            if self.limiter is not None:
+                self.limiter.settle(model, tokens, _usage_tokens(result))
+            return result
+
+    def _call_once(self, method, model, tokens, fn, args, kwargs):
+        threshold = None if kwargs.get("stream") else self.hedge_delay(method)
+        if threshold is None:
+            return fn(*args, **kwargs)
+        # each attempt gets its own thread (no shared pool): concurrency is not
+        # capped, and time queued for a worker never counts toward the threshold
+        primary = _start(contextvars.copy_context(), fn, args, kwargs)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._hedgeable(model, tokens):
+            return primary.result()
+        logger.debug("Hedging %s after %.3fs", method, threshold)
+        self.hedges += 1
+        # the duplicate runs outside the caller's timings (fresh context)
+        hedge = _start(contextvars.Context(), fn, args, kwargs)
+        hedge.add_done_callback(lambda f: self._settle_hedge(model, tokens, f))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    if future is hedge and future.exception() is None:
+                        self.hedge_wins += 1
+                    return future.result()
+
+    # ---------- async ----------
+
+    async def acall(self, method: str, model: Optional[str], fn: Callable[..., Any],
+                    args: tuple, kwargs: Dict[str, Any]) -> Any:
+        tokens = estimate_tokens(args, kwargs) if self.limiter is not None else 0
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                delay = self.limiter.reserve(model, tokens)
+                if delay:
+                    record("throttle", delay)
+                    await asyncio.sleep(delay)
+            start = time.perf_counter()
+            try:
+                result = await self._acall_once(method, model, tokens, fn, args, kwargs)
+            except Exception as e:
+                self._refund(model, tokens)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning("Retrying %s after %r (attempt %d, %.2fs)",
+                               method, e, attempt + 1, delay)
+                self.retries += 1
+                attempt += 1
+                record("backoff", delay)
+                await asyncio.sleep(delay)
+                continue
+            if not kwargs.get("stream"):
+                self._observe_latency(method, time.perf_counter() - start)
+            if self.limiter is not None:
+                self.limiter.settle(model, tokens, _usage_tokens(result))
+            return result
+
+    async def _acall_once(self, method, model, tokens, fn, args, kwargs):
+        threshold = None if kwargs.get("stream") else self.hedge_delay(method)
+        if threshold is None:
+            return await fn(*args, **kwargs)
+        primary = asyncio.ensure_future(fn(*args, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done or not self._hedgeable(model, tokens):
+            return await primary
+
+        async def duplicate():
+            with untimed():
+                return await fn(*args, **kwargs)
+
+        logger.debug("Hedging %s after %.3fs", method, threshold)
+        self.hedges += 1
+        hedge = asyncio.ensure_future(duplicate())
+        hedge.add_done_callback(lambda t: self._settle_hedge(model, tokens, t))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None or not pending:
+                        if task is hedge and task.exception() is None:
+                            self.hedge_wins += 1
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_thresholds": {m: self.hedge_delay(m) for m in self._latencies},
+        }
+
+    def close(self) -> None:
+        pass  # attempts run on their own daemon threads; nothing to shut down
+
+
+def _start(ctx: contextvars.Context, fn: Callable[..., Any], args: tuple,
+           kwargs: Dict[str, Any]) -> Future:
+    """Run fn(*args, **kwargs) in `ctx` on a new daemon thread."""
+    future: Future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(ctx.run(fn, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="mlhq-hedge", daemon=True).start()
+    return future
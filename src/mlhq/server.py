@@ -0,0 +1,598 @@
+"""
+OpenAI-compatible HTTP server in front of one local model (``mlhq serve``).
+
+    python -m mlhq serve --model Qwen/Qwen2.5-0.5B-Instruct --port 8000
+    Client(backend="openai", base_url="http://127.0.0.1:8000/v1", api_key="-")
+
+Serves ``POST /v1/chat/completions``, ``/v1/responses`` and ``/v1/completions``
+(plain JSON or SSE with ``stream: true``), ``GET /v1/models``, plus ``GET
+/stats`` (queue depth, throughput, latency as JSON) and ``GET /metrics``
+(Prometheus).
+
+Requests go into a bounded queue in front of an mlhq ``Client`` (normally
+``backend="hflocal"``), drained by `concurrency` workers on a thread pool so
+the event loop only does I/O. A worker takes the oldest request plus every
+queued request that can share its generate call (same endpoint family and
+sampling parameters, not streamed) up to `max_batch` inputs, and runs them
+as one batched call. When `max_queue` requests are already waiting, new ones
+get a 429 with a ``retry-after-ms`` estimate instead of piling up. With an
+hflocal ``kv_memory_budget`` (``kv_budget_policy="reject"``), a request
+whose KV cache does not fit gets a 503 with the same hint, and ``/stats``
+and ``/metrics`` report the reserved bytes against the budget.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import asyncio
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from ._http import EventStream, HTTPServer, Request, Response, json_error
+from .backends.hf_memory import MemoryBudgetExceeded
+from .metrics import percentile
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+# request fields forwarded to generation; anything else an OpenAI SDK sends
+# (user, n, logprobs, tools, ...) is ignored
+_SAMPLING_KEYS = ("max_tokens", "max_completion_tokens", "temperature", "top_p", "top_k", "stop")
+_THROUGHPUT_WINDOW_S = 60.0
+_END = object()
+
+
+class _QueueFull(Exception):
+    pass
+
+
+@dataclass
+class _Job:
+    api: str  # "chat.completions" | "responses" | "completions"
+    kind: str  # "chat" (messages) | "text" (raw prompts)
+    inputs: List[Any]  # conversations or prompt strings
+    kwargs: Dict[str, Any]
+    stream: bool = False
+    include_usage: bool = False
+    enqueued: float = field(default_factory=time.perf_counter)
+    future: Optional[asyncio.Future] = None
+    events: Optional[asyncio.Queue] = None  # stream chunks, _END or an exception
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def batch_key(self) -> Optional[Tuple[str, str]]:
+        if self.stream:
+            return None
+        return self.kind, json.dumps(self.kwargs, sort_keys=True, default=str)
+
+
+class _RequestQueue:
+    """FIFO of pending jobs; `take` pops the oldest plus batchable followers."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._jobs: Deque[_Job] = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def put(self, job: _Job) -> None:
+        if len(self._jobs) >= self.max_size:
+            raise _QueueFull
+        self._jobs.append(job)
+        self._ready.set()
+
+    async def take(self, max_inputs: int) -> List[_Job]:
+        while True:
+            while not self._jobs:
+                self._ready.clear()
+                await self._ready.wait()
+            job = self._jobs.popleft()
+            if not _abandoned(job):
+                break
+        batch, n = [job], len(job.inputs)
+        key = job.batch_key
+        if key is not None:
+            for other in list(self._jobs):
+                if n >= max_inputs:
+                    break
+                if other.batch_key == key and n + len(other.inputs) <= max_inputs:
+                    self._jobs.remove(other)
+                    if not _abandoned(other):
+                        batch.append(other)
+                        n += len(other.inputs)
+        return batch
+
+
+def _abandoned(job: _Job) -> bool:
+    # the caller disconnected while the job was still queued
+    return job.cancelled.is_set() or (job.future is not None and job.future.cancelled())
+
+
+class ModelServer(HTTPServer):
+    """
+    Serve `client` (an mlhq ``Client``, e.g. ``Client(backend="hflocal",
+    model=...)``) over the OpenAI HTTP API. `model_name` is the id reported
+    in responses and ``/v1/models`` (default: the client's model).
+    """
+
+    def __init__(self, client: Any, host: str = "127.0.0.1", port: int = 0, *,
+                 model_name: Optional[str] = None, max_queue: int = 64, concurrency: int = 1,
+                 max_batch: int = 8) -> None:
+        super().__init__(self._handle, host, port)
+        self.client = client
+        self.model_name = model_name or client.config.model or "mlhq"
+        self.max_queue = max_queue
+        self.concurrency = concurrency
+        self.max_batch = max_batch
+        self._queue: Optional[_RequestQueue] = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix="mlhq-serve")
+        self._started = time.perf_counter()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._prompt_tokens = 0
+        self._completion_tokens = 0
+        self._recent: Deque[Tuple[float, int]] = deque()  # (finished_at, completion tokens)
+        self._latencies: Deque[float] = deque(maxlen=1024)
+        self._waits: Deque[float] = deque(maxlen=1024)
+        self._routes: Dict[str, Callable[[Dict[str, Any]], _Job]] = {
+            "/v1/chat/completions": _parse_chat,
+            "/v1/responses": _parse_responses,
+            "/v1/completions": _parse_completions,
+        }
+
+    # ---------- lifecycle ----------
+
+    async def _start_server(self) -> None:
+        await super()._start_server()
+        self._queue = _RequestQueue(self.max_queue)
+        for i in range(self.concurrency):
+            # tracked with the connections so stop() cancels them too
+            self._tasks.add(asyncio.get_running_loop().create_task(self._worker(),
+                                                                   name=f"mlhq-serve-{i}"))
+
+    def stop(self) -> None:
+        super().stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- workers ----------
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = await self._queue.take(self.max_batch)
+            started = time.perf_counter()
+            for job in jobs:
+                self._waits.append(started - job.enqueued)
+            self._running += len(jobs)
+            try:
+                results = await loop.run_in_executor(self._executor, self._execute, jobs, loop)
+            except Exception as e:  # executor shut down
+                results = [e] * len(jobs)
+            finally:
+                self._running -= len(jobs)
+            for job, result in zip(jobs, results):
+                if job.stream:
+                    if isinstance(result, Exception):
+                        job.events.put_nowait(result)
+                elif not job.future.done():
+                    if isinstance(result, Exception):
+                        job.future.set_exception(result)
+                    else:
+                        job.future.set_result(result)
+                if not job.stream:
+                    failed = isinstance(result, Exception)
+                    self._account(job, None if failed else [r.usage for r in result])
+
+    def _execute(self, jobs: List[_Job], loop: asyncio.AbstractEventLoop) -> List[Any]:
+        """Run on the thread pool; one result (list of MLHQResponse) or
+        exception per job."""
+        if jobs[0].stream:
+            try:
+                self._drain(jobs[0], loop)
+                return [None]
+            except Exception as e:
+                return [e]
+        try:
+            outputs = self._generate(jobs[0].kind, [i for job in jobs for i in job.inputs],
+                                     jobs[0].kwargs)
+        except Exception as e:
+            if len(jobs) == 1:
+                return [e]
+            # one bad request shouldn't fail the ones it was batched with
+            return [self._execute([job], loop)[0] for job in jobs]
+        results, start = [], 0
+        for job in jobs:
+            results.append(outputs[start:start + len(job.inputs)])
+            start += len(job.inputs)
+        return results
+
+    def _generate(self, kind: str, inputs: List[Any], kwargs: Dict[str, Any]) -> List[Any]:
+        if kind == "text":
+            return self.client.text_generation(inputs, details=True, **_generate_kwargs(kwargs))
+        batch = getattr(self.client, "chat_completion_batch", None)
+        if batch is not None:
+            return batch(inputs, **kwargs)
+        return [self.client.chat.completions.create(messages=m, **kwargs) for m in inputs]
+
+    def _drain(self, job: _Job, loop: asyncio.AbstractEventLoop) -> None:
+        if job.kind == "text":
+            stream = self.client.text_generation(job.inputs[0], stream=True,
+                                                 **_generate_kwargs(job.kwargs))
+        else:
+            stream = self.client.chat.completions.create(messages=job.inputs[0], stream=True,
+                                                         **job.kwargs)
+        try:
+            for chunk in stream:
+                if job.cancelled.is_set():
+                    logger.debug("stream abandoned by the caller")
+                    break
+                loop.call_soon_threadsafe(job.events.put_nowait, chunk)
+        finally:
+            # cancels a generation that is still running and waits for it to
+            # stop, so this worker slot isn't freed while it burns on
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        loop.call_soon_threadsafe(job.events.put_nowait, _END)
+
+    # ---------- accounting ----------
+
+    def _account(self, job: _Job, usages: Optional[List[Any]]) -> None:
+        """Book a finished job; `usages` holds one usage dict per input, or is
+        None when the job failed."""
+        now = time.perf_counter()
+        if usages is None:
+            self._failed += 1
+            return
+        self._completed += 1
+        self._latencies.append(now - job.enqueued)
+        tokens = 0
+        for usage in usages:
+            usage = usage or {}
+            self._prompt_tokens += usage.get("prompt_tokens") or 0
+            tokens += usage.get("completion_tokens") or 0
+        self._completion_tokens += tokens
+        self._recent.append((now, tokens))
+
+    def _retry_after_ms(self) -> int:
+        # time for the queue ahead to drain, from recent request latencies
+        mean = sum(self._latencies) / len(self._latencies) if self._latencies else 1.0
+        depth = len(self._queue) if self._queue is not None else 0
+        return int(min(max(1000 * mean * depth / self.concurrency, 50), 60_000))
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight and finished requests, token throughput
+        (completion tokens/s over the last minute), latency percentiles and,
+        with an hflocal memory budget, its ``kv_memory`` reservations."""
+        now = time.perf_counter()
+        while self._recent and now - self._recent[0][0] > _THROUGHPUT_WINDOW_S:
+            self._recent.popleft()
+        uptime = now - self._started
+        window = min(uptime, _THROUGHPUT_WINDOW_S) or 1.0
+        latencies, waits = list(self._latencies), list(self._waits)
+        budget = getattr(self.client, "memory_budget", None)
+        out = {
+            "model": self.model_name,
+            "queue_depth": len(self._queue) if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "prompt_tokens": self._prompt_tokens,
+            "completion_tokens": self._completion_tokens,
+            "tokens_per_s": sum(n for _, n in self._recent) / window,
+            "requests_per_s": len(self._recent) / window,
+            "latency_p50_s": percentile(latencies, 50),
+            "latency_p95_s": percentile(latencies, 95),
+            "queue_wait_p50_s": percentile(waits, 50),
+            "queue_wait_p95_s": percentile(waits, 95),
+            "uptime_s": uptime,
+        }
+        if budget is not None:
+            out["kv_memory"] = budget.stats()
+        return out
+
+    def _prometheus(self) -> str:
+        metrics = getattr(self.client, "metrics", None)
+        text = metrics.to_prometheus() if metrics is not None else ""
+        s = self.stats()
+        for name, kind, value in (("queue_depth", "gauge", s["queue_depth"]),
+                                  ("running", "gauge", s["running"]),
+                                  ("rejected_total", "counter", s["rejected"]),
+                                  ("tokens_per_second", "gauge", s["tokens_per_s"])):
+            text += f"# TYPE mlhq_server_{name} {kind}\nmlhq_server_{name} {value}\n"
+        kv = s.get("kv_memory")
+        if kv is not None:
+            for name, kind, value in (("kv_reserved_bytes", "gauge", kv["reserved_bytes"]),
+                                      ("kv_budget_bytes", "gauge", kv["budget_bytes"]),
+                                      ("kv_waiting", "gauge", kv["waiting"]),
+                                      ("kv_rejected_total", "counter", kv["rejected"])):
+                text += f"# TYPE mlhq_server_{name} {kind}\nmlhq_server_{name} {value}\n"
+        return text
+
+    # ---------- routes ----------
+
+    async def _handle(self, req: Request):
+        if req.method == "GET":
+            if req.path == "/v1/models":
+                return Response(200, {"object": "list", "data": [
+                    {"id": self.model_name, "object": "model", "created": 0, "owned_by": "mlhq"}
+                ]})
+            if req.path == "/stats":
+                return Response(200, self.stats())
+            if req.path == "/metrics":
+                return Response(200, self._prometheus())
+            if req.path == "/health":
+                return Response(200, {"status": "ok"})
+            return json_error(404, f"no route for {req.path}")
+        if req.method != "POST":
+            return json_error(405, f"{req.method} not allowed")
+        parse = self._routes.get(req.path)
+        if parse is None:
+            return json_error(404, f"no route for {req.path}")
+        try:
+            job = parse(req.json())
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return json_error(400, f"invalid request: {e}")
+
+        loop = asyncio.get_running_loop()
+        if job.stream:
+            job.events = asyncio.Queue()
+        else:
+            job.future = loop.create_future()
+        try:
+            self._queue.put(job)
+        except _QueueFull:
+            self._rejected += 1
+            resp = json_error(429, f"server busy: {len(self._queue)} requests queued",
+                              "rate_limit_error")
+            resp.headers["retry-after-ms"] = str(self._retry_after_ms())
+            return resp
+
+        if job.stream:
+            return EventStream(self._events(job))
+        try:
+            result = await job.future
+        except (ValueError, TypeError) as e:
+            return json_error(400, str(e))
+        except MemoryBudgetExceeded as e:
+            resp = json_error(503, str(e), "server_error")
+            resp.headers["retry-after-ms"] = str(self._retry_after_ms())
+            return resp
+        except Exception as e:
+            logger.exception("generation failed")
+            return json_error(500, str(e), "server_error")
+        return Response(200, _FORMAT[job.api](result, self.model_name))
+
+    async def _events(self, job: _Job):
+        """SSE body of a streamed request, in the endpoint's chunk format."""
+        encoder = _STREAM_FORMAT[job.api](self.model_name, job.include_usage)
+        usage = None
+        try:
+            for event in next(encoder):
+                yield event
+            while True:
+                item = await job.events.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    self._account(job, None)
+                    logger.error("stream failed: %s", item)
+                    yield {"error": {"message": str(item), "type": "server_error"}}
+                    return
+                usage = item.usage or usage
+                for event in encoder.send(item):
+                    yield event
+            self._account(job, [usage])
+            for event in encoder.send(None):
+                yield event
+        finally:
+            job.cancelled.set()
+
+
+# ---------- request parsing ----------
+
+def _text(content: Any) -> str:
+    """Message content as text (a string, or a list of text parts)."""
+    if content is None or isinstance(content, str):
+        return content or ""
+    parts = []
+    for part in content:
+        if part.get("type") not in ("text", "input_text", "output_text"):
+            raise ValueError(f"unsupported content part {part.get('type')!r} (text only)")
+        parts.append(part.get("text", ""))
+    return "".join(parts)
+
+
+def _sampling(body: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: body[k] for k in _SAMPLING_KEYS if body.get(k) is not None}
+
+
+def _parse_chat(body: Dict[str, Any]) -> _Job:
+    messages = [{"role": m["role"], "content": _text(m.get("content"))}
+                for m in body["messages"]]
+    if not messages:
+        raise ValueError("messages is empty")
+    return _Job("chat.completions", "chat", [messages], _sampling(body),
+                stream=bool(body.get("stream")),
+                include_usage=bool((body.get("stream_options") or {}).get("include_usage")))
+
+
+def _parse_responses(body: Dict[str, Any]) -> _Job:
+    messages = []
+    if body.get("instructions"):
+        messages.append({"role": "system", "content": body["instructions"]})
+    items = body.get("input")
+    if isinstance(items, str):
+        items = [{"role": "user", "content": items}]
+    for item in items or []:
+        if item.get("type", "message") != "message":
+            raise ValueError(f"unsupported input item {item.get('type')!r}")
+        role = "system" if item.get("role") == "developer" else item.get("role", "user")
+        messages.append({"role": role, "content": _text(item.get("content"))})
+    if not messages:
+        raise ValueError("input is empty")
+    kwargs = _sampling(body)
+    if body.get("max_output_tokens") is not None:
+        kwargs["max_tokens"] = body["max_output_tokens"]
+    return _Job("responses", "chat", [messages], kwargs, stream=bool(body.get("stream")))
+
+
+def _parse_completions(body: Dict[str, Any]) -> _Job:
+    prompt = body["prompt"]
+    prompts = [prompt] if isinstance(prompt, str) else list(prompt)
+    if not prompts or not all(isinstance(p, str) for p in prompts):
+        raise ValueError("prompt must be a string or a list of strings")
+    stream = bool(body.get("stream"))
+    if stream and len(prompts) > 1:
+        raise ValueError("stream=true supports a single prompt")
+    return _Job("completions", "text", prompts, _sampling(body), stream=stream,
+                include_usage=bool((body.get("stream_options") or {}).get("include_usage")))
+
+
+def _generate_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # text_generation takes generate() kwargs; chat maps the OpenAI names itself
+    from .backends.hf_backend import _openai_to_generate_kwargs
+    return _openai_to_generate_kwargs(kwargs)
+
+
+# ---------- response formatting ----------
+
+_ids = itertools.count()
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:12]}{next(_ids)}"
+
+
+def _format_chat(result: List[Any], model: str) -> Dict[str, Any]:
+    resp = result[0]
+    return {
+        "id": _new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": resp.finish_reason,
+                     "message": {"role": "assistant", "content": resp.text}}],
+        "usage": resp.usage,
+    }
+
+
+def _format_completions(result: List[Any], model: str) -> Dict[str, Any]:
+    prompt = sum((r.usage or {}).get("prompt_tokens", 0) for r in result)
+    completion = sum((r.usage or {}).get("completion_tokens", 0) for r in result)
+    return {
+        "id": _new_id("cmpl"), "object": "text_completion", "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": i, "text": r.text, "finish_reason": r.finish_reason,
+                     "logprobs": None} for i, r in enumerate(result)],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                  "total_tokens": prompt + completion},
+    }
+
+
+def _response_object(rid: str, model: str, text: str, usage: Optional[Dict[str, Any]],
+                     status: str = "completed") -> Dict[str, Any]:
+    usage = usage or {}
+    prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return {
+        "id": rid, "object": "response", "created_at": int(time.time()), "model": model,
+        "status": status,
+        "output": [{"type": "message", "id": f"msg-{rid}", "status": status,
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        "usage": {"input_tokens": prompt, "output_tokens": completion,
+                  "total_tokens": prompt + completion,
+                  "input_tokens_details": {"cached_tokens": 0},
+                  "output_tokens_details": {"reasoning_tokens": 0}},
+    }
+
+
+def _format_responses(result: List[Any], model: str) -> Dict[str, Any]:
+    return _response_object(_new_id("resp"), model, result[0].text, result[0].usage)
+
+
+_FORMAT = {"chat.completions": _format_chat, "responses": _format_responses,
+           "completions": _format_completions}
+
+
+# Stream encoders are generators: the first send(None) returns the opening
+# events, each send(chunk) the events for that MLHQStreamChunk, and the send
+# after the last chunk (None) the closing events.
+
+def _stream_chat(model: str, include_usage: bool):
+    cid, created = _new_id("chatcmpl"), int(time.time())
+
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> Dict[str, Any]:
+        return {"id": cid, "object": "chat.completion.chunk", "created": created,
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+    item = yield [chunk({"role": "assistant", "content": ""})]
+    usage = None
+    while item is not None:
+        usage = item.usage or usage
+        events = [chunk({"content": item.text})] if item.text else []
+        if item.finish_reason:
+            events.append(chunk({}, item.finish_reason))
+        item = yield events
+    tail = []
+    if include_usage:
+        tail.append({"id": cid, "object": "chat.completion.chunk", "created": created,
+                     "model": model, "choices": [], "usage": usage})
+    yield tail + ["[DONE]"]
+
+
+def _stream_completions(model: str, include_usage: bool):
+    cid, created = _new_id("cmpl"), int(time.time())
+
+    def chunk(text: str, finish: Optional[str] = None) -> Dict[str, Any]:
+        return {"id": cid, "object": "text_completion", "created": created, "model": model,
+                "choices": [{"index": 0, "text": text, "finish_reason": finish,
+                             "logprobs": None}]}
+
+    item = yield []
+    usage = None
+    while item is not None:
+        usage = item.usage or usage
+        if item.text or item.finish_reason:
+            item = yield [chunk(item.text, item.finish_reason)]
+        else:
+            item = yield []
+    tail = []
+    if include_usage:
+        tail.append({"id": cid, "object": "text_completion", "created": created, "model": model,
+                     "choices": [], "usage": usage})
+    yield tail + ["[DONE]"]
+
+
+def _stream_responses(model: str, include_usage: bool):
+    rid = _new_id("resp")
+    seq = itertools.count()
+    parts: List[str] = []
+    item = yield [{"type": "response.created", "sequence_number": next(seq),
+                   "response": _response_object(rid, model, "", None, "in_progress")}]
+    usage = None
+    while item is not None:
+        usage = item.usage or usage
+        events = []
+        if item.text:
+            parts.append(item.text)
+            events.append({"type": "response.output_text.delta", "sequence_number": next(seq),
+                           "item_id": f"msg-{rid}", "output_index": 0, "content_index": 0,
+                           "delta": item.text})
+        item = yield events
+    yield [{"type": "response.completed", "sequence_number": next(seq),
+            "response": _response_object(rid, model, "".join(parts), usage)}]
+
+
+_STREAM_FORMAT = {"chat.completions": _stream_chat, "responses": _stream_responses,
+                  "completions": _stream_completions}
@@ -0,0 +1,170 @@
+"""
+Local OpenAI-compatible stub server for offline benchmarking.
+
+Implements ``POST /v1/chat/completions`` (plain and SSE streaming),
+``POST /v1/responses``, ``POST /v1/embeddings`` and ``GET /v1/models``. Every request waits
+`latency` seconds before the first token, then emits tokens at
+`tokens_per_s`, so the client-side cost of mlhq can be measured against a
+backend with known behaviour. `fail_rate` / `fail_status` inject errors
+(429s carry ``retry-after-ms``) and `slow_rate` / `slow_latency` a latency
+tail, for exercising retries and hedging.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, Optional
+import asyncio
+import base64
+import hashlib
+import itertools
+import random
+import struct
+import time
+
+from ._http import EventStream, HTTPServer, Request, Response, json_error
+
+_ids = itertools.count()
+
+
+def _count_prompt_tokens(body: Dict[str, Any]) -> int:
+    """Whitespace 'tokens' over every string in the request's messages/input."""
+    def walk(obj: Any) -> int:
+        if isinstance(obj, str):
+            return len(obj.split())
+        if isinstance(obj, dict):
+            return sum(walk(v) for v in obj.values())
+        if isinstance(obj, list):
+            return sum(walk(v) for v in obj)
+        return 0
+    return walk(body.get("messages") or body.get("input") or body.get("prompt") or "")
+
+
+class StubServer(HTTPServer):
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, latency: float = 0.05,
+                 tokens_per_s: float = 100.0, output_tokens: int = 32,
+                 fail_rate: float = 0.0, fail_status: int = 503, slow_rate: float = 0.0,
+                 slow_latency: float = 1.0) -> None:
+        super().__init__(self._handle, host, port)
+        self.latency = latency
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self._rng = random.Random(0)
+
+    # ---------- helpers ----------
+
+    def _n_tokens(self, body: Dict[str, Any]) -> int:
+        for key in ("max_completion_tokens", "max_tokens", "max_output_tokens"):
+            if body.get(key):
+                return int(body[key])
+        return self.output_tokens
+
+    async def _tokens(self, n: int) -> AsyncIterator[str]:
+        slow = self.slow_rate > 0 and self._rng.random() < self.slow_rate
+        await asyncio.sleep(self.slow_latency if slow else self.latency)
+        gap = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        start = time.perf_counter()
+        for i in range(n):
+            # pace against the start time so per-token sleep jitter doesn't accumulate
+            delay = start + i * gap - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield f"tok{i} "
+
+    def _should_fail(self) -> bool:
+        return self.fail_rate > 0 and self._rng.random() < self.fail_rate
+
+    # ---------- routes ----------
+
+    async def _handle(self, req: Request):
+        if req.method == "GET" and req.path == "/v1/models":
+            return Response(200, {"object": "list", "data": [
+                {"id": "stub", "object": "model", "created": 0, "owned_by": "mlhq"}
+            ]})
+        if req.method != "POST":
+            return json_error(405, f"{req.method} not allowed")
+        self.requests += 1
+        if self._should_fail():
+            resp = json_error(self.fail_status, "stub configured to fail", "server_error")
+            if self.fail_status == 429:
+                resp.headers["retry-after-ms"] = "10"
+            return resp
+        body = req.json()
+        if req.path == "/v1/chat/completions":
+            return await self._chat(body)
+        if req.path == "/v1/responses":
+            return await self._responses(body)
+        if req.path == "/v1/embeddings":
+            return await self._embeddings(body)
+        return json_error(404, f"no route for {req.path}")
+
+    async def _chat(self, body: Dict[str, Any]):
+        model = body.get("model", "stub")
+        cid, created = f"chatcmpl-stub-{next(_ids)}", int(time.time())
+        n = self._n_tokens(body)
+        usage = {"prompt_tokens": _count_prompt_tokens(body), "completion_tokens": n,
+                 "total_tokens": _count_prompt_tokens(body) + n}
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> Dict[str, Any]:
+            return {"id": cid, "object": "chat.completion.chunk", "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+            async def events():
+                yield chunk({"role": "assistant", "content": ""})
+                async for tok in self._tokens(n):
+                    yield chunk({"content": tok})
+                yield chunk({}, "length")
+                if include_usage:
+                    yield {"id": cid, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [], "usage": usage}
+                yield "[DONE]"
+            return EventStream(events())
+
+        text = "".join([tok async for tok in self._tokens(n)])
+        return Response(200, {
+            "id": cid, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "length",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": usage,
+        })
+
+    async def _embeddings(self, body: Dict[str, Any]):
+        await asyncio.sleep(self.latency)
+        inputs = body.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        dims = int(body.get("dimensions") or 8)
+        data = []
+        for i, text in enumerate(inputs):
+            # deterministic per input: seeded from its content
+            seed = hashlib.blake2b(str(text).encode(), digest_size=8).digest()
+            rng = random.Random(seed)
+            vector = [rng.uniform(-1.0, 1.0) for _ in range(dims)]
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dims}f", *vector)).decode()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = _count_prompt_tokens({"input": inputs})
+        return Response(200, {"object": "list", "data": data, "model": body.get("model", "stub"),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    async def _responses(self, body: Dict[str, Any]):
+        n = self._n_tokens(body)
+        text = "".join([tok async for tok in self._tokens(n)])
+        prompt = _count_prompt_tokens(body)
+        rid = f"resp-stub-{next(_ids)}"
+        return Response(200, {
+            "id": rid, "object": "response", "created_at": int(time.time()),
+            "model": body.get("model", "stub"), "status": "completed",
+            "output": [{"type": "message", "id": f"msg-{rid}", "status": "completed",
+                        "role": "assistant",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+            "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+            "usage": {"input_tokens": prompt, "output_tokens": n, "total_tokens": prompt + n,
+                      "input_tokens_details": {"cached_tokens": 0},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+        })
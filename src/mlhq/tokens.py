@@ -0,0 +1,267 @@
+"""
+Token counting and encoding without generating, behind ``client.tokens``.
+
+    client.tokens.count("some prompt")                 # -> int
+    client.tokens.count(["a", "b", ...])               # -> [int, ...]
+    client.tokens.count(messages=[{"role": ..., ...}])  # chat prompt, -> int
+    client.tokens.encode(["a", "b"])                   # -> [[ids], [ids]]
+
+hflocal uses the model's own HF tokenizer (text prompts are encoded the way
+``text_generation`` encodes them; message lists get the chat template with
+the generation prompt, rendered once per list). OpenAI models use tiktoken
+(optional: ``pip install 'mlhq[tokens]'``); message lists are counted with
+OpenAI's documented per-message overhead.
+
+Results are memoized in bounded LRU maps keyed by a hash of the content, so
+re-counting the same system prompt or few-shot block is a dict lookup, and
+only the misses of a batch go to the (Rust-side, batched) tokenizer.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence, Union
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from mlhq.logging_config import get_logger
+logger = get_logger(__name__)
+
+Messages = List[Dict[str, Any]]
+
+# OpenAI's chat accounting: every message costs its content plus a fixed
+# header; a name adds one; every reply is primed with 3 more tokens
+_MESSAGE_TOKENS = 3
+_NAME_TOKENS = 1
+_REPLY_TOKENS = 3
+DEFAULT_ENCODING = "o200k_base"
+
+
+class HFTokenizer:
+    """Adapter over a HF tokenizer."""
+
+    def __init__(self, tokenizer: Any) -> None:
+        self.tokenizer = tokenizer
+
+    def _encode(self, texts: List[str], add_special_tokens: bool) -> List[List[int]]:
+        # the Rust tokenizer directly skips building attention masks and
+        # BatchEncodings; only when no padding/truncation is left configured
+        backend = getattr(self.tokenizer, "backend_tokenizer", None)
+        if backend is not None and backend.padding is None and backend.truncation is None:
+            encodings = backend.encode_batch(texts, add_special_tokens=add_special_tokens)
+            return [e.ids for e in encodings]
+        return self.tokenizer(texts, add_special_tokens=add_special_tokens,
+                              return_attention_mask=False)["input_ids"]
+
+    def encode_texts(self, texts: List[str]) -> List[List[int]]:
+        # same ids text_generation sends for these prompts
+        return self._encode(texts, add_special_tokens=True)
+
+    def encode_chats(self, chats: List[Messages]) -> List[List[int]]:
+        rendered = [self.tokenizer.apply_chat_template(m, add_generation_prompt=True,
+                                                       tokenize=False) for m in chats]
+        # the template already contains the special tokens
+        return self._encode(rendered, add_special_tokens=False)
+
+    def count_chats(self, chats: List[Messages]) -> List[int]:
+        return [len(ids) for ids in self.encode_chats(chats)]
+
+
+class TiktokenTokenizer:
+    """Adapter over a tiktoken ``Encoding`` (or anything with ``encode_ordinary_batch``)."""
+
+    def __init__(self, encoding: Any) -> None:
+        self.encoding = encoding
+
+    @classmethod
+    def for_model(cls, model: Optional[str]) -> "TiktokenTokenizer":
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError("Counting OpenAI tokens needs tiktoken: "
+                              "pip install 'mlhq[tokens]'") from None
+        try:
+            encoding = tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            logger.debug("No tiktoken encoding for %r; using %s", model, DEFAULT_ENCODING)
+            encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        return cls(encoding)
+
+    def encode_texts(self, texts: List[str]) -> List[List[int]]:
+        # "ordinary": text that looks like a special token is just text
+        return self.encoding.encode_ordinary_batch(texts)
+
+    def encode_chats(self, chats: List[Messages]) -> List[List[int]]:
+        raise ValueError("OpenAI's chat token layout is not public; message lists can be "
+                         "counted (tokens.count(messages=...)) but not encoded")
+
+    def count_chats(self, chats: List[Messages]) -> List[int]:
+        counts = []
+        for messages in chats:
+            strings, n = [], _REPLY_TOKENS
+            for message in messages:
+                n += _MESSAGE_TOKENS
+                for key, value in message.items():
+                    if isinstance(value, str):
+                        strings.append(value)
+                        n += _NAME_TOKENS if key == "name" else 0
+            counts.append(n + sum(len(ids) for ids in self.encode_texts(strings)))
+        return counts
+
+
+class _LRU:
+    __slots__ = ("_data", "_max", "_lock")
+
+    def __init__(self, max_entries: int) -> None:
+        self._data: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._max = max_entries
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[bytes]) -> List[Any]:
+        with self._lock:
+            data = self._data
+            out = [data.get(k) for k in keys]
+            for k, v in zip(keys, out):
+                if v is not None:
+                    data.move_to_end(k)
+            return out
+
+    def set_many(self, items: Sequence[tuple]) -> None:
+        if not self._max:
+            return
+        with self._lock:
+            self._data.update(items)
+            while len(self._data) > self._max:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def _chat_key(messages: Messages) -> bytes:
+    blob = json.dumps(messages, sort_keys=True, separators=(",", ":"), default=str)
+    return b"m" + hashlib.blake2b(blob.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class TokenCounter:
+    """
+    Memoized count/encode over one tokenizer adapter (HFTokenizer or
+    TiktokenTokenizer). `max_entries` bounds each memo (0 disables it).
+    """
+
+    def __init__(self, tokenizer: Any, max_entries: int = 65536) -> None:
+        self.tokenizer = tokenizer
+        self._counts = _LRU(max_entries)
+        self._ids = _LRU(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, inputs: Union[str, Sequence[str], None] = None, *,
+              messages: Union[Messages, Sequence[Messages], None] = None) -> Any:
+        """Token count of a string (-> int), a list of strings (-> list), or
+        ``messages=`` a message list (-> int) or a list of them (-> list)."""
+        if messages is not None:
+            single = _is_message_list(messages)
+            chats = [messages] if single else list(messages)
+            keys = [_chat_key(m) for m in chats]
+            counts = self._memo(self._counts, keys, chats, self.tokenizer.count_chats)
+            return counts[0] if single else counts
+        if inputs is None:
+            raise ValueError("count() needs a string, a list of strings or messages=")
+        single = isinstance(inputs, str)
+        texts = [inputs] if single else list(inputs)
+        keys = [_text_key(t) for t in texts]
+
+        def compute(missing: List[str]) -> List[int]:
+            return [len(ids) for ids in self.tokenizer.encode_texts(missing)]
+
+        counts = self._memo(self._counts, keys, texts, compute)
+        return counts[0] if single else counts
+
+    def encode(self, inputs: Union[str, Sequence[str], None] = None, *,
+               messages: Union[Messages, Sequence[Messages], None] = None) -> Any:
+        """Token ids of a string (-> list of ids) or a list of strings (-> list
+        of lists); ``messages=`` encodes chat prompts the same way (hflocal)."""
+        if messages is not None:
+            single = _is_message_list(messages)
+            items = [messages] if single else list(messages)
+            keys = [_chat_key(m) for m in items]
+            compute = self.tokenizer.encode_chats
+        elif inputs is not None:
+            single = isinstance(inputs, str)
+            items = [inputs] if single else list(inputs)
+            keys = [_text_key(t) for t in items]
+            compute = self.tokenizer.encode_texts
+        else:
+            raise ValueError("encode() needs a string, a list of strings or messages=")
+
+        def encode(missing: List[Any]) -> List[tuple]:
+            return [tuple(row) for row in compute(missing)]
+
+        ids = self._memo(self._ids, keys, items, encode)
+        out = [list(row) for row in ids]
+        return out[0] if single else out
+
+    def _memo(self, memo: _LRU, keys: List[bytes], items: List[Any], compute: Any) -> List[Any]:
+        values = memo.get_many(keys)
+        missing = [i for i, v in enumerate(values) if v is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # duplicates inside one batch are computed once
+            first: Dict[bytes, int] = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            todo = list(first.values())
+            computed = compute([items[i] for i in todo])
+            fresh = {keys[i]: v for i, v in zip(todo, computed)}
+            memo.set_many(list(fresh.items()))
+            for i in missing:
+                values[i] = fresh[keys[i]]
+        return values
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses,
+                "counts": len(self._counts), "encodings": len(self._ids)}
+
+
+def _is_message_list(messages: Any) -> bool:
+    return not messages or isinstance(messages[0], dict)
+
+
+class Tokens:
+    """
+    ``client.tokens``: a TokenCounter per tokenizer, created on first use.
+    hflocal backends count with their model's tokenizer; everything else
+    with tiktoken for `model` (default: the client's model).
+    """
+
+    def __init__(self, backend: Any, model: Optional[str], max_entries: int = 65536) -> None:
+        self._backend = backend
+        self._model = model
+        self._max_entries = max_entries
+        self._counters: Dict[Optional[str], TokenCounter] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, model: Optional[str] = None) -> TokenCounter:
+        hf = getattr(self._backend, "tokenizer", None)
+        key = None if hf is not None else (model or self._model)
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                adapter = HFTokenizer(hf) if hf is not None else TiktokenTokenizer.for_model(key)
+                counter = self._counters[key] = TokenCounter(adapter, self._max_entries)
+            return counter
+
+    def count(self, inputs: Union[str, Sequence[str], None] = None, *,
+              messages: Union[Messages, Sequence[Messages], None] = None,
+              model: Optional[str] = None) -> Any:
+        return self.counter(model).count(inputs, messages=messages)
+
+    def encode(self, inputs: Union[str, Sequence[str], None] = None, *,
+               messages: Union[Messages, Sequence[Messages], None] = None,
+               model: Optional[str] = None) -> Any:
+        return self.counter(model).encode(inputs, messages=messages)
@@ -1,7 +1,8 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from types import SimpleNamespace
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, List
+import time
 
 @dataclass
 class MLHQResponse:
@@ -11,6 +12,8 @@ class MLHQResponse:
     provider: Optional[str] = None
     finish_reason: Optional[str] = None
     usage: Optional[Dict[str, Any]] = None
+    cached: bool = False  # served from mlhq's response cache
+    timings: Optional[Dict[str, float]] = None  # seconds per phase, see mlhq.metrics
 
     # --- OpenAI-ish aliases (so old code keeps working) ---
     @property
@@ -50,6 +53,8 @@ class MLHQResponse:
             "provider": self.provider,
             "finish_reason": self.finish_reason,
             "usage": self.usage,
+            "cached": self.cached,
+            "timings": self.timings,
         }
 
     def __str__(self) -> str:
@@ -70,5 +75,158 @@ class MLHQResponse:
         raw = object.__getattribute__(self, "raw")
         if hasattr(raw, name):
             return getattr(raw, name)
+        if isinstance(raw, dict) and name in raw:  # e.g. a cached/serialized payload
+            return raw[name]
         raise AttributeError(f"{type(self).__name__!s} object has no attribute {name!r}")
 
+
+
+@dataclass
+class MLHQEmbeddings:
+    """
+    ``embeddings.create`` result: one row per input, in input order, as a
+    single contiguous (n, dim) NumPy array (float32, or float16 when asked).
+    """
+    data: Any  # numpy.ndarray
+    model: Optional[str] = None
+    provider: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+    raw: Any = None
+    cached: bool = False
+    timings: Optional[Dict[str, float]] = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, i: Any) -> Any:
+        return self.data[i]
+
+    def __repr__(self) -> str:
+        shape = getattr(self.data, "shape", None)
+        return f"<MLHQEmbeddings {self.provider}:{self.model} shape={shape}>"
+
+
+# ---------- streaming ----------
+
+@dataclass
+class MLHQStreamChunk:
+    """One normalized streaming delta (OpenAI chunk or locally decoded text)."""
+    text: str
+    raw: Any = None
+    model: Optional[str] = None
+    provider: Optional[str] = None
+    finish_reason: Optional[str] = None
+    usage: Optional[Dict[str, Any]] = None
+
+    # OpenAI-ish alias: chunk.choices[0].delta.content
+    @property
+    def choices(self) -> List[Any]:
+        delta = SimpleNamespace(role="assistant", content=self.text)
+        return [SimpleNamespace(delta=delta, finish_reason=self.finish_reason)]
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class _StreamAccumulator:
+    """Folds chunks into the final aggregated MLHQResponse."""
+
+    def __init__(self, model: Optional[str], provider: Optional[str]) -> None:
+        self._parts: List[str] = []
+        self._raw: List[Any] = []
+        self._model = model
+        self._provider = provider
+        self._finish_reason: Optional[str] = None
+        self._usage: Optional[Dict[str, Any]] = None
+        self.response: Optional[MLHQResponse] = None
+        # perf_counter() of the first non-empty delta, and callbacks run on the
+        # final response (Client uses both for timings/metrics)
+        self.first_token_at: Optional[float] = None
+        self._on_finish: List[Callable[[MLHQResponse], None]] = []
+
+    def _add(self, chunk: MLHQStreamChunk) -> MLHQStreamChunk:
+        if chunk.text and self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self._parts.append(chunk.text)
+        self._raw.append(chunk.raw)
+        self._model = chunk.model or self._model
+        self._finish_reason = chunk.finish_reason or self._finish_reason
+        self._usage = chunk.usage or self._usage
+        return chunk
+
+    def _finish(self) -> None:
+        if self.response is None:
+            self.response = MLHQResponse(
+                text="".join(self._parts),
+                raw=self._raw,
+                model=self._model,
+                provider=self._provider,
+                finish_reason=self._finish_reason,
+                usage=self._usage,
+            )
+            for fn in self._on_finish:
+                fn(self.response)
+
+
+class MLHQStream(_StreamAccumulator):
+    """
+    Iterator of MLHQStreamChunk deltas. Once exhausted, `.response` holds the
+    aggregated MLHQResponse (text, finish_reason and usage); or call
+    get_final_response() to drain the rest of the stream and get it directly.
+    close() abandons it early (`on_close`, if given, stops the producer).
+    """
+
+    def __init__(self, chunks: Iterator[MLHQStreamChunk], *, model: Optional[str] = None,
+                 provider: Optional[str] = None,
+                 on_close: Optional[Callable[[], None]] = None) -> None:
+        super().__init__(model, provider)
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self) -> Iterator[MLHQStreamChunk]:
+        for chunk in self._chunks:
+            yield self._add(chunk)
+        self._finish()
+
+    def close(self) -> None:
+        """Stop the stream; a local generation behind it is cancelled and has
+        finished (releasing its resources) when this returns. Safe to call
+        from another thread while the stream is being consumed."""
+        if self._on_close is not None:
+            self._on_close()
+            return
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+    def get_final_response(self) -> MLHQResponse:
+        for _ in self:
+            pass
+        assert self.response is not None
+        return self.response
+
+
+class MLHQAsyncStream(_StreamAccumulator):
+    """Async counterpart of MLHQStream (``async for chunk in stream``)."""
+
+    def __init__(self, chunks: AsyncIterator[MLHQStreamChunk], *, model: Optional[str] = None,
+                 provider: Optional[str] = None) -> None:
+        super().__init__(model, provider)
+        self._chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[MLHQStreamChunk]:
+        async for chunk in self._chunks:
+            yield self._add(chunk)
+        self._finish()
+
+    async def aclose(self) -> None:
+        """Stop the stream (see MLHQStream.close)."""
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    async def get_final_response(self) -> MLHQResponse:
+        async for _ in self:
+            pass
+        assert self.response is not None
+        return self.response
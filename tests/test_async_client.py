@@ -0,0 +1,59 @@
+import asyncio
+import threading
+
+import pytest
+
+from mlhq import AsyncClient, Client, MLHQResponse
+
+
+def test_async_hflocal_matches_sync_and_bounds_threads(tiny_model_dir):
+    prompt = "Hello world"
+    expected = Client(backend="hflocal", model=tiny_model_dir).text_generation(
+        prompt, max_new_tokens=4, do_sample=False
+    )
+
+    async def main():
+        async with AsyncClient(backend="hflocal", model=tiny_model_dir, max_workers=2) as client:
+            before = threading.active_count()
+            outs = await asyncio.gather(*[
+                client.text_generation(prompt, max_new_tokens=4, do_sample=False)
+                for _ in range(200)
+            ])
+            assert threading.active_count() - before <= 2
+            return outs
+
+    outs = asyncio.run(main())
+    assert outs == [expected] * 200
+
+
+def test_async_openai_surface():
+    client = AsyncClient(backend="openai")
+    assert asyncio.iscoroutinefunction(client.responses.create)
+    assert asyncio.iscoroutinefunction(client.chat.completions.create)
+    asyncio.run(client.close())
+
+
+def test_async_client_context_and_disk_cache(tmp_path):
+    client = AsyncClient(backend="openai", cache=True, cache_dir=str(tmp_path))
+    with pytest.raises(TypeError, match="async with"):
+        with client:
+            pass
+    cache = client.cache
+    threads = []
+    disk_get = cache.disk.get
+
+    def get(key):
+        threads.append(threading.current_thread())
+        return disk_get(key)
+
+    cache.disk.get = get
+
+    async def main():
+        await cache.aset("k", MLHQResponse(text="hi", raw=None))
+        cache.memory.clear()
+        return await cache.aget("k")
+
+    assert asyncio.run(main()).text == "hi"
+    # the sqlite tier was read off the event loop thread
+    assert threads and threads[0] is not threading.main_thread()
+    asyncio.run(client.close())
@@ -0,0 +1,122 @@
+import asyncio
+import gc
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mlhq import AsyncClient, Client
+from mlhq.backends.balancer import Endpoint, LoadBalancer, _TrackedStream
+from mlhq.stub_server import StubServer
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _chat(client, **kwargs):
+    return client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2,
+                                          **kwargs)
+
+
+def test_least_outstanding_avoids_slow_replica():
+    stubs = [StubServer(latency=0.3, tokens_per_s=0).start(),
+             StubServer(latency=0.01, tokens_per_s=0).start(),
+             StubServer(latency=0.01, tokens_per_s=0).start()]
+    try:
+        client = Client(base_url=[s.url for s in stubs])
+        with ThreadPoolExecutor(6) as pool:
+            list(pool.map(lambda _: _chat(client), range(60)))
+        stats = client.balancer.stats()
+    finally:
+        for s in stubs:
+            s.stop()
+    slow, fast = stubs[0].requests, stubs[1].requests + stubs[2].requests
+    assert slow + fast == 60
+    assert slow < fast / 4
+    assert stats[stubs[0].url]["latency_p50_s"] > stats[stubs[1].url]["latency_p50_s"]
+    assert all(s["outstanding"] == 0 for s in stats.values())
+
+
+def test_failing_replica_is_ejected():
+    with StubServer(latency=0.0, tokens_per_s=0, fail_rate=1.0) as bad, \
+            StubServer(latency=0.0, tokens_per_s=0) as good:
+        # round robin keeps sending the bad replica traffic until it is ejected
+        client = Client(base_url=[bad.url, good.url], max_retries=3, retry_base_delay=0.01,
+                        balancer_policy="round_robin", balancer_max_failures=2,
+                        balancer_ejection_s=60)
+        for _ in range(20):
+            _chat(client)
+        stats = client.balancer.stats()
+    assert bad.requests == 2
+    assert good.requests == 20
+    assert stats[bad.url]["ejected"] and stats[bad.url]["ejections"] == 1
+    assert stats[bad.url]["errors"] == 2
+
+
+def test_least_outstanding_prefers_healthy_replica():
+    with StubServer(latency=0.0, tokens_per_s=0, fail_rate=1.0) as bad, \
+            StubServer(latency=0.0, tokens_per_s=0) as good:
+        client = Client(base_url=[bad.url, good.url], retry_base_delay=0.01)
+        for _ in range(10):
+            _chat(client)
+    assert (bad.requests, good.requests) == (1, 10)
+
+
+def test_custom_policy_and_streams():
+    with StubServer(latency=0.0, tokens_per_s=0) as a, \
+            StubServer(latency=0.0, tokens_per_s=0) as b:
+        client = Client(base_url=[a.url, b.url], balancer_policy=lambda eps: eps[-1])
+        stream = _chat(client, stream=True)
+        assert client.balancer.stats()[b.url]["outstanding"] == 1
+        assert stream.get_final_response().usage["completion_tokens"] == 2
+        assert client.balancer.stats()[b.url]["outstanding"] == 0
+        _chat(client)
+        # dropped without ever being iterated: the slot still comes back
+        _chat(client, stream=True)
+        gc.collect()
+        assert client.balancer.stats()[b.url]["outstanding"] == 0
+    assert (a.requests, b.requests) == (0, 3)
+
+    lb = LoadBalancer([Endpoint("a")])
+    stream = _TrackedStream(iter(["x", "y"]), lb, lb.acquire(), 0.0)
+    assert next(stream) == "x"
+    stream.close()
+    assert lb.stats()["a"]["outstanding"] == 0
+    del stream  # released once, not again on collection
+    assert lb.stats()["a"]["outstanding"] == 0
+
+
+def test_all_ejected_still_tries_soonest():
+    endpoints = [Endpoint("a"), Endpoint("b")]
+    lb = LoadBalancer(endpoints, max_failures=1, ejection_s=10)
+    for e in endpoints:
+        lb.release(lb.acquire(), 0.1, ConnectionError())
+    assert all(s["ejected"] for s in lb.stats().values())
+    assert lb.acquire() is min(endpoints, key=lambda e: e.ejected_until)
+
+
+def test_success_resets_ejection_backoff():
+    endpoint = Endpoint("a")
+    lb = LoadBalancer([endpoint], max_failures=1, ejection_s=10, max_ejection_s=300)
+
+    def eject():
+        lb.release(lb.acquire(), 0.1, ConnectionError())
+        return endpoint.ejected_until - time.monotonic()
+
+    assert eject() <= 10 and 10 < eject() <= 20  # doubles on repeats
+    lb.release(lb.acquire(), 0.1)  # one success restores it fully
+    assert eject() <= 10
+    assert lb.stats()["a"]["ejections"] == 3
+
+
+def test_async_balancing():
+    async def main(urls):
+        async with AsyncClient(base_url=urls) as client:
+            await asyncio.gather(*[
+                client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2)
+                for _ in range(20)
+            ])
+            return client.balancer.stats()
+
+    with StubServer(latency=0.05, tokens_per_s=0) as a, \
+            StubServer(latency=0.05, tokens_per_s=0) as b:
+        stats = asyncio.run(main([a.url, b.url]))
+    assert a.requests == b.requests == 10
+    assert all(s["outstanding"] == 0 for s in stats.values())
@@ -0,0 +1,102 @@
+import json
+
+from mlhq import Client
+from mlhq.__main__ import main
+from mlhq.batch import run_batch
+from mlhq.stub_server import StubServer
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(r) + "\n" for r in rows))
+
+
+def _read_jsonl(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def _chat_rows(n):
+    return [{"custom_id": f"q{i}", "url": "/v1/chat/completions",
+             "body": {"model": "stub", "max_tokens": 3,
+                      "messages": [{"role": "user", "content": f"question {i}"}]}}
+            for i in range(n)]
+
+
+def test_batch_resumes_after_crash(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _chat_rows(20))
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url)
+        stats = run_batch(client, str(src), str(out), concurrency=4)
+        assert stats["succeeded"] == 20
+        records = _read_jsonl(out)
+        assert sorted(r["custom_id"] for r in records) == sorted(f"q{i}" for i in range(20))
+        assert all(r["response"]["usage"]["completion_tokens"] == 3 for r in records)
+
+        # crash: 7 rows made it to disk, the 8th was torn mid-write
+        lines = out.read_text().splitlines(keepends=True)
+        out.write_text("".join(lines[:7]) + lines[7][:10])
+        seen = stub.requests
+        stats = run_batch(client, str(src), str(out), concurrency=4)
+        assert stub.requests - seen == 13
+
+    assert stats["skipped"] == 7 and stats["succeeded"] == 13
+    assert sorted(r["index"] for r in _read_jsonl(out)) == list(range(20))
+
+
+def test_batch_retries_failed_rows_on_resume(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _chat_rows(10))
+    with StubServer(latency=0.0, tokens_per_s=0, fail_rate=0.5) as stub:
+        client = Client(base_url=stub.url, max_retries=0)
+        first = run_batch(client, str(src), str(out))
+        stub.fail_rate = 0.0
+        second = run_batch(client, str(src), str(out))
+
+    assert first["failed"] > 0
+    assert second["skipped"] == first["succeeded"]
+    assert second["succeeded"] == first["failed"]
+    records = _read_jsonl(out)
+    assert len(records) == 10 and all(r["error"] is None for r in records)
+
+
+def test_malformed_lines_become_error_records(tmp_path):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    good = "".join(json.dumps(r) + "\n" for r in _chat_rows(3))
+    src.write_text(good + '{"body": {"messages": \n' + "[1, 2]\n")
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url)
+        for _ in range(2):  # a resumed run gets through too
+            stats = run_batch(client, str(src), str(out))
+            assert stats["succeeded"] + stats["skipped"] == 3 and stats["failed"] == 2
+    errors = {r["index"]: r["error"] for r in _read_jsonl(out) if r["error"] is not None}
+    assert sorted(errors) == [3, 4]
+    assert errors[3]["message"].startswith("line 4: invalid JSON")
+    assert errors[4]["message"] == "line 5: expected a JSON object"
+
+
+def test_hflocal_rows_use_batched_generation(tmp_path, tiny_model_dir):
+    prompts = ["Hello", "How are you?", "The quick brown fox", "Hi", "Tell me a story"]
+    rows = [{"messages": [{"role": "user", "content": p}], "max_tokens": 4, "temperature": 0}
+            for p in prompts]
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, rows)
+    events = []
+    client = Client(backend="hflocal", model=tiny_model_dir, max_batch_size=2,
+                    metrics_callback=events.append)
+
+    stats = run_batch(client, str(src), str(out), batch_size=4)
+
+    assert stats["succeeded"] == 5
+    assert [e["method"] for e in events] == ["chat_completion_batch"] * 2
+    texts = {r["index"]: r["response"]["text"] for r in _read_jsonl(out)}
+    for i, row in enumerate(rows):
+        assert texts[i] == client.chat.completions.create(**row).text
+
+
+def test_cli_batch_run(tmp_path, capsys):
+    src, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_jsonl(src, _chat_rows(3))
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        main(["batch", "run", str(src), str(out), "--base-url", stub.url])
+    assert json.loads(capsys.readouterr().out)["succeeded"] == 3
+    assert len(_read_jsonl(out)) == 3
@@ -0,0 +1,48 @@
+import json
+
+from mlhq import Client
+from mlhq.__main__ import main
+from mlhq.bench import percentile, run_bench
+from mlhq.stub_server import StubServer
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.5
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 100) == 100.0
+    assert percentile([], 99) == 0.0
+
+
+def test_bench_streaming_against_stub():
+    with StubServer(latency=0.05, tokens_per_s=500) as stub:
+        client = Client(backend="openai", base_url=stub.url)
+        report = run_bench(client, model="stub", max_tokens=8, concurrency=4, requests=12)
+
+    assert report["succeeded"] == report["requests"] == 12
+    assert report["errors"] == {}
+    assert report["output_tokens"] == 12 * 8
+    assert report["tokens_per_s"] > 0
+    assert report["ttft_s"]["p50"] >= 0.05
+    assert report["latency_s"]["p99"] >= report["ttft_s"]["p99"]
+    assert set(report["itl_s"]) == {"mean", "p50", "p95", "p99", "max"}
+
+
+def test_bench_counts_errors_open_loop():
+    with StubServer(latency=0.0, tokens_per_s=0, fail_rate=1.0) as stub:
+        client = Client(backend="openai", base_url=stub.url)
+        report = run_bench(client, api="responses", model="stub", max_tokens=4,
+                           concurrency=4, requests=4, rate=200)
+
+    assert report["mode"] == "open-loop"
+    assert report["requests"] == 4
+    assert report["succeeded"] == 0
+    assert report["errors"] == {"InternalServerError": 4}
+
+
+def test_cli_bench_stub(capsys):
+    main(["bench", "--stub", "--requests", "4", "--concurrency", "2", "--max-tokens", "4",
+          "--stub-latency", "0", "--stub-tokens-per-s", "0"])
+    report = json.loads(capsys.readouterr().out)
+    assert report["succeeded"] == 4
+    assert report["model"] == "stub"
@@ -0,0 +1,124 @@
+import time
+from types import SimpleNamespace
+
+from mlhq import Client, MLHQResponse
+from mlhq.backends import register_backend
+from mlhq.cache import DiskCache, cache_key, samples_by_default
+from mlhq.stub_server import StubServer
+
+
+class CountingBackend:
+    calls = 0
+
+    def __init__(self, **cfg):
+        self.chat = type("Chat", (), {"completions": self})()
+
+    def create(self, **kwargs):
+        CountingBackend.calls += 1
+        return MLHQResponse(text=f"reply {CountingBackend.calls}", raw={"id": "x"},
+                            model=kwargs.get("model"), provider="counting",
+                            usage={"total_tokens": 3})
+
+    def text_generation(self, prompt, **kwargs):
+        CountingBackend.calls += 1
+        return prompt.upper()
+
+
+register_backend("counting", CountingBackend)
+MSGS = [{"role": "user", "content": "hi"}]
+
+
+def test_memory_hits_are_marked_cached():
+    CountingBackend.calls = 0
+    client = Client(backend="counting", cache=True)
+    first = client.chat.completions.create(model="m", messages=MSGS, temperature=0)
+    # same request, different kwarg order / 0 vs 0.0
+    again = client.chat.completions.create(temperature=0.0, messages=MSGS, model="m")
+    assert CountingBackend.calls == 1
+    assert not first.cached and again.cached
+    assert again.text == first.text and again.usage == first.usage and again.id == "x"
+
+    assert client.text_generation("abc") == client.text_generation("abc") == "ABC"
+    assert CountingBackend.calls == 2
+    assert client.cache.stats()["hits"] == 2
+
+
+def test_sampled_requests_bypass_cache():
+    CountingBackend.calls = 0
+    client = Client(backend="counting", cache=True)
+    for kwargs in ({"temperature": 0.7}, {"top_p": 0.9}, {"n": 2},
+                   {"do_sample": True, "temperature": 0.5}):
+        for _ in range(2):
+            client.chat.completions.create(model="m", messages=MSGS, **kwargs)
+    assert CountingBackend.calls == 8
+    for kwargs in ({"temperature": 0, "top_p": 0.9}, {"do_sample": False, "temperature": 0.7}):
+        for _ in range(2):
+            client.chat.completions.create(model="m", messages=MSGS, **kwargs)
+    assert CountingBackend.calls == 10
+
+    client = Client(backend="counting", cache=True, cache_sampled=True)
+    first = client.chat.completions.create(model="m", messages=MSGS, temperature=0.7)
+    assert client.chat.completions.create(model="m", messages=MSGS,
+                                          temperature=0.7).text == first.text
+    assert CountingBackend.calls == 11
+
+
+def test_default_temperature_follows_backend():
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url, cache=True)
+        create = lambda **kw: client.chat.completions.create(  # noqa: E731
+            model="stub", messages=MSGS, max_tokens=4, **kw)
+        # the OpenAI API samples at temperature 1 when a request leaves it out
+        first, again = create(), create()
+        assert not again.cached and again.id != first.id
+        create(temperature=0)
+        assert create(temperature=0).cached
+    # hflocal reads the model's generation_config
+    assert samples_by_default(SimpleNamespace(do_sample=True, temperature=0.7))
+    assert not samples_by_default(SimpleNamespace(do_sample=False, temperature=1.0))
+    assert not samples_by_default(SimpleNamespace(do_sample=True, temperature=0))
+    assert not samples_by_default(None)
+
+
+def test_disk_tier_survives_new_client(tmp_path):
+    CountingBackend.calls = 0
+    Client(backend="counting", cache=True, cache_dir=str(tmp_path)).chat.completions.create(
+        model="m", messages=MSGS, temperature=0
+    )
+    resp = Client(backend="counting", cache=True, cache_dir=str(tmp_path)).chat.completions.create(
+        model="m", messages=MSGS, temperature=0
+    )
+    assert CountingBackend.calls == 1 and resp.cached
+
+
+def test_stream_requests_bypass_cache():
+    client = Client(backend="counting", cache=True)
+    assert client._cache_key("chat.completions", (), {"stream": True}) is None
+
+
+def test_disk_ttl_and_size_eviction(tmp_path):
+    disk = DiskCache(str(tmp_path / "c.sqlite"), max_bytes=450, ttl=60)
+    for i in range(5):
+        disk.set(f"k{i}", "x" * 100)
+        time.sleep(0.01)
+    disk.get("k2")  # most recently read survives eviction
+    disk.set("k5", "x" * 100)
+    assert disk.size() <= 450
+    assert disk.get("k2") is not None and disk.get("k5") is not None
+    assert disk.get("k0") is None and disk.get("k1") is None
+
+    disk.ttl = 0
+    time.sleep(0.01)
+    assert disk.get("k5") is None
+
+
+def test_key_covers_backend_and_model():
+    a = cache_key("openai", None, "responses", (), {"model": "a", "input": "x"})
+    b = cache_key("openai", None, "responses", (), {"model": "b", "input": "x"})
+    c = cache_key("hflocal", None, "responses", (), {"model": "a", "input": "x"})
+    assert len({a, b, c}) == 3
+    d = cache_key("hflocal", None, "responses", (), {"model": "a", "input": "x"},
+                  {"torch_dtype": "bfloat16"})
+    e = cache_key("hflocal", None, "responses", (), {"model": "a", "input": "x"},
+                  {"quantization": "int8"})
+    assert len({c, d, e}) == 3
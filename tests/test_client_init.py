@@ -9,9 +9,27 @@ def test_default_init_values():
     c = Client()
     cfg = c.config
     assert isinstance(cfg, ClientConfig)
-    assert cfg.api_key is None
-    assert cfg.endpoint == "https://api.example.com"
-    assert cfg.timeout == 30.0
+    assert cfg.backend == "openai"
+    assert cfg.base_url is None
+    assert cfg.model is None
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unsupported backend"):
+        Client(backend="does-not-exist")
+
+def test_register_backend():
+    from mlhq.backends import register_backend
+
+    class EchoBackend:
+        def __init__(self, **cfg):
+            self.cfg = cfg
+        def text_generation(self, prompt, **kwargs):
+            return prompt
+
+    register_backend("echo", EchoBackend)
+    c = Client(backend="echo", model="m")
+    assert c.text_generation("hi") == "hi"
+    assert c._backend.cfg["model"] == "m"
 
 def openai_sanity_check(): 
     client = Client()
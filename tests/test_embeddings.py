@@ -0,0 +1,63 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from mlhq import AsyncClient, Client
+from mlhq.stub_server import StubServer
+
+TEXTS = ["a short one", "The quick brown fox jumps over the lazy dog, twice over.",
+         "mid length text"]
+
+
+def test_openai_base64_passthrough():
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url)
+        create = lambda **kw: client.embeddings.create(model="stub-embed", **kw)  # noqa: E731
+        resp = create(input=TEXTS)
+        single = create(input=TEXTS[1])
+        floats = create(input=TEXTS, encoding_format="float")
+        half = create(input=TEXTS, dimensions=4, dtype="float16")
+    assert resp.data.shape == (3, 8) and resp.data.dtype == np.float32
+    assert resp.data.flags["C_CONTIGUOUS"]
+    assert len(resp) == 3 and resp.provider == "openai"
+    assert resp.usage["prompt_tokens"] > 0
+    np.testing.assert_array_equal(single[0], resp[1])
+    np.testing.assert_allclose(floats.data, resp.data, rtol=1e-6)
+    assert half.data.shape == (3, 4) and half.data.dtype == np.float16
+
+
+def test_hflocal_rows_follow_input_order(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir, max_batch_size=2)
+    try:
+        resp = client.embeddings.create(input=TEXTS)
+        assert resp.data.shape == (3, 32) and resp.data.dtype == np.float32
+        assert resp.data.flags["C_CONTIGUOUS"]
+        np.testing.assert_allclose(np.linalg.norm(resp.data, axis=1), 1.0, rtol=1e-5)
+        # batching is by sorted length; every row still matches its own input
+        for i, text in enumerate(TEXTS):
+            np.testing.assert_allclose(client.embeddings.create(input=text)[0], resp[i],
+                                       atol=1e-5)
+        tok = client._backend.tokenizer
+        assert resp.usage["prompt_tokens"] == sum(len(tok(t)["input_ids"]) for t in TEXTS)
+        assert 'method="embeddings",status="ok"} 4' in client.metrics.to_prometheus()
+
+        last = client.embeddings.create(input=TEXTS, pooling="last")
+        assert not np.allclose(last.data, resp.data)
+        half = client.embeddings.create(input=TEXTS, dtype="float16", dimensions=16)
+        assert half.data.shape == (3, 16) and half.data.dtype == np.float16
+        with pytest.raises(ValueError):
+            client.embeddings.create(input=TEXTS, pooling="cls")
+    finally:
+        client.close()
+
+
+def test_async_hflocal_embeddings(tiny_model_dir):
+    async def main():
+        client = AsyncClient(backend="hflocal", model=tiny_model_dir)
+        try:
+            return await client.embeddings.create(input=TEXTS[:2])
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()).data.shape == (2, 32)
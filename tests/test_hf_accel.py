@@ -0,0 +1,56 @@
+import pytest
+
+from mlhq import Client
+from mlhq.bench import parse_mode
+
+
+def test_parse_mode():
+    assert parse_mode("fp32") == {"torch_dtype": "fp32"}
+    assert parse_mode("bf16+compile") == {"torch_dtype": "bf16", "compile": True}
+    assert parse_mode("int8+compile-aot_eager") == {"quantization": "int8",
+                                                    "compile": "aot_eager"}
+    with pytest.raises(ValueError):
+        parse_mode("fp8")
+
+
+def _greedy(client):
+    return client.text_generation("Hello world", max_new_tokens=8, do_sample=False)
+
+
+def test_bf16_weights(tiny_model_dir):
+    import torch
+
+    client = Client(backend="hflocal", model=tiny_model_dir, torch_dtype="bf16")
+    try:
+        assert client._backend._inner.model.dtype == torch.bfloat16
+        assert isinstance(_greedy(client), str)
+    finally:
+        client.close()
+
+
+def test_int8_quantizes_linears(tiny_model_dir):
+    import torch
+
+    client = Client(backend="hflocal", model=tiny_model_dir, quantization="int8")
+    try:
+        model = client._backend._inner.model
+        assert not any(type(m) is torch.nn.Linear for m in model.modules())
+        assert isinstance(_greedy(client), str)
+    finally:
+        client.close()
+
+
+def test_int8_needs_fp32(tiny_model_dir):
+    with pytest.raises(ValueError):
+        Client(backend="hflocal", model=tiny_model_dir, quantization="int8", torch_dtype="bf16")
+
+
+def test_compile_matches_eager(tiny_model_dir):
+    eager = Client(backend="hflocal", model=tiny_model_dir)
+    compiled = Client(backend="hflocal", model=tiny_model_dir, compile="eager")
+    try:
+        assert compiled._backend._inner.model is not eager._backend._inner.model
+        assert _greedy(compiled) == _greedy(eager)
+    finally:
+        eager.close()
+        compiled.close()
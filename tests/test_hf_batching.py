@@ -0,0 +1,52 @@
+from mlhq import Client
+
+PROMPTS = [
+    "Hello world",
+    "The quick brown fox jumps over the lazy dog.",
+    "How are you?",
+    '{"name": "mlhq"}',
+    "Hello",
+]
+
+
+def test_batched_matches_single_in_input_order(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir, max_batch_size=2)
+    single = [client.text_generation(p, max_new_tokens=6, do_sample=False) for p in PROMPTS]
+    batched = client.text_generation(PROMPTS, max_new_tokens=6, do_sample=False)
+    assert batched == single
+
+
+def test_plan_batches_respects_limits(tiny_model_dir):
+    inner = Client(backend="hflocal", model=tiny_model_dir)._backend._inner
+    inner.max_batch_size, inner.max_batch_tokens = 3, 40
+    batches = inner._plan_batches([9, 1, 5, 3, 7, 2], max_new_tokens=4)
+    assert sorted(i for b in batches for i in b) == list(range(6))
+    lengths = [9, 1, 5, 3, 7, 2]
+    for b in batches:
+        assert len(b) <= 3
+        assert len(b) == 1 or len(b) * (max(lengths[i] for i in b) + 4) <= 40
+    # bucketed by length: shortest prompts share the first batch
+    assert batches[0] == [1, 5, 3]
+
+
+def test_default_max_new_tokens_counts_toward_batch_cost(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    inner = client._backend._inner
+    saved = inner.model.generation_config.max_new_tokens  # the model is shared
+    inner.model.generation_config.max_new_tokens = 10
+    seen = []
+    plan = inner._plan_batches
+    inner._plan_batches = lambda lengths, max_new_tokens: (
+        seen.append(max_new_tokens) or plan(lengths, max_new_tokens))
+    try:
+        client.text_generation(PROMPTS, do_sample=False)
+    finally:
+        inner.model.generation_config.max_new_tokens = saved
+    assert seen == [10]
+    assert inner._max_new_tokens({"max_new_tokens": 0}, 5) == 0
+
+
+def test_empty_prompt_list(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    assert client.text_generation([]) == []
+    assert client.chat_completion_batch([]) == []
@@ -0,0 +1,105 @@
+import json
+import re
+
+import pytest
+
+pytest.importorskip("torch")
+
+from mlhq import Client
+from mlhq.backends.hf_constrained import RegexDFA, TokenIndex, schema_to_regex
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "maxLength": 8},
+        "value": {"type": "integer"},
+        "ok": {"type": "boolean"},
+    },
+    "required": ["name", "value"],
+}
+
+
+@pytest.fixture(scope="module")
+def client(tiny_model_dir):
+    c = Client(backend="hflocal", model=tiny_model_dir)
+    yield c
+    c.close()
+
+
+@pytest.mark.parametrize("pattern,good,bad", [
+    (r"ab+c?", ["ab", "abbbc"], ["a", "ac", "abcc"]),
+    (r"[a-f0-9]{2,3}", ["a0", "fff"], ["g1", "a", "abcd"]),
+    (r"(yes|no)\.", ["yes.", "no."], ["yes", "maybe."]),
+    (r"[^x]é", ["aé", "éé"], ["xé", "ae"]),
+])
+def test_regex_dfa(pattern, good, bad):
+    dfa = RegexDFA(pattern)
+    for text in good:
+        assert dfa.matches(text) and re.fullmatch(pattern, text)
+    for text in bad:
+        assert not dfa.matches(text)
+
+
+def test_schema_regex():
+    dfa = RegexDFA(schema_to_regex(SCHEMA))
+    assert dfa.matches('{"name":"mlhq","value":-12}')
+    assert dfa.matches('{"name":"a\\"b","value":0,"ok":true}')
+    assert not dfa.matches('{"value":1,"name":"x"}')          # properties in schema order
+    assert not dfa.matches('{"name":"mlhq"}')                 # missing required
+    assert not dfa.matches('{"name":"toolongname","value":1}')
+    assert RegexDFA(schema_to_regex({})).matches('{"a":[1,2.5,null,"x"],"b":{}}')
+
+
+@pytest.mark.parametrize("bounds,good,bad", [
+    ({"minimum": 0}, ["0", "7"], ["-1"]),
+    ({"exclusiveMinimum": 0}, ["1", "10"], ["0", "-1"]),
+    ({"minimum": 0.5}, ["1"], ["0"]),
+    ({"minimum": -0.5}, ["0", "3"], ["-1"]),
+    ({"minimum": 0, "exclusiveMinimum": True}, ["1"], ["0"]),  # draft 4
+    ({"minimum": -3}, ["-2", "0"], []),  # not enforced beyond the sign
+])
+def test_integer_lower_bounds(bounds, good, bad):
+    dfa = RegexDFA(schema_to_regex({"type": "integer", **bounds}))
+    assert all(dfa.matches(s) for s in good)
+    assert not any(dfa.matches(s) for s in bad)
+
+
+def test_generation_follows_regex(client):
+    pattern = r"(cat|dog)s? [0-9]{1,3}"
+    outs = client.text_generation(["Hello world", "The quick brown fox"], max_new_tokens=12,
+                                  do_sample=False, regex=pattern)
+    assert all(re.fullmatch(pattern, out) for out in outs)
+
+    stream = client.text_generation("Hello world", max_new_tokens=12, do_sample=False,
+                                    regex=pattern, stream=True)
+    assert re.fullmatch(pattern, "".join(c.text for c in stream))
+
+
+def test_chat_response_format(client):
+    resp = client.chat.completions.create(
+        messages=[{"role": "user", "content": "Describe mlhq"}], max_tokens=48, temperature=0,
+        response_format={"type": "json_schema", "json_schema": {"name": "x", "schema": SCHEMA}},
+    )
+    if resp.finish_reason == "stop":
+        data = json.loads(resp.text)
+        assert isinstance(data["name"], str) and isinstance(data["value"], int)
+    else:  # cut off by max_tokens: still a prefix of a valid document
+        assert re.match(r'\{\s*"name"\s*:\s*"', resp.text)
+
+
+def test_index_persisted(tiny_model_dir, tmp_path):
+    from transformers import AutoTokenizer
+
+    tok = AutoTokenizer.from_pretrained(tiny_model_dir)
+    pattern = schema_to_regex(SCHEMA)
+    path = str(tmp_path / "index.pt")
+    first = TokenIndex(pattern, tok, path)
+    states = first.compile()
+    first.save()
+
+    second = TokenIndex(pattern, tok, path)
+    second._walk = None  # every row must come from disk
+    assert second.row(second.initial) == {
+        t: second.dfa.state_for(first.dfa.key(n)) for t, n in first.row(first.initial).items()
+    }
+    assert second.compile() == states
@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from mlhq import Client
+from mlhq.backends.hf_detokenize import IncrementalDetokenizer, StopMatcher, TextStream
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tiny_model_dir):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tiny_model_dir)
+
+
+def test_incremental_detokenizer(tokenizer):
+    text = "Hello wörld! 日本語 🦊 The quick brown fox"
+    ids = tokenizer(text)["input_ids"]
+    detok = IncrementalDetokenizer(tokenizer)
+    deltas = [detok.push([tok]) for tok in ids] + [detok.flush()]
+    assert "".join(deltas) == tokenizer.decode(ids) == text
+    assert not any("\ufffd" in d for d in deltas)
+
+
+def test_stop_matcher_streaming():
+    m = StopMatcher(["STOP", "\n\n", "abcd", "bc"])
+    assert m.feed("hello S") == "hello "  # "S" may start "STOP"
+    assert m.feed("TOR") == "STOR"
+    assert m.feed("a\n") == "a"
+    assert m.feed("\nmore") == "" and m.hit
+    assert m.feed("ignored") == ""
+
+    m = StopMatcher(["abcd", "bc"])
+    assert m.feed("xab") == "x"
+    assert m.feed("cd") == "a" and m.hit  # "bc" completes first
+    assert StopMatcher(["<end>", "end"]).find("the <end>") == 5
+    assert StopMatcher(["zz"]).find("abc") == -1
+
+    m = StopMatcher(["xyz"])
+    assert m.feed("abx") == "ab"
+    assert m.flush() == "x" and not m.hit
+
+
+def test_text_stream_end_ids(tokenizer):
+    ids = tokenizer("Hello world")["input_ids"]
+    stream = TextStream(tokenizer, ["world"], end_ids=[tokenizer.eos_token_id])
+    emitted = "".join(stream.push([tok]) for tok in ids) + stream.finish()
+    assert emitted == stream.text == "Hello " and stream.hit
+
+    stream = TextStream(tokenizer, end_ids=[tokenizer.eos_token_id])
+    stream.push(ids[:2] + [tokenizer.eos_token_id] + ids[2:])
+    stream.finish()
+    assert stream.text == tokenizer.decode(ids[:2]) and not stream.hit
+
+
+def test_generate_stops_on_sequence(tiny_model_dir):
+    with Client(backend="hflocal", model=tiny_model_dir) as client:
+        prompts = ["Hello world", "The quick brown fox"]
+        full = client.text_generation(prompts, max_new_tokens=12, do_sample=False, details=True)
+        stop = full[0].text[4:6]
+        cut = client.text_generation(prompts, max_new_tokens=12, do_sample=False, stop=[stop],
+                                     details=True)
+        for f, c in zip(full, cut):
+            if stop in f.text:
+                assert c.text == f.text[:f.text.index(stop)] and c.finish_reason == "stop"
+                # generation ended at the stop sequence, not at max_new_tokens
+                assert c.usage["completion_tokens"] < f.usage["completion_tokens"]
+            else:
+                assert c.text == f.text
+
+        stream = client.text_generation(prompts[0], stream=True, max_new_tokens=12,
+                                        do_sample=False, stop=stop)
+        assert "".join(ch.text for ch in stream) == cut[0].text
+        assert stream.response.finish_reason == "stop"
@@ -0,0 +1,150 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+pytest.importorskip("torch")
+
+from mlhq import Client, MLHQResponse
+from mlhq.backends.hf_memory import Footprint, MemoryBudget, MemoryBudgetExceeded
+from mlhq.server import ModelServer
+
+PROMPTS = ["Hello world", "The quick brown fox jumps", "How are you today?", "lazy dog"]
+
+
+def test_kv_estimate_matches_cache(tiny_model_dir):
+    import torch
+    from transformers import AutoModelForCausalLM
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    footprint = Footprint(model)
+    # 2 layers * (K, V) * 2 kv heads * head_dim 8 * fp32
+    assert footprint.kv_bytes_per_token == 2 * 2 * 2 * 8 * 4
+    input_ids = torch.randint(3, 200, (3, 10))
+    out = model.generate(input_ids, max_new_tokens=6, min_new_tokens=6, do_sample=False,
+                         return_dict_in_generate=True)
+    cache = out.past_key_values
+    actual = sum(t.numel() * t.element_size() for layer in cache.layers
+                 for t in (layer.keys, layer.values))
+    # the last generated token is never fed back, so the cache holds one less
+    assert actual == 3 * (10 + 6 - 1) * footprint.kv_bytes_per_token
+    assert footprint.estimate(3, 10, 6) > actual
+
+
+def test_budget_reject_and_queue():
+    budget = MemoryBudget(100, policy="reject")
+    with budget.reserve(60):
+        with pytest.raises(MemoryBudgetExceeded):
+            budget.acquire(60)
+    with pytest.raises(ValueError, match="whole budget"):
+        budget.acquire(101)
+    assert budget.stats()["rejected"] == 2 and budget.stats()["reserved_bytes"] == 0
+
+    budget = MemoryBudget(100, policy="queue")
+    held = budget.acquire(60)
+    admitted = threading.Event()
+
+    def waiter():
+        with budget.reserve(60):
+            admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted.is_set() and budget.stats()["waiting"] == 1
+    budget.release(held)
+    thread.join(5)
+    stats = budget.stats()
+    assert admitted.is_set() and stats["queued"] == 1 and stats["wait_s"] >= 0.04
+    assert stats["reserved_bytes"] == 0 and stats["peak_reserved_bytes"] == 60
+
+    budget = MemoryBudget(100, timeout=0.01)
+    with budget.reserve(60), pytest.raises(MemoryBudgetExceeded):
+        budget.acquire(60)
+    with pytest.raises(ValueError):
+        MemoryBudget(100, policy="drop")
+
+
+def test_client_admission(tiny_model_dir):
+    plain = Client(backend="hflocal", model=tiny_model_dir)
+    expected = plain.text_generation(PROMPTS, max_new_tokens=8, do_sample=False)
+    plain.close()
+    probe = Client(backend="hflocal", model=tiny_model_dir, kv_memory_budget=1 << 40)
+    longest = max(len(ids) for ids in probe._backend.tokenizer(PROMPTS)["input_ids"])
+    one_row = probe._backend._inner._footprint_of(1, longest, 8)
+    probe.close()
+
+    # room for one long row at a time: the batch is split, results are unchanged
+    with Client(backend="hflocal", model=tiny_model_dir,
+                kv_memory_budget=int(one_row * 1.5)) as client:
+        assert client.text_generation(PROMPTS, max_new_tokens=8, do_sample=False) == expected
+        stats = client.memory_budget.stats()
+        assert stats["admitted"] > 1 and stats["reserved_bytes"] == 0
+        assert stats["peak_reserved_bytes"] <= stats["budget_bytes"]
+        with pytest.raises(ValueError, match="whole budget"):
+            client.text_generation(PROMPTS[0], max_new_tokens=4000)
+        # one oversized prompt fails the whole list before anything is generated
+        admitted = client.memory_budget.stats()["admitted"]
+        with pytest.raises(ValueError, match="whole budget"):
+            client.text_generation([*PROMPTS, "Hello " * 40], max_new_tokens=8)
+        assert client.memory_budget.stats()["admitted"] == admitted
+        # embeddings are one forward pass: not budgeted, not split by it
+        plan = client._backend._inner._plan_batches
+        assert plan([30] * 4, 0, budgeted=False) == [[0, 1, 2, 3]]
+        assert len(client.embeddings.create(input=PROMPTS).data) == len(PROMPTS)
+        assert client.memory_budget.stats()["admitted"] == admitted
+
+    # continuous batching: concurrent requests queue for memory
+    with Client(backend="hflocal", model=tiny_model_dir, continuous_batching=True,
+                kv_memory_budget=int(one_row * 2.5)) as client:
+        with ThreadPoolExecutor(4) as pool:
+            out = list(pool.map(lambda p: client.text_generation(
+                p, max_new_tokens=8, do_sample=False, details=True), PROMPTS))
+        assert [r.text for r in out] == expected
+        stats = client.memory_budget.stats()
+        assert stats["reserved_bytes"] == 0 and stats["peak_reserved_bytes"] <= 2.5 * one_row
+        assert stats["admitted"] == len(PROMPTS)
+
+    with Client(backend="hflocal", model=tiny_model_dir, kv_memory_budget=int(one_row * 1.5),
+                kv_budget_policy="reject") as client:
+        held = client.memory_budget.acquire(one_row)  # another request in flight
+        labels = f'{{backend="hflocal",model="{tiny_model_dir}"}}'
+        text = client.metrics.to_prometheus()
+        assert f"mlhq_kv_reserved_bytes{labels} {one_row}" in text
+        assert f"mlhq_kv_budget_bytes{labels} {int(one_row * 1.5)}" in text
+        with pytest.raises(MemoryBudgetExceeded):
+            client.text_generation(PROMPTS[1], max_new_tokens=8)
+        client.memory_budget.release(held)
+        stream = client.text_generation(PROMPTS[1], max_new_tokens=8, do_sample=False,
+                                        stream=True)
+        assert "".join(c.text for c in stream) == expected[1]
+        stats = client.memory_budget.stats()
+        assert stats["reserved_bytes"] == 0 and stats["rejected"] == 1
+
+
+class _FullClient:
+    """Stand-in for an hflocal Client whose memory budget is already taken."""
+
+    def __init__(self):
+        self.config = SimpleNamespace(model="fake")
+        self.metrics = None
+        self.memory_budget = MemoryBudget(1000, policy="reject")
+        self.memory_budget.acquire(900)
+
+    def chat_completion_batch(self, conversations, **kwargs):
+        with self.memory_budget.reserve(500):
+            return [MLHQResponse(text="ok", raw=None) for _ in conversations]
+
+
+def test_server_rejects_over_budget():
+    with ModelServer(_FullClient()) as server:
+        resp = httpx.post(f"{server.url}/chat/completions", json={
+            "model": "fake", "messages": [{"role": "user", "content": "hi"}]})
+        assert resp.status_code == 503 and int(resp.headers["retry-after-ms"]) > 0
+        base = server.url.rsplit("/v1", 1)[0]
+        assert httpx.get(f"{base}/stats").json()["kv_memory"]["reserved_bytes"] == 900
+        metrics = httpx.get(f"{base}/metrics").text
+    assert "mlhq_server_kv_reserved_bytes 900" in metrics
+    assert "mlhq_server_kv_rejected_total 1" in metrics
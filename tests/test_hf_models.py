@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from mlhq import Client
+from mlhq.backends.hf_models import (ModelRegistry, configure_model_registry, get_model_registry,
+                                     snapshot_path)
+from mlhq.metrics import Timings, timed_request
+
+
+def test_clients_share_one_loaded_model(tiny_model_dir):
+    registry = get_model_registry()
+    loads = registry.loads
+    with ThreadPoolExecutor(4) as pool:
+        clients = list(pool.map(lambda _: Client(backend="hflocal", model=tiny_model_dir),
+                                range(4)))
+    inners = [c._backend._inner for c in clients]
+    assert all(i.model is inners[0].model for i in inners)
+    assert registry.loads - loads <= 1
+    key = "/".join(ModelRegistry.key(tiny_model_dir, None, inners[0].device))
+    refs = registry.stats()["models"][key]["refs"]
+    for c in clients:
+        c.close()
+    assert registry.stats()["models"][key]["refs"] == refs - 4
+
+
+def test_idle_models_evicted_over_budget(tiny_model_dir):
+    registry = ModelRegistry()
+    a = registry.acquire(tiny_model_dir, device="cpu")
+    b = registry.acquire(tiny_model_dir, dtype="bfloat16", device="cpu")
+    registry.memory_budget = a.nbytes
+
+    registry.release(b)  # over budget: idle b goes, in-use a stays
+    assert list(registry.stats()["models"]) == ["/".join(a.key)]
+    registry.release(a)  # within budget: a stays warm while idle
+    assert registry.stats()["evictions"] == 1
+
+    registry.acquire(tiny_model_dir, dtype="bfloat16", device="cpu")  # reload pushes out idle a
+    stats = registry.stats()
+    assert stats["loads"] == 3 and stats["evictions"] == 2
+    assert list(stats["models"]) == ["/".join(b.key)]
+
+
+def test_client_budget_never_lowers_process_budget(tiny_model_dir):
+    registry = ModelRegistry()
+    registry.raise_budget(200)
+    registry.raise_budget(100)  # another tenant's smaller budget is ignored
+    assert registry.memory_budget == 200
+    registry.raise_budget(300)
+    assert registry.memory_budget == 300
+
+    shared = get_model_registry()
+    saved = shared.memory_budget
+    try:
+        assert configure_model_registry(memory_budget=1 << 40) is shared
+        Client(backend="hflocal", model=tiny_model_dir, model_memory_budget=1).close()
+        assert shared.memory_budget == 1 << 40
+    finally:
+        configure_model_registry(memory_budget=saved)
+
+
+def _load_phases(registry, name, snapshot_dir, **kwargs):
+    timings = Timings()
+    with timed_request(timings):
+        entry = registry.acquire(name, device="cpu", snapshot_dir=snapshot_dir, **kwargs)
+    return entry, timings.phases
+
+
+@pytest.mark.parametrize("kwargs", [{"dtype": "bf16"}, {"quantization": "int8"}])
+def test_snapshot_skips_post_processing(tiny_model_dir, tmp_path, kwargs):
+    first, phases = _load_phases(ModelRegistry(), tiny_model_dir, str(tmp_path), **kwargs)
+    assert {"load_weights", "save_snapshot"} <= set(phases)
+    again, phases = _load_phases(ModelRegistry(), tiny_model_dir, str(tmp_path), **kwargs)
+    assert "load_snapshot" in phases and "load_weights" not in phases
+    assert "quantize" not in phases
+    ids = torch.tensor([[1, 2, 3, 4]])
+    with torch.inference_mode():
+        assert torch.equal(first.model(ids).logits, again.model(ids).logits)
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_snapshot_tracks_the_source(tiny_model_dir, tmp_path):
+    path = snapshot_path(str(tmp_path), tiny_model_dir, "bfloat16", "cpu", "eager")
+    assert path == snapshot_path(str(tmp_path), tiny_model_dir, "bfloat16", "cpu", "eager")
+    assert path != snapshot_path(str(tmp_path), tiny_model_dir, "bfloat16", "cpu", "int8")
+    config = os.path.join(tiny_model_dir, "config.json")
+    st = os.stat(config)
+    os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    try:
+        assert path != snapshot_path(str(tmp_path), tiny_model_dir, "bfloat16", "cpu", "eager")
+    finally:
+        os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_warmup_and_startup_timings(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir, warmup="Hi", warmup_tokens=2)
+    try:
+        startup = client._backend.startup_timings
+        assert startup["warmup"] > 0 and startup["total"] >= startup["warmup"]
+        # the warm-up is not a request
+        assert "text_generation" not in client.metrics.to_prometheus()
+    finally:
+        client.close()
@@ -0,0 +1,87 @@
+import os
+import signal
+import time
+
+import pytest
+
+from mlhq import Client
+from mlhq.backends.hf_pool import plan_cpus
+
+PROMPTS = ["Hello world", "The quick brown fox", '{"name": "mlhq"', "How are you"]
+
+
+def test_plan_cpus():
+    assert plan_cpus(2, 2, cpus=range(4)) == [[0, 1], [2, 3]]
+    assert plan_cpus(None, None, cpus=range(8)) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert plan_cpus(None, None, cpus=[0]) == [[0]]
+    assert plan_cpus(3, 1, cpus=[0, 1]) == [[0], [1], [0]]  # oversubscribed: wrap
+
+
+@pytest.fixture(scope="module")
+def pool_client(tiny_model_dir):
+    client = Client(backend="hflocal-pool", model=tiny_model_dir, pool_workers=2,
+                    pool_threads=1)
+    yield client
+    client.close()
+
+
+def test_pool_matches_local(tiny_model_dir, pool_client):
+    local = Client(backend="hflocal", model=tiny_model_dir)
+    try:
+        expected = local.text_generation(PROMPTS, max_new_tokens=8, do_sample=False)
+        vectors = local.embeddings.create(input=PROMPTS).data
+    finally:
+        local.close()
+    assert pool_client.text_generation(PROMPTS, max_new_tokens=8, do_sample=False) == expected
+    assert (pool_client.embeddings.create(input=PROMPTS).data - vectors).max() < 1e-5
+    assert pool_client.text_generation(PROMPTS[0], max_new_tokens=8, do_sample=False) == expected[0]
+    streamed = pool_client.text_generation(PROMPTS[0], max_new_tokens=8, do_sample=False,
+                                           stream=True)
+    assert "".join(c.text for c in streamed) == expected[0]
+    assert streamed.response.usage["completion_tokens"] == 8
+
+    stats = pool_client.pool.stats()
+    assert stats["alive"] == 2
+    # the list was split across both workers
+    assert all(w["requests"] >= 1 for w in stats["workers"])
+    assert all(w["shared_weight_bytes"] > 0 for w in stats["workers"])
+    assert stats["completion_tokens"] >= 48 and stats["tokens_per_s"] > 0
+
+
+def test_pool_timings_and_errors(pool_client):
+    resp = pool_client.text_generation(PROMPTS[0], max_new_tokens=4, details=True)
+    assert resp.timings["prefill"] > 0 and "queue" in resp.timings
+    with pytest.raises(ValueError):  # generate()'s own error, re-raised in the parent
+        pool_client.text_generation(PROMPTS[0], max_new_tokens=4, not_a_kwarg=True)
+
+
+def test_pool_restart_and_respawn(pool_client):
+    pool = pool_client.pool
+    old = [w["pid"] for w in pool.stats()["workers"]]
+    pool.restart(0)
+    pids = [w["pid"] for w in pool.stats()["workers"]]
+    assert pids[0] != old[0] and pids[1] == old[1]
+
+    os.kill(pids[1], signal.SIGKILL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        worker = pool.stats()["workers"][1]
+        if worker["alive"] and worker["pid"] != pids[1]:
+            break
+        time.sleep(0.1)
+    assert pool.stats()["alive"] == 2
+    assert pool.stats()["restarts"] == 2
+    assert isinstance(pool_client.text_generation(PROMPTS, max_new_tokens=2), list)
+
+
+def test_restart_does_not_kill_busy_worker(pool_client):
+    pool = pool_client.pool
+    pids = [w["pid"] for w in pool.stats()["workers"]]
+    futures = [pool.submit("text_generation", (PROMPTS[0],),
+                           {"max_new_tokens": 200, "min_new_tokens": 200})
+               for _ in range(4)]
+    with pytest.raises(TimeoutError, match="did not drain"):
+        pool.restart(0, timeout=0.001)
+    assert all(f.result()[0] for f in futures)  # the in-flight calls finished
+    assert [w["pid"] for w in pool.stats()["workers"]] == pids
+    assert not any(w.draining for w in pool.workers)
@@ -0,0 +1,54 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+from transformers import DynamicCache  # noqa: E402
+
+from mlhq import Client  # noqa: E402
+from mlhq.backends.hf_prefix_cache import PrefixCache  # noqa: E402
+
+
+def _cache(length, layers=2):
+    return DynamicCache.from_legacy_cache(tuple(
+        (torch.randn(1, 2, length, 4), torch.randn(1, 2, length, 4)) for _ in range(layers)
+    ))
+
+
+def test_block_aligned_prefix_hit_and_lru_eviction():
+    entry_bytes = 2 * 2 * (1 * 2 * 40 * 4) * 4  # layers * (k, v) * elems * fp32
+    pc = PrefixCache(max_bytes=2 * entry_bytes, block_size=8)
+
+    a = list(range(40))
+    pc.store(a, _cache(40))
+    # shares the first 20 tokens -> two full blocks reusable
+    matched, past = pc.lookup(a[:20] + [99] * 10)
+    assert matched == 16 and past.get_seq_length() == 16
+    # always leaves at least one token to prefill
+    assert pc.lookup(a)[0] == 32
+    assert pc.lookup([7] * 40) == (0, None)
+
+    pc.store([1000 + i for i in range(40)], _cache(40))
+    pc.store([2000 + i for i in range(40)], _cache(40))  # evicts `a` (least recent)
+    assert pc.lookup(a[:20] + [99])[0] == 0
+    stats = pc.stats()
+    assert stats["entries"] == 2 and stats["bytes"] <= stats["max_bytes"]
+    assert stats["hits"] == 2 and stats["misses"] == 2
+
+
+def test_prefix_reuse_matches_full_prefill(tiny_model_dir):
+    system = "You are a helpful assistant. " * 6
+    plain = Client(backend="hflocal", model=tiny_model_dir)
+    cached = Client(backend="hflocal", model=tiny_model_dir, prefix_cache_max_bytes=1 << 20)
+    for question in ["Hello world", "How are you?"]:
+        expected = plain.text_generation(system + question, max_new_tokens=6, do_sample=False)
+        assert cached.text_generation(system + question, max_new_tokens=6,
+                                      do_sample=False) == expected
+    assert cached._backend.prefix_cache.stats()["hits"] == 1
+
+
+def test_caller_generate_kwargs_do_not_collide(tiny_model_dir):
+    plain = Client(backend="hflocal", model=tiny_model_dir)
+    cached = Client(backend="hflocal", model=tiny_model_dir, prefix_cache_max_bytes=1 << 20)
+    expected = plain.text_generation("Hello world", max_new_tokens=4, do_sample=False)
+    for client in (plain, cached):
+        assert client.text_generation("Hello world", max_new_tokens=4, do_sample=False,
+                                      return_dict_in_generate=True) == expected
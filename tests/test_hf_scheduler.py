@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from mlhq import Client
+
+PROMPTS = [
+    "Hello world", "The quick brown fox jumps over the lazy dog.", "How are you?", "Hello",
+] * 3
+
+
+def test_continuous_batching_matches_generate(tiny_model_dir):
+    plain = Client(backend="hflocal", model=tiny_model_dir)
+    expected = [plain.text_generation(p, max_new_tokens=10, do_sample=False) for p in PROMPTS]
+
+    with Client(backend="hflocal", model=tiny_model_dir, continuous_batching=True,
+                max_batch_size=4) as client:
+        with ThreadPoolExecutor(6) as pool:
+            got = list(pool.map(
+                lambda p: client.text_generation(p, max_new_tokens=10, do_sample=False), PROMPTS
+            ))
+        stats = client._backend._inner._scheduler.stats()
+
+    assert got == expected
+    # concurrent callers shared forward passes
+    assert stats["avg_batch"] > 1
+
+
+def test_continuous_batching_stream_and_stop(tiny_model_dir):
+    with Client(backend="hflocal", model=tiny_model_dir, continuous_batching=True) as client:
+        full = client.text_generation("Hello world", max_new_tokens=10, do_sample=False)
+        stream = client.text_generation("Hello world", stream=True, max_new_tokens=10,
+                                        do_sample=False)
+        assert "".join(c.text for c in stream) == full
+
+        stop = full[3:5]
+        cut = client.text_generation("Hello world", max_new_tokens=10, do_sample=False, stop=stop)
+        assert cut == full[:full.index(stop)]
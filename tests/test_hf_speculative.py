@@ -0,0 +1,69 @@
+import pytest
+
+from mlhq import Client
+
+PROMPTS = ["Hello world", "The quick brown fox", '{"name": "mlhq"']
+
+
+@pytest.fixture(scope="module")
+def clients(tiny_model_dir, tiny_draft_dir):
+    base = Client(backend="hflocal", model=tiny_model_dir)
+    spec = Client(backend="hflocal", model=tiny_model_dir, draft_model=tiny_draft_dir,
+                  draft_tokens=4)
+    yield base, spec
+    base.close()
+    spec.close()
+
+
+def test_matches_greedy_target(clients):
+    base, spec = clients
+    expected = base.text_generation(PROMPTS, max_new_tokens=12, do_sample=False)
+    got = spec.text_generation(PROMPTS, max_new_tokens=12, do_sample=False, details=True)
+    assert [r.text for r in got] == expected
+    for r in got:
+        stats = r.speculative
+        assert 0 <= stats["accepted_tokens"] <= stats["draft_tokens"]
+        assert 0.0 <= stats["acceptance_rate"] <= 1.0
+        # every verification round yields at least one token
+        assert stats["target_forwards"] <= r.usage["completion_tokens"]
+
+
+def test_stream_reports_acceptance(clients):
+    base, spec = clients
+    expected = base.text_generation(PROMPTS[0], max_new_tokens=12, do_sample=False)
+    chunks = list(spec.text_generation(PROMPTS[0], max_new_tokens=12, do_sample=False,
+                                       stream=True))
+    assert "".join(c.text for c in chunks) == expected
+    assert "acceptance_rate" in chunks[-1].raw["speculative"]
+
+
+def test_vocabularies_compared_once(clients, monkeypatch):
+    _, spec = clients
+    inner = spec._backend._inner
+    assert inner._draft_vocab_match
+    # get_vocab() builds a dict of the whole vocabulary: not on the request path
+    monkeypatch.setattr(type(inner.tokenizer), "get_vocab",
+                        lambda self: pytest.fail("get_vocab() called per request"))
+    spec.text_generation(PROMPTS[0], max_new_tokens=4, do_sample=False)
+
+
+def test_draft_tokens_is_per_client(clients, tiny_model_dir, tiny_draft_dir):
+    _, spec = clients
+    one = Client(backend="hflocal", model=tiny_model_dir, draft_model=tiny_draft_dir,
+                 draft_tokens=1)
+    inner, shared = one._backend._inner, spec._backend._inner
+    assert inner._draft is shared._draft  # one draft model, loaded once
+    r = one.text_generation(PROMPTS[1], max_new_tokens=12, do_sample=False, details=True)
+    one.close()
+    # one drafted token (one draft forward) per verification round
+    assert r.speculative["draft_tokens"] <= r.speculative["target_forwards"]
+    assert shared._assistant.generation_config.num_assistant_tokens == 4
+    assert shared._draft.model.generation_config.num_assistant_tokens == 20
+
+
+def test_rejects_bad_draft_config(tiny_model_dir, tiny_draft_dir):
+    with pytest.raises(ValueError):
+        Client(backend="hflocal", model=tiny_model_dir, draft_model=tiny_model_dir)
+    with pytest.raises(ValueError):
+        Client(backend="hflocal", model=tiny_model_dir, draft_model=tiny_draft_dir,
+               continuous_batching=True)
@@ -0,0 +1,71 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mlhq import AsyncClient, Client
+from mlhq.bench import run_bench
+from mlhq.stub_server import StubServer
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _chat(client):
+    return client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2)
+
+
+@pytest.fixture(scope="module")
+def stub():
+    with StubServer(latency=0.05, tokens_per_s=0) as server:
+        yield server
+
+
+def test_clients_share_one_pool(stub):
+    a = Client(base_url=stub.url, http_max_connections=7)
+    b = Client(base_url=stub.url, http_max_connections=7)
+    other = Client(base_url=stub.url, http_max_connections=8)
+    assert a.http_pool is b.http_pool and other.http_pool is not a.http_pool
+    _chat(a)
+    a.close()
+    _chat(b)  # still open for the remaining user
+    stats = b.http_pool.stats()
+    assert stats["requests"] == 2 and stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 1
+    b.close()
+    assert b.http_pool.client.is_closed
+    other.close()
+
+
+def test_pool_limits_and_wait_stats(stub):
+    client = Client(base_url=stub.url, http_max_connections=2, http_shared=False)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: _chat(client), range(16)))
+    stats = client.http_pool.stats()
+    client.close()
+    assert stats["requests"] == 16 and stats["errors"] == 0
+    assert stats["in_use"] == stats["waiting"] == 0
+    assert stats["peak_in_use"] == 2 and stats["peak_utilization"] == 1.0
+    assert stats["connections_opened"] == 2 and stats["connections_reused"] == 14
+    # six callers queue behind two connections held for ~50ms each
+    assert stats["pool_wait_s"]["p95"] > 0.03
+
+
+def test_bench_reports_pool(stub):
+    client = Client(base_url=stub.url, http_max_connections=4, http_shared=False)
+    report = run_bench(client, model="stub", max_tokens=2, stream=False, concurrency=4,
+                       requests=8)
+    client.close()
+    assert report["http_pool"]["requests"] == 8
+    assert report["http_pool"]["peak_in_use"] <= 4
+
+
+def test_async_pool(stub):
+    async def main():
+        async with AsyncClient(base_url=stub.url, http_max_connections=3) as client:
+            await asyncio.gather(*(client.chat.completions.create(
+                model="stub", messages=MESSAGES, max_tokens=2) for _ in range(6)))
+            return client.http_pool.stats()
+
+    stats = asyncio.run(main())
+    assert stats["requests"] == 6 and stats["peak_in_use"] == 3
+    assert stats["connections_opened"] == 3
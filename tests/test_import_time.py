@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+# Budget for a cold `import mlhq` in a fresh interpreter. Generous enough for
+# slow CI boxes, but far below what importing torch/transformers costs.
+IMPORT_BUDGET_S = 1.0
+
+
+def _run(code):
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return out.stdout.strip()
+
+
+def test_import_does_not_load_heavy_deps():
+    loaded = _run(
+        "import sys, mlhq; "
+        "print(','.join(m for m in ('torch', 'transformers', 'openai') if m in sys.modules))"
+    )
+    assert loaded == ""
+
+
+def test_import_time_budget():
+    elapsed = float(_run(
+        "import time; t = time.perf_counter(); import mlhq; print(time.perf_counter() - t)"
+    ))
+    assert elapsed < IMPORT_BUDGET_S, f"import mlhq took {elapsed:.3f}s"
+
+
+def test_openai_backend_imported_on_selection():
+    loaded = _run(
+        "import sys, mlhq; mlhq.Client(backend='openai'); "
+        "print('openai' in sys.modules, 'torch' in sys.modules)"
+    )
+    assert loaded == "True False"
@@ -0,0 +1,70 @@
+import io
+import json
+import logging
+import time
+
+import pytest
+
+from mlhq import Client
+from mlhq.bench import _SlowSink
+from mlhq.logging_config import get_logger, setup_logging, shutdown_logging
+from mlhq.stub_server import StubServer
+
+logger = get_logger("test_logging")
+
+
+@pytest.fixture(autouse=True)
+def restore_logging():
+    root = logging.getLogger("mlhq")
+    saved = (root.level, list(root.handlers), root.propagate)
+    yield
+    shutdown_logging()
+    root.setLevel(saved[0])
+    root.handlers[:] = saved[1]
+    root.propagate = saved[2]
+
+
+def test_json_lines_carry_request_id_and_timings():
+    out = io.StringIO()
+    setup_logging("DEBUG", json_lines=True, stream=out)
+    with StubServer(latency=0.0, tokens_per_s=10000) as stub:
+        client = Client(backend="openai", base_url=stub.url)
+        for _ in range(2):
+            client.chat.completions.create(model="stub", max_tokens=4,
+                                           messages=[{"role": "user", "content": "hi"}])
+    shutdown_logging()  # drain the queue
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    done = [r for r in records if "timings" in r]
+    assert len(done) == 2
+    assert done[0]["request_id"] != done[1]["request_id"]
+    assert done[0]["method"] == "chat.completions" and done[0]["status"] == "ok"
+    assert done[0]["timings"]["network"] > 0 and done[0]["usage"]["completion_tokens"] == 4
+
+
+def test_sampling_keeps_info():
+    out = io.StringIO()
+    setup_logging("DEBUG", stream=out, sample={"mlhq.test_logging": 0.1})
+    for i in range(1000):
+        logger.debug("event %d", i)
+    logger.info("always")
+    shutdown_logging()
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 101 and lines[-1].endswith("always")
+
+
+def test_slow_sink_does_not_block_callers():
+    sink = _SlowSink(0.05)
+    handler = setup_logging("INFO", stream=sink, max_queue=5)
+    start = time.perf_counter()
+    for i in range(20):
+        logger.info("event %d", i)
+    assert time.perf_counter() - start < 0.5  # a synchronous handler would take 1s
+    shutdown_logging()
+    assert sink.lines + handler.dropped == 20 and handler.dropped > 0
+
+    out = io.StringIO()
+    setup_logging("INFO", stream=out, background=False)
+    items = ["a"]
+    logger.info("items %s", items)
+    items.append("b")  # arguments are rendered when the call is made
+    assert out.getvalue().rstrip().endswith("items ['a']")
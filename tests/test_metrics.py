@@ -0,0 +1,81 @@
+import pytest
+
+from mlhq import Client, MLHQResponse
+from mlhq.metrics import Metrics
+from mlhq.stub_server import StubServer
+
+HF_PHASES = {"dispatch", "tokenize", "prefill", "decode", "detokenize", "total"}
+
+
+def test_prometheus_export():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    event = {"method": "chat.completions", "backend": "openai", "model": "m",
+             "timings": {"network": 0.5, "dispatch": 0.01, "total": 0.51},
+             "usage": {"prompt_tokens": 3, "completion_tokens": 7}}
+    metrics.observe(event)
+    metrics.observe({**event, "status": "error", "usage": {}})
+    text = metrics.to_prometheus()
+
+    labels = 'backend="openai",model="m",method="chat.completions"'
+    assert f'mlhq_requests_total{{{labels},status="ok"}} 1' in text
+    assert f'mlhq_requests_total{{{labels},status="error"}} 1' in text
+    assert f'mlhq_tokens_total{{{labels},kind="completion"}} 7' in text
+    assert f'mlhq_phase_duration_seconds_bucket{{{labels},phase="network",le="0.1"}} 0' in text
+    assert f'mlhq_phase_duration_seconds_bucket{{{labels},phase="network",le="1"}} 2' in text
+    assert f'mlhq_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"mlhq_request_duration_seconds_count{{{labels}}} 2" in text
+
+
+def test_hflocal_details_carry_phase_timings(tiny_model_dir):
+    events = []
+    client = Client(backend="hflocal", model=tiny_model_dir, metrics_callback=events.append)
+    resp = client.text_generation("Hello world", max_new_tokens=6, do_sample=False, details=True)
+
+    assert isinstance(resp, MLHQResponse)
+    assert resp.text == client.text_generation("Hello world", max_new_tokens=6, do_sample=False)
+    assert HF_PHASES <= set(resp.timings)
+    parts = sum(v for k, v in resp.timings.items() if k != "total")
+    assert parts == pytest.approx(resp.timings["total"], rel=1e-6, abs=1e-9)
+
+    assert [e["method"] for e in events] == ["text_generation"] * 2
+    assert events[0]["usage"]["completion_tokens"] == resp.usage["completion_tokens"]
+    assert 'method="text_generation",status="ok"} 2' in client.metrics.to_prometheus()
+
+
+def test_hflocal_stream_timings(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    stream = client.chat.completions.create(
+        messages=[{"role": "user", "content": "Hi"}], max_tokens=6, temperature=0, stream=True
+    )
+    final = stream.get_final_response()
+    assert HF_PHASES <= set(final.timings)
+    if final.text:
+        assert 0 < final.timings["ttft"] <= final.timings["total"]
+
+
+def test_continuous_batching_reports_queue(tiny_model_dir):
+    with Client(backend="hflocal", model=tiny_model_dir, continuous_batching=True) as client:
+        resp = client.chat.completions.create(
+            messages=[{"role": "user", "content": "Hi"}], max_tokens=4, temperature=0
+        )
+    assert {"queue", "prefill", "decode"} <= set(resp.timings)
+
+
+def test_openai_network_phase():
+    with StubServer(latency=0.05, tokens_per_s=0) as stub:
+        client = Client(backend="openai", base_url=stub.url)
+        resp = client.chat.completions.create(
+            model="stub", messages=[{"role": "user", "content": "hi"}], max_tokens=4
+        )
+    assert resp.timings["network"] >= 0.05
+    assert resp.timings["network"] <= resp.timings["total"]
+    snap = client.metrics.snapshot()
+    assert sum(snap["counters"]["mlhq_requests_total"].values()) == 1
+
+
+def test_metrics_disabled(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir, metrics=False)
+    resp = client.chat.completions.create(messages=[{"role": "user", "content": "Hi"}],
+                                          max_tokens=2)
+    assert client.metrics is None
+    assert resp.timings is None
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mlhq import AsyncClient, Client, MLHQResponse
+from mlhq.ratelimit import RequestPolicy, TokenBucket, estimate_tokens, is_retryable
+from mlhq.stub_server import StubServer
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_token_bucket_queues_in_order():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.02)
+    assert not bucket.try_reserve()
+    bucket.refund(5)
+    assert bucket.try_reserve()
+
+
+def test_estimate_tokens():
+    assert estimate_tokens((), {"messages": [{"content": "x" * 400}], "max_tokens": 10}) > 100
+    assert estimate_tokens(("abcd" * 10,), {"max_new_tokens": 5}) == 15
+
+
+def test_rpm_limit_spaces_requests():
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url,
+                        rate_limits={"stub": {"rpm": 600, "burst_s": 0.1}})  # 10/s, burst 1
+        start = time.perf_counter()
+        for _ in range(4):
+            resp = client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2)
+        elapsed = time.perf_counter() - start
+    assert elapsed >= 0.28
+    assert resp.timings["throttle"] > 0
+
+
+def test_retries_429_with_retry_after():
+    with StubServer(latency=0.0, tokens_per_s=0, fail_rate=0.5, fail_status=429) as stub:
+        client = Client(base_url=stub.url, max_retries=10)
+        for _ in range(8):
+            client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2)
+        assert stub.requests > 8
+    assert client.policy.retries == stub.requests - 8
+
+
+def test_non_retryable_errors_raise_immediately():
+    calls = []
+
+    def boom(**kwargs):
+        calls.append(kwargs)
+        raise ValueError("bad request")
+
+    policy = RequestPolicy(max_retries=5)
+    with pytest.raises(ValueError):
+        policy.call("chat.completions", None, boom, (), {})
+    assert len(calls) == 1
+    assert not is_retryable(ValueError())
+    assert is_retryable(ConnectionError())
+
+
+def test_failed_and_hedged_attempts_settle_tokens():
+    def used(n):
+        return MLHQResponse(text="ok", raw=None, usage={"total_tokens": n})
+
+    # 1 token/s refill, so the balance barely moves while the test runs
+    limits = {"*": {"tpm": 60, "burst_s": 1000}}
+    policy = RequestPolicy(rate_limits=limits, max_retries=3, retry_base_delay=0)
+    bucket = policy.limiter._bucket("m", "tpm")
+    failures = [ConnectionError(), ConnectionError()]
+
+    def flaky(**kwargs):
+        if failures:
+            raise failures.pop()
+        return used(10)
+
+    policy.call("chat.completions", "m", flaky, (), {"max_tokens": 100})
+    # the two failed attempts gave their 100-token estimates back
+    assert bucket.available == pytest.approx(bucket.capacity - 10, abs=1)
+
+    policy = RequestPolicy(rate_limits=limits, hedge_percentile=50, hedge_min_samples=1)
+    policy._observe_latency("chat.completions", 0.05)
+    bucket = policy.limiter._bucket("m", "tpm")
+
+    def slow(**kwargs):
+        time.sleep(0.2)
+        return used(10)
+
+    policy.call("chat.completions", "m", slow, (), {"max_tokens": 100})
+    time.sleep(0.3)  # both copies have finished and settled
+    assert policy.hedges == 1
+    assert bucket.available == pytest.approx(bucket.capacity - 20, abs=1)
+
+
+def test_hedging_cuts_the_tail():
+    with StubServer(latency=0.05, tokens_per_s=0, slow_rate=0.3, slow_latency=2.0) as stub:
+        client = Client(base_url=stub.url, hedge_percentile=50, hedge_min_samples=5)
+        worst = 0.0
+        for i in range(30):
+            start = time.perf_counter()
+            client.chat.completions.create(model="stub", messages=MESSAGES, max_tokens=2)
+            if i >= 5:  # hedging needs 5 samples first
+                worst = max(worst, time.perf_counter() - start)
+        stats = client.policy.stats()
+        client.close()
+    assert stats["hedges"] > 0
+    assert stats["hedge_wins"] > 0
+    assert worst < 1.5
+
+
+def test_async_hedging():
+    async def main(url):
+        async with AsyncClient(base_url=url, hedge_percentile=50, hedge_min_samples=5) as client:
+            for _ in range(30):
+                await client.chat.completions.create(model="stub", messages=MESSAGES,
+                                                     max_tokens=2)
+            return client.policy.stats()
+
+    with StubServer(latency=0.05, tokens_per_s=0, slow_rate=0.3, slow_latency=2.0) as stub:
+        stats = asyncio.run(main(stub.url))
+    assert stats["hedge_wins"] > 0
+
+
+def test_hedging_does_not_cap_concurrency():
+    policy = RequestPolicy(hedge_percentile=50, hedge_min_samples=1)
+    policy._observe_latency("chat.completions", 1.0)
+    lock, active, peak = threading.Lock(), [0], [0]
+
+    def call():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.2)
+        with lock:
+            active[0] -= 1
+        return "ok"
+
+    with ThreadPoolExecutor(16) as pool:
+        futures = [pool.submit(policy.call, "chat.completions", None, call, (), {})
+                   for _ in range(16)]
+        assert [f.result() for f in futures] == ["ok"] * 16
+    assert peak[0] == 16 and policy.hedges == 0
+
+
+def test_local_backend_has_no_policy(tiny_model_dir):
+    with Client(backend="hflocal", model=tiny_model_dir, max_retries=5,
+                hedge_percentile=50) as client:
+        assert client.policy is None
+        assert client.text_generation("Hello", max_new_tokens=2)
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from mlhq import Client, MLHQResponse, MLHQStream, MLHQStreamChunk
+from mlhq.server import ModelServer
+
+MESSAGES = [{"role": "user", "content": "Hello world! How are you today?"}]
+
+
+@pytest.fixture(scope="module")
+def served(tiny_model_dir):
+    local = Client(backend="hflocal", model=tiny_model_dir)
+    server = ModelServer(local, model_name="tiny").start()
+    yield local, server
+    server.stop()
+    local.close()
+
+
+def test_openai_client_against_server(served):
+    local, server = served
+    expected = local.chat.completions.create(messages=MESSAGES, max_tokens=8, temperature=0)
+    remote = Client(base_url=server.url, api_key="-")
+    resp = remote.chat.completions.create(model="tiny", messages=MESSAGES, max_tokens=8,
+                                          temperature=0)
+    assert resp.text == expected.text
+    assert resp.usage["completion_tokens"] == expected.usage["completion_tokens"]
+
+    stream = remote.chat.completions.create(model="tiny", messages=MESSAGES, max_tokens=8,
+                                            temperature=0, stream=True,
+                                            stream_options={"include_usage": True})
+    assert "".join(c.text for c in stream) == expected.text
+    assert stream.response.usage["completion_tokens"] == expected.usage["completion_tokens"]
+
+    out = remote.responses.create(model="tiny", input=MESSAGES[0]["content"],
+                                  max_output_tokens=8, temperature=0)
+    assert out.text == expected.text
+    remote.close()
+
+
+def test_completions_and_stats(served):
+    local, server = served
+    prompts = ["Hello world", "The quick brown fox"]
+    expected = local.text_generation(prompts, max_new_tokens=6, do_sample=False)
+    body = {"model": "tiny", "prompt": prompts, "max_tokens": 6, "temperature": 0}
+    data = httpx.post(f"{server.url}/completions", json=body).json()
+    assert [c["text"] for c in data["choices"]] == expected
+
+    with httpx.stream("POST", f"{server.url}/completions",
+                      json={**body, "prompt": prompts[0], "stream": True}) as r:
+        lines = [line for line in r.iter_lines() if line.startswith("data: ")]
+    assert lines[-1] == "data: [DONE]"
+
+    assert httpx.post(f"{server.url}/chat/completions", json={"model": "tiny"}).status_code == 400
+    base = server.url.rsplit("/v1", 1)[0]
+    stats = httpx.get(f"{base}/stats").json()
+    assert stats["completed"] >= 2 and stats["queue_depth"] == 0
+    assert stats["completion_tokens"] >= 12 and stats["tokens_per_s"] > 0
+    assert "mlhq_server_queue_depth 0" in httpx.get(f"{base}/metrics").text
+
+
+class _BlockingClient:
+    """Stand-in for an hflocal Client whose generate calls wait for `release`."""
+
+    def __init__(self):
+        self.config = SimpleNamespace(model="fake")
+        self.metrics = None
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+    def chat_completion_batch(self, conversations, **kwargs):
+        self.started.set()
+        self.release.wait(10)
+        self.batches.append(len(conversations))
+        return [MLHQResponse(text="ok", raw=None, finish_reason="stop",
+                             usage={"prompt_tokens": 1, "completion_tokens": 1})
+                for _ in conversations]
+
+
+def test_backpressure_and_batching():
+    fake = _BlockingClient()
+    with ModelServer(fake, max_queue=3, max_batch=8) as server, \
+            ThreadPoolExecutor(8) as pool:
+        def post():
+            return httpx.post(f"{server.url}/chat/completions", timeout=10,
+                              json={"model": "fake", "messages": MESSAGES, "max_tokens": 4})
+
+        first = pool.submit(post)
+        assert fake.started.wait(5)  # the worker is busy with the first request
+        queued = [pool.submit(post) for _ in range(3)]
+        while server.stats()["queue_depth"] < 3:
+            threading.Event().wait(0.01)
+        rejected = post()
+        assert rejected.status_code == 429
+        assert int(rejected.headers["retry-after-ms"]) > 0
+        fake.release.set()
+        assert all(f.result().status_code == 200 for f in [first, *queued])
+        stats = server.stats()
+    # the three queued requests shared one batched call
+    assert fake.batches == [1, 3]
+    assert stats["rejected"] == 1 and stats["completed"] == 4
+
+
+class _EndlessClient:
+    """Stand-in for a Client whose streams run until they are closed."""
+
+    def __init__(self):
+        self.config = SimpleNamespace(model="fake")
+        self.metrics = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.closed = threading.Event()
+
+    def create(self, messages, stream=False, **kwargs):
+        stop = threading.Event()
+
+        def chunks():
+            while not stop.is_set():
+                yield MLHQStreamChunk(text="x")
+                time.sleep(0.01)
+
+        def close():
+            stop.set()
+            self.closed.set()
+
+        return MLHQStream(chunks(), on_close=close)
+
+
+def test_disconnect_stops_stream():
+    fake = _EndlessClient()
+    with ModelServer(fake) as server:
+        with httpx.stream("POST", f"{server.url}/chat/completions", timeout=10,
+                          json={"model": "fake", "messages": MESSAGES, "stream": True}) as r:
+            next(line for line in r.iter_lines() if line.startswith("data: "))
+        # the generation is stopped before the worker slot is given back
+        assert fake.closed.wait(5)
+        deadline = time.monotonic() + 5
+        while server.stats()["running"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.stats()["running"] == 0
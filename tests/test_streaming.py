@@ -0,0 +1,90 @@
+import asyncio
+import gc
+import threading
+
+from mlhq import AsyncClient, Client, MLHQResponse, MLHQStream
+from mlhq.backends.openai_backend import _stream_kwargs
+from mlhq.stub_server import StubServer
+
+
+def test_text_generation_stream_matches_blocking(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    expected = client.text_generation("Hello world", max_new_tokens=8, do_sample=False)
+
+    stream = client.text_generation("Hello world", stream=True, max_new_tokens=8, do_sample=False)
+    assert isinstance(stream, MLHQStream)
+    deltas = [chunk.text for chunk in stream]
+    assert "".join(deltas) == expected
+
+    final = stream.response
+    assert isinstance(final, MLHQResponse)
+    assert final.text == expected
+    assert final.finish_reason in ("stop", "length")
+    assert final.usage["completion_tokens"] <= 8
+    assert final.usage["prompt_tokens"] > 0
+
+
+def test_chat_completions_stream(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    messages = [{"role": "user", "content": "Hello"}]
+    blocking = client.chat.completions.create(messages=messages, max_tokens=6, temperature=0)
+    stream = client.chat.completions.create(
+        messages=messages, max_tokens=6, temperature=0, stream=True
+    )
+    final = stream.get_final_response()
+    assert final.text == blocking.text == blocking.choices[0].message.content
+    assert final.usage == blocking.usage
+
+
+def test_async_chat_stream(tiny_model_dir):
+    async def main():
+        async with AsyncClient(backend="hflocal", model=tiny_model_dir) as client:
+            stream = await client.chat.completions.create(
+                messages=[{"role": "user", "content": "Hi"}], max_tokens=5, stream=True
+            )
+            parts = [chunk.text async for chunk in stream]
+            return "".join(parts), stream.response
+
+    text, final = asyncio.run(main())
+    assert final.text == text
+    assert final.usage["completion_tokens"] <= 5
+
+
+def test_openai_stream_options():
+    with StubServer(latency=0.0, tokens_per_s=0) as stub:
+        client = Client(base_url=stub.url)
+        create = lambda **kw: client.chat.completions.create(  # noqa: E731
+            model="stub", messages=[{"role": "user", "content": "Hi"}], max_tokens=4,
+            stream=True, **kw).get_final_response()
+        assert create().usage["completion_tokens"] == 4
+        # the caller's choice wins; None leaves the field out entirely
+        assert create(stream_options={"include_usage": False}).usage is None
+        assert create(stream_options=None).usage is None
+    assert "stream_options" not in _stream_kwargs({"stream": True, "stream_options": None})
+
+
+def _generating():
+    return any(t.name == "mlhq-hflocal-stream" for t in threading.enumerate())
+
+
+def test_abandoned_stream_stops_generation(tiny_model_dir):
+    kwargs = dict(stream=True, max_new_tokens=400, min_new_tokens=400, do_sample=False)
+    with Client(backend="hflocal", model=tiny_model_dir, kv_memory_budget=1 << 30) as client:
+        stream = client.text_generation("Hello world", **kwargs)
+        next(iter(stream))
+        stream.close()
+        # generate() has stopped and given its memory back once close() returns
+        assert not _generating() and client.memory_budget.stats()["reserved_bytes"] == 0
+
+        it = iter(client.text_generation("Hello world", **kwargs))
+        next(it)
+        del it
+        gc.collect()
+        assert not _generating() and client.memory_budget.stats()["reserved_bytes"] == 0
+
+    with Client(backend="hflocal", model=tiny_model_dir, continuous_batching=True,
+                kv_memory_budget=1 << 30) as client:
+        stream = client.text_generation("Hello world", stream=True, max_new_tokens=400)
+        next(iter(stream))
+        stream.close()
+        assert client.memory_budget.stats()["reserved_bytes"] == 0
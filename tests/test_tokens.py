@@ -0,0 +1,66 @@
+import pytest
+
+from mlhq import Client
+from mlhq.tokens import TiktokenTokenizer, TokenCounter
+
+MESSAGES = [{"role": "system", "content": "Be brief."},
+            {"role": "user", "content": "Hello world! How are you today?"}]
+
+
+class _WordEncoding:
+    """tiktoken stand-in: one token per whitespace-separated word."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode_ordinary_batch(self, texts):
+        self.batches.append(list(texts))
+        return [list(range(len(t.split()))) for t in texts]
+
+
+def test_counts_match_what_hflocal_sends(tiny_model_dir):
+    client = Client(backend="hflocal", model=tiny_model_dir)
+    try:
+        tok = client._backend.tokenizer
+        texts = ["Hello world", "The quick brown fox jumps over the lazy dog."]
+        assert client.tokens.count(texts) == [len(tok(t)["input_ids"]) for t in texts]
+        assert client.tokens.encode(texts[0]) == tok(texts[0])["input_ids"]
+
+        n = client.tokens.count(messages=MESSAGES)
+        assert client.tokens.encode(messages=MESSAGES) == tok.apply_chat_template(
+            MESSAGES, add_generation_prompt=True, tokenize=True)
+        resp = client.chat.completions.create(messages=MESSAGES, max_tokens=2)
+        assert resp.usage["prompt_tokens"] == n
+        assert client.tokens.count(messages=[MESSAGES, MESSAGES[1:]])[0] == n
+    finally:
+        client.close()
+
+
+def test_memoized_by_content():
+    encoding = _WordEncoding()
+    counter = TokenCounter(TiktokenTokenizer(encoding))
+    assert counter.count(["a b", "c", "a b"]) == [2, 1, 2]
+    assert encoding.batches == [["a b", "c"]]  # duplicates tokenized once
+    assert counter.count(["c", "d e f"]) == [1, 3]
+    assert encoding.batches[-1] == ["d e f"]  # only the miss
+    assert counter.count("a b") == 2
+    assert counter.stats()["hits"] == 2
+
+
+def test_openai_chat_accounting():
+    counter = TokenCounter(TiktokenTokenizer(_WordEncoding()))
+    # 3 per message + content words + 1 for a name + 3 reply priming
+    messages = [{"role": "user", "content": "one two", "name": "bob"}]
+    assert counter.count(messages=messages) == 3 + (1 + 2 + 1) + 1 + 3
+    with pytest.raises(ValueError):
+        counter.encode(messages=messages)
+
+
+def test_openai_backend_uses_tiktoken():
+    tiktoken = pytest.importorskip("tiktoken")
+    client = Client(backend="openai", model="gpt-4o-mini", api_key="x")
+    try:
+        enc = tiktoken.encoding_for_model("gpt-4o-mini")
+        assert client.tokens.count("Hello world") == len(enc.encode_ordinary("Hello world"))
+    finally:
+        client.close()